@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark of client overhead of put, take and ack: requests go to a
+connection stub, so only the time spent in Python is measured.
+
+    $ PYTHONPATH=. python benchmarks/bench_calls.py
+"""
+import timeit
+
+from tarantool_queue import Queue
+
+
+class Response(list):
+    rowcount = 1
+    return_code = 0
+
+
+class NullConnection(object):
+    """
+    Connection, that answers every call with the same task.
+    """
+    row = Response([('id', 'tube', 'r', b'\x01')])
+
+    def __init__(self, host, port, schema=None):
+        pass
+
+    def call(self, method, args):
+        return self.row
+
+
+def main(number=100000):
+    queue = Queue("localhost", 33013, 0)
+    queue.tarantool_connection = NullConnection
+    tube = queue.tube("tube", ttl=60, ttr=30)
+    cases = [
+        ("put", lambda: tube.put(1)),
+        ("put with options", lambda: tube.put(1, pri=1)),
+        ("urgent", lambda: tube.urgent(1)),
+        ("take", lambda: queue._take_task("tube", 0)),
+        ("ack", lambda: queue._ack("id")),
+    ]
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=number, repeat=3))
+        print("%-20s %8.2f us/call" % (name, best / number * 1e6))
+
+
+if __name__ == "__main__":
+    main()
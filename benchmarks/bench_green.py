@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of cooperative mode: thousands of greenlet consumers with
+long-poll takes in one process. Every consumer takes on its own
+connection, puts run on `--connections` shared connections. Needs gevent
+and a queue server.
+
+    $ PYTHONPATH=. python benchmarks/bench_green.py --consumers 5000
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import time
+import argparse
+
+import gevent
+
+from tarantool_queue import Queue, cooperative
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=33013)
+    parser.add_argument('--space', type=int, default=0)
+    parser.add_argument('--consumers', type=int, default=2000)
+    parser.add_argument('--connections', type=int, default=64)
+    parser.add_argument('--tasks', type=int, default=100000)
+    args = parser.parse_args()
+
+    queue = cooperative(Queue(args.host, args.port, args.space),
+                        size=args.connections)
+    tube = queue.tube('bench.green')
+    done = []
+
+    def consume():
+        while len(done) < args.tasks:
+            task = tube.take(1)
+            if task is not None:
+                task.ack()
+                done.append(1)
+
+    consumers = [gevent.spawn(consume) for _ in range(args.consumers)]
+    # all consumers wait in long-poll now
+    gevent.sleep(1)
+    start = time.time()
+    for i in range(args.tasks):
+        tube.put(i)
+    gevent.joinall(consumers)
+    elapsed = time.time() - start
+    print("%d consumers, %d connections: %d tasks in %.2fs, %.0f tasks/s"
+          % (args.consumers, args.connections, args.tasks, elapsed,
+             args.tasks / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,5 +2,25 @@ __version__ = "0.1.4"
 
 from .tarantool_queue import Queue
 from .tarantool_tqueue import TQueue
+from .tarantool_nqueue import NQueue
+from .multispace import MultiQueue
+from .green import ConnectionPool, cooperative
+from .producer import AsyncProducer, AdmissionController, DedupFilter
+from .producer import CoalescingProducer
+from .spool import Spool
+from .monitoring import LatencyMonitor
+from .tracing import Tracer
+from .retry import RetryPolicy
+from .maintenance import DeadLetters
+from .transfer import export_tube, import_tube
+from .blobstore import FileBlobStore, SpaceBlobStore
+from .pipeline import Pipeline, Stage
+from .rpc import RpcClient, RpcServer, RemoteException, reply
+from .consumer import AdaptiveTake, Consumer
 
-__all__ = [Queue, TQueue, __version__]
+__all__ = [Queue, TQueue, NQueue, MultiQueue, ConnectionPool, cooperative,
+           AsyncProducer, AdmissionController, DedupFilter,
+           CoalescingProducer, Spool, LatencyMonitor, Tracer, RetryPolicy,
+           DeadLetters, export_tube, import_tube, FileBlobStore,
+           SpaceBlobStore, Pipeline, Stage, RpcClient, RpcServer,
+           RemoteException, reply, AdaptiveTake, Consumer, __version__]
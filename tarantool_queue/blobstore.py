@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import uuid
+
+# 0xc1 is never used by msgpack, so references are not mistaken for
+# plain payloads
+REFERENCE_MAGIC = b'\xc1TQB'
+
+
+def make_reference(key):
+    return REFERENCE_MAGIC + key.encode('ascii')
+
+
+def parse_reference(raw_data):
+    """
+    Return key of blob if payload is a reference to blob, else None.
+    """
+    if raw_data[:4] != REFERENCE_MAGIC:
+        return None
+    return raw_data[4:].decode('ascii')
+
+
+def new_key():
+    return uuid.uuid4().hex
+
+
+class FileBlobStore(object):
+    """
+    Blob store in directory of local (or shared) filesystem.
+
+    :param path: directory for blobs
+    :type path: string
+    """
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _path(self, key):
+        return os.path.join(self.path, key)
+
+    def put(self, key, value):
+        tmp = self._path(key) + '.tmp'
+        with open(tmp, 'wb') as fp:
+            fp.write(value)
+        os.rename(tmp, self._path(key))
+
+    def get(self, key):
+        with open(self._path(key), 'rb') as fp:
+            return fp.read()
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+    def expire(self, max_age):
+        """
+        Delete blobs older than `max_age` seconds, e.g. blobs of tasks
+        expired by ttl. Call it periodically with `max_age` greater than
+        ttl of the tubes.
+
+        :rtype: int - number of deleted blobs
+        """
+        deadline = time.time() - max_age
+        deleted = 0
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            try:
+                if os.path.getmtime(path) < deadline:
+                    os.unlink(path)
+                    deleted += 1
+            except OSError:
+                pass
+        return deleted
+
+
+class SpaceBlobStore(object):
+    """
+    Blob store in Tarantool space with tuples ``(key, value)`` and STR
+    primary key. It uses the connection of queue.
+
+    :param queue: `Queue` instance
+    :param space: number of space for blobs
+    :type space: int
+    """
+    def __init__(self, queue, space):
+        self.queue = queue
+        self.space = space
+
+    def put(self, key, value):
+        self.queue.tnt.insert(self.space, (key, value))
+
+    def get(self, key):
+        the_tuple = self.queue.tnt.select(self.space, [key])
+        if not the_tuple:
+            raise KeyError(key)
+        return the_tuple[0][1]
+
+    def delete(self, key):
+        self.queue.tnt.delete(self.space, key)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+
+
+class _TakeBatch(object):
+    """
+    Group of takers waiting for one bulk fetch.
+    """
+    def __init__(self, timeout, meta):
+        self.timeout = timeout
+        self.meta = meta
+        self.waiters = 0
+        self.closed = False
+        self.tasks = []
+        self.error = None
+        self.ready = threading.Event()
+
+    def join(self):
+        self.waiters += 1
+        return self.waiters - 1
+
+    def get(self, slot):
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+        if slot < len(self.tasks):
+            return self.tasks[slot]
+        return None
+
+
+class TakeCoalescer(object):
+    """
+    Groups concurrent :meth:`Tube.take() <tarantool_queue.Tube.take>` calls
+    into one bulk fetch. The first taker waits `window` seconds for others
+    to join, then fetches tasks for the whole group with
+    :meth:`Tube.take_many() <tarantool_queue.Tube.take_many>` and hands
+    them out. Takers left without a task get None, as on timeout, but
+    takers without timeout join the next group and keep waiting.
+
+    Only takers with equal arguments are grouped together.
+
+    .. warning::
+
+        Don't instantiate it with your bare hands, use
+        :meth:`Tube.coalesce_takes() <tarantool_queue.Tube.coalesce_takes>`
+    """
+    def __init__(self, tube, window=0.0005, limit=64):
+        if window < 0:
+            raise ValueError("window must be non-negative")
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        self.tube = tube
+        self.window = window
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._batches = {}
+
+    def take(self, timeout=0, meta=False):
+        while True:
+            task = self._take(timeout, meta)
+            if task is not None or timeout is not None:
+                return task
+
+    def _take(self, timeout, meta):
+        with self._lock:
+            batch = self._batches.get((timeout, meta))
+            leader = batch is None
+            if leader:
+                batch = _TakeBatch(timeout, meta)
+                self._batches[(timeout, meta)] = batch
+            slot = batch.join()
+            if batch.waiters >= self.limit:
+                self._close(batch)
+        if leader:
+            self._fetch(batch)
+        return batch.get(slot)
+
+    def _close(self, batch):
+        batch.closed = True
+        key = (batch.timeout, batch.meta)
+        if self._batches.get(key) is batch:
+            del self._batches[key]
+
+    def _fetch(self, batch):
+        if self.window:
+            time.sleep(self.window)
+        with self._lock:
+            if not batch.closed:
+                self._close(batch)
+        try:
+            batch.tasks = self.tube.take_many(batch.waiters, batch.timeout,
+                                              batch.meta)
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.ready.set()
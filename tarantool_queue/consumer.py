@@ -0,0 +1,472 @@
+# -*- coding: utf-8 -*-
+import os
+import math
+import time
+import threading
+import msgpack
+import multiprocessing
+from collections import deque
+
+
+class AdaptiveTake(object):
+    """
+    Take policy with adaptive long-poll timeout: every empty take
+    multiplies the timeout by `factor` up to `max_timeout`, a taken task
+    snaps it back to the floor. The floor grows from `min_timeout` to
+    `max_timeout` with the share of empty takes among the last `window`
+    takes and among the takes of all consumers of the tube (`take` and
+    `take_timeout` of :meth:`Tube.statistics()
+    <tarantool_queue.Tube.statistics>`, sampled every `stats_interval`
+    seconds), so idle consumers rarely poll the server, and busy ones
+    notice shutdown soon. It may be shared by threads.
+    Usage:
+
+        >>> policy = AdaptiveTake(tube, max_timeout=30)
+        >>> while running:
+        ...     task = policy.take()
+        ...     if task is not None:
+        ...         process(task)
+        >>> policy.stats()
+            {'taken': 1520, 'empty': 12, 'timeout': 0.1, 'empty_rate': 0.0}
+
+    :param tube: `Tube` instance
+    :param min_timeout: minimal timeout of take in seconds
+    :param max_timeout: maximal timeout of take in seconds
+    :param factor: multiplier of timeout after empty take
+    :param window: number of last takes for the rate of empty takes
+    :param stats_interval: interval of sampling of tube statistics in
+                           seconds, None - don't use statistics
+    :type min_timeout: float
+    :type max_timeout: float
+    :type factor: float
+    :type window: int
+    :type stats_interval: float or None
+    """
+    def __init__(self, tube, min_timeout=0.1, max_timeout=30, factor=2,
+                 window=100, stats_interval=60):
+        self.tube = tube
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.factor = factor
+        self.stats_interval = stats_interval
+        self.timeout = min_timeout
+        self.taken = 0
+        self.empty = 0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+        # server counters (take, take_timeout) of the last sample
+        self._sample = None
+        self._sample_time = 0
+        self._server_rate = 0.0
+
+    def take(self, meta=False):
+        """
+        Take a task with the current timeout and adapt the timeout.
+
+        :param meta: take task metadata too
+        :type meta: boolean
+        :rtype: `Task` instance or None
+        """
+        self._sample_statistics()
+        task = self.tube.take(self.timeout, meta)
+        with self._lock:
+            self._recent.append(task is None)
+            if task is None:
+                self.empty += 1
+                self.timeout = min(self.timeout * self.factor,
+                                   self.max_timeout)
+            else:
+                self.taken += 1
+                self.timeout = self._floor()
+        return task
+
+    @property
+    def empty_rate(self):
+        """
+        Share of empty takes among the last takes of this policy.
+        """
+        if not self._recent:
+            return 0.0
+        return float(sum(self._recent)) / len(self._recent)
+
+    def _floor(self):
+        rate = max(self.empty_rate, self._server_rate)
+        # square keeps the floor low unless takes are mostly empty
+        floor = (self.min_timeout +
+                 (self.max_timeout - self.min_timeout) * rate * rate)
+        return min(floor, self.max_timeout)
+
+    def _sample_statistics(self):
+        if self.stats_interval is None:
+            return
+        now = time.time()
+        with self._lock:
+            if now - self._sample_time < self.stats_interval:
+                return
+            self._sample_time = now
+        try:
+            stat = self.tube.statistics()
+            sample = (int(stat['take']), int(stat['take_timeout']))
+        except (KeyError, TypeError, ValueError):
+            # the backend doesn't count takes
+            return
+        with self._lock:
+            if self._sample is not None:
+                takes = sample[0] - self._sample[0]
+                if takes > 0:
+                    empty = sample[1] - self._sample[1]
+                    self._server_rate = min(float(empty) / takes, 1.0)
+            self._sample = sample
+
+    def stats(self):
+        """
+        Return counters of taken tasks and empty takes, current timeout
+        and the rate of empty takes.
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'taken': self.taken,
+                'empty': self.empty,
+                'timeout': self.timeout,
+                'empty_rate': self.empty_rate,
+            }
+
+
+class Consumer(object):
+    """
+    Pool of worker threads, that take tasks from `tube` with
+    :class:`AdaptiveTake <tarantool_queue.AdaptiveTake>`, call
+    `handler(data)` and ack tasks (or retry them according to retry
+    policy of tube, if handler fails). The number of workers is scaled
+    between `min_workers` and `max_workers` every `interval` seconds:
+    workers needed to process ready tasks of tube in `target_delay`
+    seconds are estimated from the handler latency. The pool grows at
+    most twice at once, and only while CPU utilization of the process
+    is below `max_cpu`; it shrinks by one worker at once. After a change
+    the pool isn't scaled for `cooldown` seconds.
+
+    Work in flight (taken, but not acked tasks) may be limited by number
+    of tasks and by total size of payloads: workers take tasks only when
+    there's budget left for one more task of the average size, counting
+    takes in progress. A task larger than the budget is taken, when
+    nothing else is in flight. The size of offloaded payload (see :meth:`Tube.offload()
+    <tarantool_queue.Tube.offload>`) is the size of its reference.
+    Usage:
+
+        >>> consumer = Consumer(tube, send_email, max_workers=32)
+        >>> consumer.start()
+        >>> consumer.metrics()
+            {'workers': 4, 'processed': 1520, 'latency': 0.12, ...}
+        >>> consumer.stop()
+
+    :param tube: `Tube` instance
+    :param handler: function, that takes task data
+    :param min_workers: minimal number of workers
+    :param max_workers: maximal number of workers
+    :param target_delay: desired time to process ready tasks in seconds
+    :param max_cpu: CPU utilization (0..1 of all cores), which stops
+                    growing
+    :param interval: interval of scaling in seconds
+    :param cooldown: time between changes of the number of workers
+    :param take: object with take() method, that returns task or None
+    :param max_tasks: maximal number of tasks in flight, at least 1
+    :param max_bytes: soft limit of total size of payloads in flight.
+                      Sizes of tasks are unknown before take, so a task
+                      is taken, if the average size fits, and tasks
+                      larger than the average may exceed the limit
+    :type min_workers: int
+    :type max_workers: int
+    :type target_delay: float
+    :type max_cpu: float
+    :type interval: float
+    :type cooldown: float
+    :type max_tasks: int or None
+    :type max_bytes: int or None
+    """
+    def __init__(self, tube, handler, min_workers=1, max_workers=8,
+                 target_delay=10, max_cpu=0.8, interval=5, cooldown=30,
+                 take=None, max_tasks=None, max_bytes=None):
+        self.tube = tube
+        self.handler = handler
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.target_delay = target_delay
+        self.max_cpu = max_cpu
+        self.interval = interval
+        self.cooldown = cooldown
+        if take is None:
+            # short polls, so retired workers exit soon
+            take = AdaptiveTake(tube, max_timeout=1, stats_interval=None)
+        self.take = take
+        if max_tasks is not None and max_tasks < 1:
+            raise ValueError("max_tasks must be at least 1")
+        self.max_tasks = max_tasks
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self.in_flight_bytes = 0
+        self.processed = 0
+        self.failed = 0
+        # moving average of handler time in seconds
+        self.latency = None
+        self.depth = 0
+        self.cpu = 0.0
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._retire = 0
+        # number of started workers, for names of threads
+        self._spawned = 0
+        self._control = None
+        self._last_scale = 0
+        self._cpu_sample = None
+        # takes in progress and average payload size, for the budget
+        self._reserved = 0
+        self._avg_size = None
+        self._budget = threading.Condition(self._lock)
+
+    @property
+    def workers(self):
+        """
+        Number of workers, not counting retiring ones.
+        """
+        with self._lock:
+            return len(self._threads) - self._retire
+
+    def _retired(self):
+        with self._lock:
+            if self._retire > 0:
+                self._retire -= 1
+                self._threads.remove(threading.current_thread())
+                return True
+            return False
+
+    def _fits(self):
+        """
+        May one more task be taken within the budget, must be called
+        with the lock held. The size of the next task is estimated with
+        the average size.
+        """
+        if (self.max_tasks is not None and
+                self.in_flight + self._reserved >= self.max_tasks):
+            return False
+        if self.max_bytes is None:
+            return True
+        if not self.in_flight and not self._reserved:
+            return True
+        if self._avg_size is None:
+            # size of tasks is unknown yet, take them one by one
+            return False
+        reserved = (self._reserved + 1) * self._avg_size
+        return self.in_flight_bytes + reserved <= self.max_bytes
+
+    def _reserve(self):
+        with self._budget:
+            while not self._fits():
+                if self._stopping.is_set():
+                    return False
+                self._budget.wait(0.1)
+            self._reserved += 1
+            return True
+
+    @staticmethod
+    def _size(task):
+        raw_data = task.raw_data
+        if raw_data is None:
+            return 0
+        if isinstance(raw_data, bytes):
+            return len(raw_data)
+        # native payload of NQueue
+        return len(msgpack.packb(raw_data))
+
+    def _admit(self, task):
+        size = 0 if task is None else self._size(task)
+        with self._budget:
+            self._reserved -= 1
+            if task is not None:
+                self.in_flight += 1
+                self.in_flight_bytes += size
+                if self._avg_size is None:
+                    self._avg_size = float(size)
+                else:
+                    self._avg_size = 0.8 * self._avg_size + 0.2 * size
+            self._budget.notify_all()
+        return size
+
+    def _free(self, size):
+        with self._budget:
+            self.in_flight -= 1
+            self.in_flight_bytes -= size
+            self._budget.notify_all()
+
+    def _work(self):
+        while not self._stopping.is_set() and not self._retired():
+            if not self._reserve():
+                break
+            try:
+                task = self.take.take()
+            except Exception as e:
+                self._admit(None)
+                self.last_error = e
+                time.sleep(1)
+                continue
+            size = self._admit(task)
+            if task is None:
+                continue
+            try:
+                self._process(task)
+            finally:
+                self._free(size)
+
+    def _process(self, task):
+        start = time.time()
+        try:
+            self.handler(task.data)
+        except Exception as e:
+            self.last_error = e
+            failed = True
+            try:
+                task.retry()
+            except Exception as e:
+                # the task is returned by the server after its ttr
+                self.last_error = e
+        else:
+            failed = False
+            task.ack()
+        elapsed = time.time() - start
+        with self._lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.processed += 1
+            if self.latency is None:
+                self.latency = elapsed
+            else:
+                self.latency = 0.8 * self.latency + 0.2 * elapsed
+
+    def _resize(self, count):
+        with self._lock:
+            current = len(self._threads) - self._retire
+            if count < current:
+                self._retire += current - count
+                return
+            for _ in range(count - current):
+                self._spawned += 1
+                thread = threading.Thread(target=self._work,
+                                          name='Consumer-%d' % self._spawned)
+                thread.daemon = True
+                self._threads.append(thread)
+                thread.start()
+
+    def _sample_cpu(self):
+        now = time.time()
+        times = os.times()
+        used = times[0] + times[1]
+        if self._cpu_sample is not None:
+            wall = now - self._cpu_sample[0]
+            if wall > 0:
+                self.cpu = ((used - self._cpu_sample[1]) / wall /
+                            multiprocessing.cpu_count())
+        self._cpu_sample = (now, used)
+        return self.cpu
+
+    def _sample_depth(self):
+        try:
+            self.depth = int(self.tube.statistics()['tasks']['ready'])
+        except KeyError:
+            self.depth = 0
+        return self.depth
+
+    def scale(self):
+        """
+        Sample ready tasks of tube and CPU utilization and change the
+        number of workers, unless the pool is in cooldown.
+
+        :rtype: int - number of workers
+        """
+        depth = self._sample_depth()
+        cpu = self._sample_cpu()
+        workers = self.workers
+        if time.time() - self._last_scale < self.cooldown:
+            return workers
+        if self.latency is None:
+            # nothing is processed yet, so latency is unknown
+            needed = workers + 1 if depth else workers
+        else:
+            needed = int(math.ceil(depth * self.latency / self.target_delay))
+        needed = max(self.min_workers, min(needed, self.max_workers))
+        if needed > workers:
+            # more workers don't help, if budget of work in flight is out
+            exhausted = not self._has_budget()
+            grow = cpu < self.max_cpu and not exhausted
+            target = needed if grow else workers
+            target = min(target, max(workers * 2, 1))
+        else:
+            target = max(needed, workers - 1)
+        if target != workers:
+            self._resize(target)
+            self._last_scale = time.time()
+        return target
+
+    def _has_budget(self):
+        with self._lock:
+            return self._fits()
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            self._stopping.wait(self.interval)
+            if self._stopping.is_set():
+                break
+            try:
+                self.scale()
+            except Exception as e:
+                self.last_error = e
+
+    def start(self):
+        """
+        Start `min_workers` workers and scaling.
+        """
+        self._stopping.clear()
+        self._sample_cpu()
+        self._resize(self.min_workers)
+        self._control = threading.Thread(target=self._loop,
+                                         name='Consumer-scaler')
+        self._control.daemon = True
+        self._control.start()
+
+    def stop(self):
+        """
+        Stop all workers, waiting for current tasks to finish.
+        """
+        self._stopping.set()
+        if self._control is not None:
+            self._control.join()
+            self._control = None
+        with self._lock:
+            threads = list(self._threads)
+        for thread in threads:
+            thread.join()
+        with self._lock:
+            self._threads = []
+            self._retire = 0
+
+    def metrics(self):
+        """
+        :rtype: dict with number of workers, counters of processed and
+                failed tasks, handler latency, ready tasks and CPU
+                utilization of the last scaling, number and total payload
+                size of tasks in flight
+        """
+        with self._lock:
+            return {
+                'workers': len(self._threads) - self._retire,
+                'processed': self.processed,
+                'failed': self.failed,
+                'latency': self.latency,
+                'depth': self.depth,
+                'cpu': self.cpu,
+                'in_flight': self.in_flight,
+                'in_flight_bytes': self.in_flight_bytes,
+            }
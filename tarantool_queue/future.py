@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Future(object):
+    """
+    Result of an operation that completes in another thread.
+
+    .. warning::
+
+        Don't instantiate it with your bare hands
+    """
+    class TimeoutException(Exception):
+        pass
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        """
+        Return True if result or exception is already set.
+
+        :rtype: boolean
+        """
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the operation and return its result. Raises the exception
+        of the operation if it failed.
+
+        :param timeout: time to wait in seconds, None - wait forever
+        :type timeout: float or None
+        """
+        if not self._event.wait(timeout) and not self._event.is_set():
+            raise Future.TimeoutException("operation is not completed")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """
+        Wait for the operation and return its exception or None.
+
+        :param timeout: time to wait in seconds, None - wait forever
+        :type timeout: float or None
+        """
+        if not self._event.wait(timeout) and not self._event.is_set():
+            raise Future.TimeoutException("operation is not completed")
+        return self._exception
+
+    def add_done_callback(self, func):
+        """
+        Call `func(future)` when the operation completes. If it is already
+        completed, `func` is called immediately.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(func)
+                return
+        self._call(func)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            self._call(func)
+
+    def _call(self, func):
+        # a failed callback must not break others and the caller
+        try:
+            func(self)
+        except Exception:
+            logger.exception("exception in callback of %r", self)
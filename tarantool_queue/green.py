@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import tarantool
+
+try:
+    from Queue import LifoQueue
+except ImportError:
+    from queue import LifoQueue
+
+
+class ConnectionPool(object):
+    """
+    Connection of `Queue` for many threads (or greenlets). Every thread
+    that takes tasks gets its own connection on its first take and runs
+    all its calls on it: the server accepts ack, release etc. only from
+    the session that took the task, and consumers waiting in long-poll
+    don't hold shared connections, so their number isn't limited by the
+    pool. Other requests run on one of at most `size` shared
+    connections, opened on demand; callers wait for a free one, when all
+    of them are busy. Subclass it to set `size`, `connection_class`, `queue_class`
+    (LIFO queue of idle connections) and `local_class` (thread local
+    storage), both must suit the threading model, and set it as
+    `Queue.tarantool_connection`, or use :func:`cooperative`.
+    """
+    size = 16
+    connection_class = tarantool.Connection
+    queue_class = LifoQueue
+    local_class = threading.local
+    # procedures, that may wait for a task
+    blocking = ('take', 'take_meta', 'take_many')
+
+    def __init__(self, host, port, schema=None):
+        self.host = host
+        self.port = port
+        self.schema = schema
+        self._idle = self.queue_class()
+        self._local = self.local_class()
+        # None is a slot for connection, that isn't opened yet
+        for _ in range(self.size):
+            self._idle.put(None)
+
+    def _connect(self):
+        return self.connection_class(self.host, self.port,
+                                     schema=self.schema)
+
+    def _run(self, method, *args, **kwargs):
+        connection = self._idle.get()
+        try:
+            if connection is None:
+                connection = self._connect()
+            result = getattr(connection, method)(*args, **kwargs)
+        except tarantool.NetworkError:
+            # reopen it next time
+            self._idle.put(None)
+            raise
+        except Exception:
+            self._idle.put(connection)
+            raise
+        self._idle.put(connection)
+        return result
+
+    def _is_blocking(self, name):
+        # queue.take, box.queue.take, queue.tube.<name>:take, ...
+        return name.rsplit('.', 1)[-1].rsplit(':', 1)[-1] in self.blocking
+
+    def _run_local(self, method, *args, **kwargs):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        try:
+            return getattr(connection, method)(*args, **kwargs)
+        except tarantool.NetworkError:
+            # reopen it next time
+            self._local.connection = None
+            raise
+
+    def call(self, name, *args, **kwargs):
+        if (self._is_blocking(name) or
+                getattr(self._local, 'connection', None) is not None):
+            return self._run_local('call', name, *args, **kwargs)
+        return self._run('call', name, *args, **kwargs)
+
+    def select(self, *args, **kwargs):
+        return self._run('select', *args, **kwargs)
+
+    def insert(self, *args, **kwargs):
+        return self._run('insert', *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._run('delete', *args, **kwargs)
+
+
+def _green(library):
+    if library == 'gevent':
+        import gevent.lock
+        import gevent.queue
+        import gevent.monkey
+        import gevent.local
+        patched = gevent.monkey.is_module_patched('socket')
+        return (patched, gevent.lock.RLock, gevent.queue.LifoQueue,
+                gevent.local.local)
+    if library == 'eventlet':
+        import eventlet.queue
+        import eventlet.patcher
+        import eventlet.semaphore
+        import eventlet.corolocal
+        patched = eventlet.patcher.is_monkey_patched('socket')
+        return (patched, eventlet.semaphore.Semaphore,
+                eventlet.queue.LifoQueue, eventlet.corolocal.local)
+    raise ValueError("library must be 'gevent' or 'eventlet'")
+
+
+def cooperative(queue, library='gevent', size=64):
+    """
+    Switch `queue` to cooperative mode of gevent or eventlet: requests
+    run on a :class:`ConnectionPool` with green queue, lock and local
+    storage, so thousands of greenlets may wait in long-poll
+    :meth:`Tube.take() <tarantool_queue.Tube.take>` without blocking the
+    hub. Every consumer greenlet takes on its own connection, other
+    requests share `size` connections and don't wait for takes. The
+    socket module must be monkey patched, because tarantool-python
+    uses it.
+    Usage:
+
+        >>> from gevent import monkey
+        >>> monkey.patch_all()
+        >>> queue = cooperative(Queue('localhost', 33013, 0))
+
+    :param queue: `Queue` instance
+    :param library: 'gevent' or 'eventlet'
+    :param size: maximal number of shared connections
+    :type library: string
+    :type size: int
+    :rtype: `Queue` instance
+    """
+    patched, lock_class, queue_class, local_class = _green(library)
+    if not patched:
+        raise queue.BadConfigException(
+            "socket module must be monkey patched by %s" % library)
+    queue.tarantool_lock = lock_class()
+    queue.tarantool_connection = type('GreenConnectionPool',
+                                      (ConnectionPool,), {
+                                          'size': size,
+                                          'connection_class':
+                                              queue.tarantool_connection,
+                                          'queue_class': queue_class,
+                                          'local_class': local_class,
+                                      })
+    return queue
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import time
+
+from .ratelimit import TokenBucket
+from .tarantool_queue import Task, unpack_meta
+
+
+class DeadLetters(object):
+    """
+    Streaming bulk operations over buried tasks of a Tube. Tasks are read
+    in batches of `batch` tasks, filtered by age and by `predicate(task)`,
+    and processed at most `rate` tasks per second, so maintenance doesn't
+    disturb production traffic.
+    Usage:
+
+        >>> dead = DeadLetters(tube, rate=500,
+        ...                    progress=lambda stats: log(stats))
+        >>> dead.count(older_than=86400)
+            1500
+        >>> dead.requeue(queue.tube('retry'),
+        ...              predicate=lambda task: task.data['kind'] == 'mail')
+            300
+        >>> dead.delete(older_than=7 * 86400)
+            1000
+
+    :param tube: `Tube` instance
+    :param batch: number of tasks read in one request
+    :param rate: maximum number of processed tasks per second,
+                 None - unlimited
+    :param progress: function, that is called after every batch with
+                     dict of 'scanned', 'matched' and 'processed' counters
+    :type batch: int
+    :type rate: float or None
+    """
+    def __init__(self, tube, batch=1000, rate=None, progress=None):
+        if batch < 1:
+            raise ValueError("batch must be positive")
+        tube.queue._need_select("DeadLetters")
+        self.tube = tube
+        self.queue = tube.queue
+        self.batch = batch
+        self.bucket = TokenBucket(rate) if rate else None
+        self.progress = progress
+
+    def scan(self, predicate=None, older_than=None, _consume=False):
+        """
+        Iterate over buried tasks matching the filters.
+
+        :param predicate: function, that takes `Task` and returns boolean
+        :param older_than: minimal age of task in seconds
+        :type older_than: float or None
+        :rtype: generator of `Task` instances
+        """
+        created_before = None
+        if older_than is not None:
+            created_before = (time.time() - older_than) * 1000000
+        stats = {'scanned': 0, 'matched': 0, 'processed': 0}
+        offset = 0
+        while True:
+            rows = self.queue._select(self.tube.opt['tube'], 'buried',
+                                      offset=offset, limit=self.batch)
+            if not rows:
+                break
+            for row in rows:
+                stats['scanned'] += 1
+                if created_before is not None:
+                    if unpack_meta(row[:12])[7] > created_before:
+                        offset += 1
+                        continue
+                task = Task.from_row(self.queue, row)
+                if predicate is not None and not predicate(task):
+                    offset += 1
+                    continue
+                stats['matched'] += 1
+                if self.bucket is not None:
+                    self.bucket.acquire()
+                yield task
+                stats['processed'] += 1
+                if not _consume:
+                    offset += 1
+            if self.progress is not None:
+                self.progress(dict(stats))
+            if len(rows) < self.batch:
+                break
+
+    def _apply(self, action, predicate, older_than):
+        count = 0
+        for task in self.scan(predicate, older_than, _consume=True):
+            action(task)
+            count += 1
+        return count
+
+    def count(self, predicate=None, older_than=None):
+        """
+        Count buried tasks matching the filters.
+
+        :rtype: int
+        """
+        return sum(1 for _ in self.scan(predicate, older_than))
+
+    def dig(self, predicate=None, older_than=None):
+        """
+        Dig up buried tasks matching the filters.
+
+        :rtype: int - number of tasks
+        """
+        return self._apply(lambda task: task.dig(), predicate, older_than)
+
+    def delete(self, predicate=None, older_than=None):
+        """
+        Delete buried tasks matching the filters.
+
+        :rtype: int - number of tasks
+        """
+        return self._apply(lambda task: task.delete(), predicate, older_than)
+
+    def requeue(self, target, predicate=None, older_than=None, **kwargs):
+        """
+        Put buried tasks matching the filters into `target` tube and
+        delete them from this one. Options of the new tasks are the
+        defaults of `target` updated with `kwargs`.
+
+        :param target: `Tube` instance
+        :rtype: int - number of tasks
+        """
+        def move(task):
+            target._produce_raw("queue.put", task.raw_data, **kwargs)
+            # the new task refers to the same offloaded payload
+            self.queue._delete(task.task_id)
+        return self._apply(move, predicate, older_than)
+
+    def bury(self, tasks):
+        """
+        Bury tasks.
+
+        :param tasks: `Task` instances or UUIDs of tasks in HEX
+        :type tasks: iterable of `Task` instances or strings
+        :rtype: int - number of buried tasks
+        """
+        count = 0
+        for task in tasks:
+            if self.bucket is not None:
+                self.bucket.acquire()
+            if isinstance(task, Task):
+                buried = task.bury()
+            else:
+                buried = self.queue._bury(task)
+            if buried:
+                count += 1
+        return count
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+import time
+import bisect
+import threading
+
+from .tarantool_queue import unpack_meta
+
+
+class Histogram(object):
+    """
+    Histogram of durations in seconds with exponential buckets: from
+    `start` seconds, every next bucket is `factor` times wider.
+
+    :type start: float
+    :type factor: float
+    :type count: int
+    """
+    def __init__(self, start=0.001, factor=2.0, buckets=27):
+        self.bounds = [start * factor ** i for i in range(buckets)]
+        self.buckets = [0] * (buckets + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, q):
+        """
+        Upper bound of the bucket with `q`-th percentile, None if empty.
+
+        :param q: percentile from 0 to 100
+        :type q: float
+        :rtype: float or None
+        """
+        with self._lock:
+            if not self.count:
+                return None
+            rank = self.count * q / 100.0
+            seen = 0
+            for index, count in enumerate(self.buckets):
+                seen += count
+                if seen >= rank and count:
+                    if index < len(self.bounds):
+                        return min(self.bounds[index], self.max)
+                    return self.max
+            return self.max
+
+    def snapshot(self):
+        """
+        :rtype: dict with count, sum, max, p50, p90, p99
+        """
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99)
+        }
+
+
+class LatencyMonitor(object):
+    """
+    Per-tube instrumentation of queue latency. When it's set as
+    `Queue.monitor`, it records on every take the time the task waited in
+    the queue, and on every ack the time between take and ack.
+
+    Wait time is computed from task metadata, if it was taken with the
+    task (see :meth:`Tube.take() <tarantool_queue.Tube.take>`), otherwise
+    from `timestamp(task)` - unix time of the put, e.g. embedded into the
+    payload by the producer, or from the envelope of the task (see
+    :class:`Tracer <tarantool_queue.Tracer>`). Without them the wait time
+    is not recorded.
+    Usage:
+
+        >>> monitor = LatencyMonitor()
+        >>> queue.monitor = monitor
+        >>> task = tube.take(meta=True)
+        >>> task.ack()
+        >>> monitor.stats()
+            {'tube': {'wait': {...}, 'handling': {...}}}
+        >>> monitor.oldest_ready_age(tube)
+            12.5
+
+    :param timestamp: function, that returns unix time of the put of the
+                      task or None
+    """
+    def __init__(self, timestamp=None):
+        self.timestamp = timestamp
+        self._wait = {}
+        self._handling = {}
+        self._lock = threading.Lock()
+
+    def _histogram(self, histograms, tube):
+        histogram = histograms.get(tube)
+        if histogram is None:
+            with self._lock:
+                histogram = histograms.setdefault(tube, Histogram())
+        return histogram
+
+    def wait_time(self, tube):
+        """
+        :rtype: `Histogram` of queue wait time of tube
+        """
+        return self._histogram(self._wait, tube)
+
+    def handling_time(self, tube):
+        """
+        :rtype: `Histogram` of time from take to ack of tube
+        """
+        return self._histogram(self._handling, tube)
+
+    def on_take(self, task):
+        now = time.time()
+        task.taken_at = now
+        wait = None
+        meta = None
+        if task._meta_row is not None or hasattr(task, '_decoded_meta'):
+            meta = task.meta_cached
+        if meta is not None and 'created' in meta:
+            wait = (meta['now'] - meta['created']) / 1000000.0
+        else:
+            if self.timestamp is not None:
+                stamp = self.timestamp(task)
+            else:
+                envelope = task.envelope
+                stamp = envelope.get('ts') if envelope else None
+            if stamp is not None:
+                wait = now - stamp
+        if wait is not None:
+            self.wait_time(task.tube).observe(max(wait, 0.0))
+
+    def on_ack(self, task):
+        taken_at = getattr(task, 'taken_at', None)
+        if taken_at is not None:
+            self.handling_time(task.tube).observe(time.time() - taken_at)
+
+    def oldest_ready_age(self, tube, sample=1000):
+        """
+        Estimate age of the oldest ready task of tube in seconds: the
+        maximum age of the first `sample` tasks to be taken.
+
+        :param tube: `Tube` instance
+        :param sample: number of tasks to look at
+        :type sample: int
+        :rtype: float or None if there are no ready tasks
+        """
+        tube.queue._need_select("oldest_ready_age")
+        rows = tube.queue._select(tube.opt['tube'], 'ready',
+                                 limit=sample)
+        if not rows:
+            return None
+        created = min(unpack_meta(row[:12])[7] for row in rows)
+        return max(time.time() - created / 1000000.0, 0.0)
+
+    def stats(self):
+        """
+        :rtype: dict of tube name - dict with snapshots of 'wait'
+                and 'handling' histograms
+        """
+        with self._lock:
+            tubes = set(self._wait) | set(self._handling)
+        return dict((tube, {
+            'wait': self.wait_time(tube).snapshot(),
+            'handling': self.handling_time(tube).snapshot()
+        }) for tube in tubes)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+
+from .tarantool_queue import Queue, split_statistics
+from .tarantool_nqueue import NQueue
+
+
+class MultiQueue(object):
+    """
+    Client of many queue spaces of one server. Queues of spaces share one
+    connection and one lock, so the number of connections doesn't grow
+    with the number of spaces, and :meth:`statistics` of all spaces is
+    fetched with one request.
+    Usage:
+
+        >>> multi = MultiQueue('localhost', 33013)
+        >>> emails = multi.space(0).tube('emails')
+        >>> sms = multi.space(1).tube('sms')
+        >>> multi.statistics()
+            {0: {'emails': {...}}, 1: {'sms': {...}}}
+
+    :param host: host of Tarantool
+    :param port: port of Tarantool
+    :param schema: schema of connection
+    :param queue_class: class of queues of spaces, it's called as
+                        `queue_class(host, port, space, schema)` like
+                        `Queue` and `TQueue`; `NQueue` has no spaces
+                        and raises `Queue.BadConfigException`
+    :type host: string
+    :type port: int
+    """
+    def __init__(self, host="localhost", port=33013, schema=None,
+                 queue_class=Queue):
+        if issubclass(queue_class, NQueue):
+            raise Queue.BadConfigException(
+                "queues of Tarantool 1.6+ have no spaces")
+        self.host = host
+        self.port = port
+        self.schema = schema
+        self.queue_class = queue_class
+        self.queues = {}
+        self._lock = threading.Lock()
+        self._stats = None
+        self._stats_time = 0
+        # the queue, that owns the connection
+        self._owner = queue_class(host, port, 0, schema)
+
+    @property
+    def tnt(self):
+        return self._owner.tnt
+
+    def space(self, space):
+        """
+        Return queue of space, sharing connection with other spaces.
+
+        :param space: number of space
+        :type space: int
+        :rtype: `Queue` instance
+        """
+        with self._lock:
+            queue = self.queues.get(space)
+            if queue is None:
+                queue = self.queue_class(self.host, self.port, space,
+                                         self.schema)
+                queue.tarantool_lock = self._owner.tarantool_lock
+                queue._tnt = self.tnt
+                self.queues[space] = queue
+        return queue
+
+    def statistics(self, space=None, max_age=0):
+        """
+        Return statistics of all spaces in one request: dict of
+        statistics in the format of :meth:`Queue.statistics()
+        <tarantool_queue.Queue.statistics>` by space number, or the
+        statistics of one `space`. Statistics fetched less than `max_age`
+        seconds ago are reused, so many callers cost one request.
+
+        :param space: number of space
+        :param max_age: maximal age of statistics in seconds
+        :type space: int or None
+        :type max_age: float
+        :rtype: dict with statistics
+        """
+        with self._lock:
+            if (self._stats is None or
+                    time.time() - self._stats_time >= max_age):
+                owner = self._owner
+                self._stats = split_statistics(
+                    self.tnt.call(owner._statistics_proc,
+                                  (owner._space_arg,)))
+                self._stats_time = time.time()
+            stats = self._stats
+        if space is not None:
+            return stats.get(space, {})
+        return stats
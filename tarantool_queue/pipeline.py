@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+import collections
+
+# maximum number of input tasks, whose put results are remembered
+_MAX_TRACKED = 10000
+
+
+class Stage(object):
+    """
+    Stage of :class:`Pipeline <tarantool_queue.Pipeline>`.
+
+    .. warning::
+
+        Don't instantiate it with your bare hands, use
+        :meth:`Pipeline.stage() <tarantool_queue.Pipeline.stage>`
+    """
+    def __init__(self, queue, name, input, handler, outputs=(),
+                 batch=100, timeout=1, many=False):
+        self.queue = queue
+        self.name = name
+        self.input = input
+        self.handler = handler
+        self.outputs = list(outputs)
+        self.batch = batch
+        self.timeout = timeout
+        self.many = many
+        self.taken = 0
+        self.processed = 0
+        self.failed = 0
+        self.forwarded = 0
+        self.last_error = None
+        self.started = time.time()
+        self._lock = threading.Lock()
+        # task id - (output, number of result) put before failed step
+        self._put = collections.OrderedDict()
+
+    def step(self):
+        """
+        Take a batch of tasks from input tube, process them, put results
+        into output tubes and ack the processed tasks. Tasks, that failed,
+        are retried according to retry policy of input tube. If results
+        can't be put, processed tasks are released, and results that were
+        put are remembered, so they aren't put again when the tasks come
+        back to this stage.
+
+        :rtype: int - number of taken tasks
+        """
+        tasks = self.queue.tube(self.input).take_many(self.batch,
+                                                      self.timeout)
+        if not tasks:
+            return 0
+        done = []
+        # task id, number of result and result
+        results = []
+        failed = 0
+        for task in tasks:
+            try:
+                result = self.handler(task.data)
+            except Exception:
+                failed += 1
+                task.retry()
+                continue
+            done.append(task)
+            if not self.many:
+                result = () if result is None else (result,)
+            for index, item in enumerate(result or ()):
+                results.append((task.task_id, index, item))
+        forwarded = self._forward(done, results)
+        for task in done:
+            task.ack()
+        with self._lock:
+            for task in done:
+                self._put.pop(task.task_id, None)
+            self.taken += len(tasks)
+            self.processed += len(done)
+            self.failed += failed
+            self.forwarded += forwarded
+        return len(tasks)
+
+    def _forward(self, done, results):
+        put = []
+        try:
+            for output in self.outputs:
+                with self._lock:
+                    pending = [
+                        (task_id, index, item)
+                        for task_id, index, item in results
+                        if (output, index) not in self._put.get(task_id, ())]
+                try:
+                    self.queue.tube(output).put_many(
+                        [item for _, _, item in pending])
+                except self.queue.PartialPutException as e:
+                    put.extend((output, task_id, index) for task_id, index, _
+                               in pending[:len(e.tasks)])
+                    raise
+                put.extend((output, task_id, index)
+                           for task_id, index, _ in pending)
+        except Exception:
+            with self._lock:
+                for output, task_id, index in put:
+                    self._put.setdefault(task_id, set()).add((output, index))
+                while len(self._put) > _MAX_TRACKED:
+                    self._put.popitem(last=False)
+            for task in done:
+                task.release()
+            raise
+        return len(put)
+
+    def metrics(self):
+        """
+        :rtype: dict with counters, throughput (processed tasks per
+                second) and backlog (ready tasks in input tube)
+        """
+        try:
+            tasks = self.queue.tube(self.input).statistics()['tasks']
+            backlog = int(tasks['ready'])
+        except KeyError:
+            backlog = 0
+        elapsed = time.time() - self.started
+        with self._lock:
+            return {
+                'taken': self.taken,
+                'processed': self.processed,
+                'failed': self.failed,
+                'forwarded': self.forwarded,
+                'throughput': self.processed / elapsed if elapsed else 0.0,
+                'backlog': backlog
+            }
+
+
+class Pipeline(object):
+    """
+    Chain of tubes: every stage takes tasks from its input tube, calls
+    handler with task data and puts the result into its output tubes.
+    Input tasks are acked only after results are put.
+    Usage:
+
+        >>> pipeline = Pipeline(queue)
+        >>> pipeline.stage('parse', 'raw', parse, outputs=['parsed'])
+        >>> pipeline.stage('enrich', 'parsed', enrich, outputs=['enriched'])
+        >>> pipeline.stage('index', 'enriched', index)
+        >>> pipeline.start(workers=2)
+        >>> pipeline.metrics()
+            {'parse': {'processed': 100, 'backlog': 3, ...}, ...}
+        >>> pipeline.stop()
+
+    :param queue: `Queue` instance
+    """
+    def __init__(self, queue):
+        self.queue = queue
+        self.stages = []
+        self._threads = []
+        self._running = threading.Event()
+
+    def stage(self, name, input, handler, outputs=(), batch=100, timeout=1,
+              many=False):
+        """
+        Add stage to pipeline.
+
+        :param name: name of stage
+        :param input: name of input tube
+        :param handler: function, that takes task data and returns the
+                        result or None if there's nothing to forward
+        :param outputs: names of output tubes
+        :param batch: maximum number of tasks taken at once
+        :param timeout: time to wait for tasks in input tube
+        :param many: handler returns iterable of results
+        :type name: string
+        :type input: string
+        :type outputs: list of strings
+        :type batch: int
+        :type timeout: int
+        :type many: boolean
+        :rtype: `Stage` instance
+        """
+        stage = Stage(self.queue, name, input, handler, outputs,
+                      batch, timeout, many)
+        self.stages.append(stage)
+        return stage
+
+    def run_once(self):
+        """
+        Make one step of every stage in current thread.
+
+        :rtype: int - number of taken tasks
+        """
+        return sum(stage.step() for stage in self.stages)
+
+    def _loop(self, stage):
+        while self._running.is_set():
+            try:
+                stage.step()
+            except Exception as e:
+                stage.last_error = e
+                time.sleep(1)
+
+    def start(self, workers=1):
+        """
+        Start `workers` threads for every stage.
+        """
+        self._running.set()
+        for stage in self.stages:
+            for i in range(workers):
+                name = 'Pipeline-%s-%d' % (stage.name, i)
+                thread = threading.Thread(target=self._loop, args=(stage,),
+                                          name=name)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        """
+        Stop all threads, waiting for current steps to finish.
+        """
+        self._running.clear()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def metrics(self):
+        """
+        :rtype: dict of stage name - :meth:`Stage.metrics()
+                <tarantool_queue.Stage.metrics>`
+        """
+        return dict((stage.name, stage.metrics()) for stage in self.stages)
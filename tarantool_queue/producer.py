@@ -0,0 +1,639 @@
+# -*- coding: utf-8 -*-
+import time
+import struct
+import hashlib
+import threading
+import collections
+
+from .future import Future
+from .ratelimit import TokenBucket
+
+
+class AsyncProducer(object):
+    """
+    Fire-and-forget producer for a Tube. :meth:`put` stores the task in a
+    bounded in-memory buffer and returns at once, the background thread
+    sends buffered tasks to the server in batches.
+    Usage:
+
+        >>> producer = AsyncProducer(queue.tube('tube'), maxsize=1000)
+        >>> future = producer.put([1, 2, 3])
+        >>> producer.flush()
+            True
+        >>> future.result().task_id
+            '...'
+        >>> producer.close()
+
+    :param tube: `Tube` instance to put tasks into
+    :param maxsize: maximum number of buffered tasks
+    :param batch_size: maximum number of tasks sent in one batch
+    :param on_full: 'block' - wait for free space in the buffer (at most
+                    `timeout` seconds), 'drop' - drop the task and
+                    return None
+    :param timeout: time to wait for free space if `on_full` is 'block',
+                    None - wait forever
+    :type maxsize: int
+    :type batch_size: int
+    :type on_full: string
+    :type timeout: float or None
+    """
+
+    BLOCK = 'block'
+    DROP = 'drop'
+
+    class FullException(Exception):
+        pass
+
+    class ClosedException(Exception):
+        pass
+
+    def __init__(self, tube, maxsize=10000, batch_size=100,
+                 on_full=BLOCK, timeout=None):
+        if on_full not in (self.BLOCK, self.DROP):
+            raise ValueError("on_full must be 'block' or 'drop'")
+        if maxsize < 1 or batch_size < 1:
+            raise ValueError("maxsize and batch_size must be positive")
+        self.tube = tube
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.on_full = on_full
+        self.timeout = timeout
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self._buffer = collections.deque()
+        self._inflight = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run,
+                                        name='AsyncProducer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def pending(self):
+        """
+        Number of tasks accepted, but not sent yet.
+        """
+        with self._cond:
+            return len(self._buffer) + self._inflight
+
+    def put(self, data, **kwargs):
+        """
+        Enqueue a task in background. Accepts the same arguments as
+        :meth:`Tube.put() <tarantool_queue.Tube.put>`.
+
+        :rtype: `Future` with `Task` instance as result or None if
+                the task was dropped
+        """
+        with self._cond:
+            if self._closed:
+                raise AsyncProducer.ClosedException("producer is closed")
+            if len(self._buffer) >= self.maxsize:
+                if self.on_full == self.DROP:
+                    self.dropped += 1
+                    return None
+                self._wait_for_space()
+            future = Future()
+            self._buffer.append((data, kwargs, future))
+            self._cond.notify_all()
+        return future
+
+    def _wait_for_space(self):
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        while len(self._buffer) >= self.maxsize:
+            if self._closed:
+                raise AsyncProducer.ClosedException("producer is closed")
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise AsyncProducer.FullException("buffer is full")
+            self._cond.wait(remaining)
+
+    def flush(self, timeout=None):
+        """
+        Wait until every accepted task is sent. Failed tasks are reported
+        through their futures and counted in `failed`.
+
+        :param timeout: time to wait in seconds, None - wait forever
+        :type timeout: float or None
+        :rtype: boolean - True if everything is sent
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self._cond:
+            while self._buffer or self._inflight:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """
+        Stop accepting tasks, send everything buffered and stop the
+        background thread.
+
+        :param timeout: time to wait in seconds, None - wait forever
+        :type timeout: float or None
+        :rtype: boolean - True if everything is sent
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        flushed = self.flush(timeout)
+        self._thread.join(timeout)
+        return flushed
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closed:
+                    self._cond.wait()
+                if not self._buffer:
+                    return
+                batch = []
+                while self._buffer and len(batch) < self.batch_size:
+                    batch.append(self._buffer.popleft())
+                self._inflight = len(batch)
+                self._cond.notify_all()
+            try:
+                self._send(batch)
+            finally:
+                with self._cond:
+                    self._inflight = 0
+                    self._cond.notify_all()
+
+    def _send(self, batch):
+        # consecutive tasks with the same options are put in one request
+        start = 0
+        while start < len(batch):
+            kwargs = batch[start][1]
+            end = start + 1
+            while end < len(batch) and batch[end][1] == kwargs:
+                end += 1
+            self._send_many(batch[start:end], kwargs)
+            start = end
+
+    def _send_many(self, batch, kwargs):
+        try:
+            tasks = self.tube.put_many([data for data, _, _ in batch],
+                                       **kwargs)
+            error = None
+        except self.tube.queue.PartialPutException as e:
+            tasks, error = e.tasks, e
+        except Exception as e:
+            tasks, error = [], e
+        self.sent += len(tasks)
+        self.failed += len(batch) - len(tasks)
+        for index, (_, _, future) in enumerate(batch):
+            if index < len(tasks):
+                future.set_result(tasks[index])
+            else:
+                future.set_exception(error)
+
+
+class AdmissionController(object):
+    """
+    Producer-side admission control for a Tube. It samples the number of
+    ready and delayed tasks from :meth:`Tube.statistics()
+    <tarantool_queue.Tube.statistics>` at most once per `interval` seconds.
+    When it reaches `high`, the tube is overloaded until it falls to `low`,
+    and puts are blocked, throttled or rejected depending on `mode`.
+    Usage:
+
+        >>> controller = AdmissionController(tube, high=100000, low=80000)
+        >>> controller.put([1, 2, 3])
+        # or check admission before putting with other producers
+        >>> controller.admit()
+        >>> producer.put([1, 2, 3])
+
+    :param tube: `Tube` instance to watch and put tasks into
+    :param high: high-water mark of ready and delayed tasks
+    :param low: low-water mark, default is `high`
+    :param mode: 'block' - wait until the tube drains to `low`
+                 (at most `timeout` seconds), 'throttle' - limit puts to
+                 `rate` per second, 'reject' - raise `RejectedException`
+    :param interval: minimal time between statistics requests in seconds
+    :param rate: puts per second in 'throttle' mode
+    :param timeout: time to wait in 'block' mode, None - wait forever
+    :type high: int
+    :type low: int or None
+    :type mode: string
+    :type interval: float
+    :type rate: float
+    :type timeout: float or None
+    """
+
+    BLOCK = 'block'
+    THROTTLE = 'throttle'
+    REJECT = 'reject'
+
+    class RejectedException(Exception):
+        pass
+
+    def __init__(self, tube, high, low=None, mode=BLOCK, interval=1.0,
+                 rate=100, timeout=None):
+        if mode not in (self.BLOCK, self.THROTTLE, self.REJECT):
+            raise ValueError("mode must be 'block', 'throttle' or 'reject'")
+        low = high if low is None else low
+        if low > high:
+            raise ValueError("low must not be greater than high")
+        self.tube = tube
+        self.high = high
+        self.low = low
+        self.mode = mode
+        self.interval = interval
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate)
+        self.depth = 0
+        self.overloaded = False
+        self.rejected = 0
+        self._sampled = None
+        self._lock = threading.Lock()
+
+    def sample(self, force=False):
+        """
+        Update `depth` and `overloaded` from the tube statistics, if
+        `interval` is passed since the last update.
+
+        :rtype: boolean - `overloaded`
+        """
+        with self._lock:
+            now = time.time()
+            if (force or self._sampled is None or
+                    now - self._sampled >= self.interval):
+                self._sampled = now
+                try:
+                    tasks = self.tube.statistics()['tasks']
+                except KeyError:
+                    tasks = {}
+                self.depth = (int(tasks.get('ready', 0)) +
+                              int(tasks.get('delayed', 0)))
+                if self.depth >= self.high:
+                    self.overloaded = True
+                elif self.depth <= self.low:
+                    self.overloaded = False
+            return self.overloaded
+
+    def admit(self):
+        """
+        Wait until a new task may be put into the tube. Raises
+        `RejectedException` if it may not.
+        """
+        if not self.sample():
+            return
+        if self.mode == self.THROTTLE:
+            self.bucket.acquire()
+            return
+        if self.mode == self.BLOCK:
+            deadline = None
+            if self.timeout is not None:
+                deadline = time.time() + self.timeout
+            while deadline is None or time.time() < deadline:
+                delay = self.interval
+                if deadline is not None:
+                    delay = min(delay, deadline - time.time())
+                time.sleep(max(delay, 0))
+                if not self.sample():
+                    return
+        self.rejected += 1
+        raise AdmissionController.RejectedException(
+            "tube is overloaded: %d tasks" % self.depth)
+
+    def put(self, data, **kwargs):
+        """
+        Same as :meth:`Tube.put() <tarantool_queue.Tube.put>`, but waits
+        for admission first.
+        """
+        self.admit()
+        return self.tube.put(data, **kwargs)
+
+
+class BloomFilter(object):
+    """
+    Bloom filter over byte strings with `size` bits and `hashes` hash
+    functions.
+
+    :type size: int
+    :type hashes: int
+    """
+    def __init__(self, size=1 << 20, hashes=4):
+        if size < 8 or hashes < 1:
+            raise ValueError("size and hashes are too small")
+        self.size = size
+        self.hashes = hashes
+        self.bits = bytearray((size + 7) // 8)
+
+    def _positions(self, key):
+        h1, h2 = struct.unpack("<QQ", hashlib.md5(key).digest())
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        for pos in self._positions(key):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class DedupFilter(object):
+    """
+    Client-side dedup cache in front of :meth:`Tube.put_unique()
+    <tarantool_queue.Tube.put_unique>`. Keys of recently sent tasks are
+    kept in an LRU cache for `ttl` seconds, a task with a cached key is
+    dropped without a round trip. Other tasks go to the server.
+
+    With `bloom_size` the keys are also remembered in a Bloom filter,
+    that is renewed every `ttl` seconds. If the tube has no other
+    producers (`exclusive` is True), tasks whose keys are surely not in
+    the filter are sent with cheaper `queue.put`, and only uncertain ones
+    go to `queue.put_unique`.
+    Usage:
+
+        >>> dedup = DedupFilter(tube, capacity=100000, ttl=60,
+        ...                     key=lambda data: data['url'])
+        >>> dedup.put({'url': 'http://tarantool.org'})  # `Task` instance
+        >>> dedup.put({'url': 'http://tarantool.org'})  # dropped
+            None
+
+    :param tube: `Tube` instance to put tasks into
+    :param capacity: maximum number of keys in LRU cache
+    :param ttl: time to remember the key in seconds
+    :param key: function that returns key (bytes or hashable) for data,
+                default is SHA1 of serialized data
+    :param bloom_size: size of Bloom filter in bits, None - no filter
+    :param bloom_hashes: number of hash functions of Bloom filter
+    :param exclusive: the tube has no other producers
+    :type capacity: int
+    :type ttl: float
+    :type bloom_size: int or None
+    :type bloom_hashes: int
+    :type exclusive: boolean
+    """
+    def __init__(self, tube, capacity=100000, ttl=60, key=None,
+                 bloom_size=None, bloom_hashes=4, exclusive=False):
+        if capacity < 1:
+            raise ValueError("capacity must be positive")
+        self.tube = tube
+        self.capacity = capacity
+        self.ttl = ttl
+        self.key = key
+        self.bloom_size = bloom_size
+        self.bloom_hashes = bloom_hashes
+        self.exclusive = exclusive
+        self.dropped = 0
+        self.uncertain = 0
+        self._cache = collections.OrderedDict()
+        self._blooms = []
+        self._rotated = time.time()
+        if bloom_size:
+            self._blooms = [BloomFilter(bloom_size, bloom_hashes)]
+        self._lock = threading.Lock()
+
+    def _make_key(self, data, raw_data):
+        if self.key is None:
+            return hashlib.sha1(raw_data).digest()
+        key = self.key(data)
+        if not isinstance(key, bytes):
+            key = repr(key).encode('utf-8')
+        return key
+
+    def _rotate(self, now):
+        if self._blooms and now - self._rotated >= self.ttl:
+            self._blooms = [BloomFilter(self.bloom_size, self.bloom_hashes),
+                            self._blooms[0]]
+            self._rotated = now
+
+    def _check(self, key):
+        now = time.time()
+        with self._lock:
+            self._rotate(now)
+            stamp = self._cache.get(key)
+            if stamp is not None:
+                if now - stamp < self.ttl:
+                    self.dropped += 1
+                    return None
+                del self._cache[key]
+            if not self._blooms:
+                return "queue.put_unique"
+            for bloom in self._blooms:
+                if key in bloom:
+                    self.uncertain += 1
+                    return "queue.put_unique"
+            return "queue.put" if self.exclusive else "queue.put_unique"
+
+    def _remember(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
+            self._cache[key] = time.time()
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+            if self._blooms:
+                self._blooms[0].add(key)
+
+    def put(self, data, **kwargs):
+        """
+        Same as :meth:`Tube.put_unique()
+        <tarantool_queue.Tube.put_unique>`, but returns None at once if
+        the task was sent recently.
+        """
+        raw_data = self.tube.serialize(data)
+        key = self._make_key(data, raw_data)
+        method = self._check(key)
+        if method is None:
+            return None
+        # payload is not wrapped, so it's the same for put and put_unique
+        task = self.tube._produce_raw(method, raw_data, **kwargs)
+        self._remember(key)
+        return task
+
+    def forget(self, data):
+        """
+        Remove the key of data from LRU cache, e.g. when the task is done
+        and may be put again.
+        """
+        key = self._make_key(data, self.tube.serialize(data))
+        with self._lock:
+            self._cache.pop(key, None)
+
+
+class CoalescingProducer(object):
+    """
+    Producer for a Tube, that merges tasks with the same key. The first
+    put of a key is delayed for `window` seconds, and puts of the same key
+    during the window are merged into it: the last one wins, or
+    `merge(old_data, new_data)` is used. Then the background thread sends
+    one task per key.
+    Usage:
+
+        >>> producer = CoalescingProducer(tube, key=lambda data: data['key'],
+        ...                               window=0.5)
+        >>> producer.put({'key': 'user:1'})
+        >>> producer.put({'key': 'user:1'})  # merged with the previous one
+        >>> producer.close()
+
+    :param tube: `Tube` instance to put tasks into
+    :param key: function that returns hashable key for data
+    :param window: time to wait for the tasks with the same key in seconds
+    :param merge: function that merges data of two tasks,
+                  None - the last one wins
+    :param maxsize: maximum number of pending keys, `put` of a new key
+                    waits while there are more
+    :type window: float
+    :type maxsize: int
+    """
+
+    class ClosedException(Exception):
+        pass
+
+    def __init__(self, tube, key, window=1.0, merge=None, maxsize=100000):
+        if maxsize < 1:
+            raise ValueError("maxsize must be positive")
+        self.tube = tube
+        self.key = key
+        self.window = window
+        self.merge = merge
+        self.maxsize = maxsize
+        self.merged = 0
+        self.sent = 0
+        self.failed = 0
+        self.last_error = None
+        self._pending = collections.OrderedDict()
+        self._sending = 0
+        self._force = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run,
+                                        name='CoalescingProducer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def pending(self):
+        """
+        Number of keys, that are not sent yet.
+        """
+        with self._cond:
+            return len(self._pending) + self._sending
+
+    def put(self, data, **kwargs):
+        """
+        Enqueue a task after the window or merge it into a pending task
+        with the same key. Accepts the same arguments as
+        :meth:`Tube.put() <tarantool_queue.Tube.put>`.
+        """
+        key = self.key(data)
+        with self._cond:
+            # the key may become pending while waiting for free space
+            while True:
+                if self._closed:
+                    raise CoalescingProducer.ClosedException(
+                        "producer is closed")
+                entry = self._pending.get(key)
+                if entry is not None:
+                    if self.merge is not None:
+                        data = self.merge(entry[1], data)
+                    entry[1] = data
+                    entry[2] = kwargs
+                    self.merged += 1
+                    return
+                if len(self._pending) < self.maxsize:
+                    break
+                self._cond.wait()
+            self._pending[key] = [time.time() + self.window, data, kwargs]
+            self._cond.notify_all()
+
+    def _due(self):
+        now = time.time()
+        batch = []
+        while self._pending:
+            key, entry = next(iter(self._pending.items()))
+            if entry[0] > now and not self._force and not self._closed:
+                return batch, entry[0] - now
+            del self._pending[key]
+            batch.append(entry)
+        return batch, None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                batch, wait = self._due()
+                while not batch:
+                    if self._closed:
+                        return
+                    self._force = False
+                    self._cond.notify_all()
+                    self._cond.wait(wait)
+                    batch, wait = self._due()
+                self._sending = len(batch)
+                self._cond.notify_all()
+            for _, data, kwargs in batch:
+                try:
+                    self.tube.put(data, **kwargs)
+                except Exception as e:
+                    self.failed += 1
+                    self.last_error = e
+                else:
+                    self.sent += 1
+            with self._cond:
+                self._sending = 0
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Send all pending tasks without waiting for their windows.
+
+        :param timeout: time to wait in seconds, None - wait forever
+        :type timeout: float or None
+        :rtype: boolean - True if everything is sent
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self._cond:
+            self._force = True
+            self._cond.notify_all()
+            while self._pending or self._sending:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """
+        Stop accepting tasks, send all pending tasks and stop the
+        background thread.
+
+        :rtype: boolean - True if everything is sent
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        flushed = self.flush(timeout)
+        self._thread.join(timeout)
+        return flushed
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter: `rate` tokens per second, at most `burst`
+    tokens are saved up.
+
+    :param rate: tokens per second
+    :param burst: size of the bucket, default is `rate`
+    :type rate: float
+    :type burst: float or None
+    """
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self._tokens = self.burst
+        self._stamp = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def try_acquire(self, tokens=1):
+        """
+        Take tokens if there are enough of them.
+
+        :rtype: boolean
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1):
+        """
+        Take tokens, sleeping until there are enough of them.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
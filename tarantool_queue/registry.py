@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import weakref
+import threading
+from collections import OrderedDict
+
+
+class TubeRegistry(object):
+    """
+    Registry of tubes of `Queue` with bounded memory. At most `maxsize`
+    tubes with default options are kept, the least recently used are
+    dropped. Tubes with changed options, serializers, retry policy,
+    offloading or coalescing are kept always, and tubes held by callers
+    are found until they are collected, so dropping a tube loses nothing
+    but the object.
+
+    :param maxsize: number of kept tubes with default options
+    :type maxsize: int
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._refs = weakref.WeakValueDictionary()
+        self._recent = OrderedDict()
+        self._pinned = {}
+
+    def get(self, name, default=None):
+        with self._lock:
+            tube = self._refs.get(name)
+            if tube is None:
+                return default
+            if name in self._recent:
+                # move to the end, OrderedDict of Python 2 has no
+                # move_to_end()
+                del self._recent[name]
+                self._recent[name] = tube
+            elif name not in self._pinned:
+                self._add(name, tube)
+            return tube
+
+    def __setitem__(self, name, tube):
+        with self._lock:
+            self._refs[name] = tube
+            self._recent.pop(name, None)
+            self._pinned.pop(name, None)
+            self._add(name, tube)
+
+    def _add(self, name, tube):
+        self._recent[name] = tube
+        while len(self._recent) > self.maxsize:
+            name, tube = self._recent.popitem(last=False)
+            if not tube._is_default():
+                self._pinned[name] = tube
+
+    def __getitem__(self, name):
+        tube = self.get(name)
+        if tube is None:
+            raise KeyError(name)
+        return tube
+
+    def __contains__(self, name):
+        return name in self._refs
+
+    def __len__(self):
+        return len(self._refs)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return list(self._refs.keys())
+
+    def values(self):
+        return list(self._refs.values())
+
+    def items(self):
+        return list(self._refs.items())
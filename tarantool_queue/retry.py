@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+import time
+import random
+import threading
+
+
+class RetryPolicy(object):
+    """
+    Retry policy for failed tasks: release the task with exponential
+    backoff and jitter, bury it after `max_attempts` attempts.
+
+    The number of attempts is counted in one of two modes:
+
+    * 'release' - number of takes of the task from its metadata
+      (`ctaken`), the task is released with delay.
+    * 'put' - counter in the envelope of the task payload, the task is
+      put again with the incremented counter and delay (keeping its
+      priority, ttr and remaining ttl), and the original task is acked.
+      Use it if tasks may be taken without failure, e.g. released on
+      shutdown.
+
+    Delay is at least one second, unless `base` is 0.
+
+    If task metadata has no number of takes (:class:`TQueue
+    <tarantool_queue.TQueue>` and :class:`NQueue <tarantool_queue.NQueue>`),
+    attempts are counted as in 'put' mode.
+
+    The policy may be set as `Tube.retry_policy` and used with
+    :meth:`Task.retry() <tarantool_queue.Task.retry>`, or used directly.
+    Usage:
+
+        >>> tube.retry_policy = RetryPolicy(max_attempts=5, base=1)
+        >>> task = tube.take()
+        >>> try:
+        ...     handle(task.data)
+        ... except Exception:
+        ...     task.retry()
+        ... else:
+        ...     task.ack()
+        # or
+        >>> tube.retry_policy.process(tube.take(), handle_task)
+
+    :param max_attempts: bury the task after this number of attempts
+    :param base: delay after the first attempt in seconds
+    :param factor: delay multiplier for every next attempt
+    :param max_delay: maximum delay in seconds
+    :param jitter: part of the delay that is random, from 0 to 1
+    :param mode: 'release' or 'put'
+    :type max_attempts: int
+    :type base: float
+    :type factor: float
+    :type max_delay: float
+    :type jitter: float
+    :type mode: string
+    """
+
+    RELEASE = 'release'
+    PUT = 'put'
+
+    def __init__(self, max_attempts=5, base=1, factor=2, max_delay=3600,
+                 jitter=0.5, mode=RELEASE):
+        if mode not in (self.RELEASE, self.PUT):
+            raise ValueError("mode must be 'release' or 'put'")
+        if not 0 <= jitter <= 1:
+            raise ValueError("jitter must be from 0 to 1")
+        self.max_attempts = max_attempts
+        self.base = base
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.mode = mode
+        self.retried = 0
+        self.buried = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def attempts(self, task):
+        """
+        Number of attempts to process the task, including current one.
+
+        :rtype: int
+        """
+        if self._in_envelope(task):
+            envelope = task.envelope or {}
+            return envelope.get('attempt', 0) + 1
+        meta = task.meta_cached
+        return meta['ctaken'] if meta else 1
+
+    def _in_envelope(self, task):
+        if self.mode == self.PUT:
+            return True
+        meta = task.meta_cached
+        return meta is not None and 'ctaken' not in meta
+
+    def delay(self, attempts):
+        """
+        Delay in seconds before the next attempt.
+
+        :rtype: int
+        """
+        delay = min(self.max_delay,
+                    self.base * self.factor ** (attempts - 1))
+        delay *= 1 - self.jitter * random.random()
+        if not self.base:
+            return 0
+        return max(int(round(delay)), 1)
+
+    def _put_options(self, task, delay):
+        """
+        Options to put the task again: its priority, ttr and remaining
+        ttl, times in metadata are in microseconds.
+        """
+        opt = {'delay': delay}
+        meta = task.meta_cached
+        if meta is None or 'pri' not in meta:
+            return opt
+        now = meta.get('now') or time.time() * 1000000
+        opt['pri'] = int(meta['pri'])
+        opt['ttr'] = meta['ttr'] // 1000000
+        if meta['ttl']:
+            opt['ttl'] = max(
+                int((meta['created'] + meta['ttl'] - now) / 1000000), 1)
+        return opt
+
+    def fail(self, task):
+        """
+        Release the task with backoff or bury it, if it has no attempts
+        left.
+
+        :rtype: boolean - True if the task will be retried
+        """
+        attempts = self.attempts(task)
+        if attempts >= self.max_attempts:
+            task.bury()
+            with self._lock:
+                self.buried += 1
+            return False
+        delay = self.delay(attempts)
+        if self._in_envelope(task):
+            tube = task.queue.tube(task.tube)
+            raw_data = task._rewrap({'attempt': attempts})
+            tube._produce_raw("queue.put", raw_data,
+                              **self._put_options(task, delay))
+            # the new task refers to the same offloaded payload
+            task._ack_keeping_blob()
+        else:
+            task.release(delay=delay)
+        with self._lock:
+            self.retried += 1
+        return True
+
+    def process(self, task, handler):
+        """
+        Call `handler(task)`, ack the task on success or
+        :meth:`fail` it on exception. The exception is saved into
+        `last_error`.
+
+        :rtype: boolean - True if the task is processed
+        """
+        try:
+            handler(task)
+        except Exception as e:
+            self.last_error = e
+            self.fail(task)
+            return False
+        task.ack()
+        return True
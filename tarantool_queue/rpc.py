@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+import time
+import uuid
+import threading
+
+from .future import Future
+
+
+class RemoteException(Exception):
+    """
+    Exception raised by the handler of request on server side.
+    """
+    pass
+
+
+def reply(task, result=None, error=None):
+    """
+    Send reply to request task made by :meth:`RpcClient.call()
+    <tarantool_queue.RpcClient.call>` and ack the task.
+
+    :param task: `Task` instance of request
+    :param result: result of request
+    :param error: error message, if request failed
+    :type error: string or None
+    """
+    envelope = task.envelope or {}
+    reply_to = envelope.get('reply_to')
+    if reply_to is not None:
+        tube = task.queue.tube(reply_to)
+        headers = {'cid': envelope.get('cid')}
+        if error is not None:
+            headers['error'] = error
+        tube._produce_raw("queue.put",
+                          tube._wrap(tube.serialize(result), headers),
+                          ttl=envelope.get('reply_ttl', 0))
+    task.ack()
+
+
+class RpcServer(object):
+    """
+    Server side of request/reply over tubes: takes requests from tube,
+    calls `handler(data)` and replies with its result or with the message
+    of its exception.
+    Usage:
+
+        >>> server = RpcServer(queue.tube('requests'), handle)
+        >>> while True:
+        ...     server.serve(timeout=1)
+
+    :param tube: `Tube` instance with requests
+    :param handler: function, that takes request data and returns result
+    """
+    def __init__(self, tube, handler):
+        self.tube = tube
+        self.handler = handler
+
+    def serve(self, timeout=0):
+        """
+        Process one request, if it appears in `timeout` seconds.
+
+        :rtype: boolean - True if request was processed
+        """
+        task = self.tube.take(timeout)
+        if task is None:
+            return False
+        try:
+            result = self.handler(task.data)
+        except Exception as e:
+            reply(task, error=str(e) or type(e).__name__)
+        else:
+            reply(task, result)
+        return True
+
+
+class RpcClient(object):
+    """
+    Client side of request/reply over tubes. Every request is put into
+    `tube` with correlation id and name of reply tube in the envelope, a
+    single listener thread long-polls the reply tube and resolves futures
+    of requests, so many requests in flight cost one poll. The listener
+    uses a clone of the queue (see :meth:`Queue.clone()
+    <tarantool_queue.Queue.clone>`) with its own connection, so it doesn't
+    block other requests. Configure the reply tube (e.g. offloading)
+    before the first call.
+    Usage:
+
+        >>> client = RpcClient(queue, 'requests')
+        >>> future = client.call({'user': 1}, timeout=5)
+        >>> future.result(5)
+            {'name': 'Brian'}
+        >>> client.close()
+
+    :param queue: `Queue` instance
+    :param tube: name of tube with requests
+    :param reply_tube: name of reply tube, unique per client by default
+    :param poll: timeout of long-poll of reply tube in seconds
+    :type tube: string
+    :type reply_tube: string or None
+    :type poll: int
+    """
+    def __init__(self, queue, tube, reply_tube=None, poll=1):
+        self.queue = queue
+        self.tube = queue.tube(tube)
+        self.reply_tube = reply_tube or 'reply_' + uuid.uuid4().hex
+        self.poll = poll
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        self._listener = None
+
+    def _start(self):
+        with self._lock:
+            if self._running:
+                return
+            # settings of reply tube (e.g. offloading) are cloned too
+            self.queue.tube(self.reply_tube)
+            self._listener = self.queue.clone().tube(self.reply_tube)
+            self._running = True
+            self._thread = threading.Thread(target=self._listen,
+                                            name='RpcClient')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def call(self, data, timeout=None, **kwargs):
+        """
+        Put request and return future for its result. If server fails,
+        the future raises :class:`RemoteException
+        <tarantool_queue.RemoteException>`. If there's no reply in
+        `timeout` seconds, the future raises `Future.TimeoutException`
+        and the request expires in queue.
+
+        :param data: Data of request
+        :param timeout: time to wait for reply, None - wait forever
+        :type timeout: float or None
+        :rtype: `Future` instance
+        """
+        self._start()
+        cid = uuid.uuid4().hex
+        future = Future()
+        deadline = None
+        headers = {'cid': cid, 'reply_to': self.reply_tube}
+        if timeout is not None:
+            deadline = time.time() + timeout
+            headers['reply_ttl'] = int(timeout) + 1
+            kwargs.setdefault('ttl', int(timeout) + 1)
+        with self._lock:
+            self._pending[cid] = (future, deadline)
+        try:
+            self.tube._produce_raw(
+                "queue.put",
+                self.tube._wrap(self.tube.serialize(data), headers),
+                **kwargs)
+        except Exception:
+            with self._lock:
+                self._pending.pop(cid, None)
+            raise
+        return future
+
+    @property
+    def in_flight(self):
+        """
+        Number of requests waiting for reply.
+        """
+        with self._lock:
+            return len(self._pending)
+
+    def _expire(self):
+        now = time.time()
+        with self._lock:
+            expired = [cid for cid, (_, deadline) in self._pending.items()
+                       if deadline is not None and deadline < now]
+            futures = [self._pending.pop(cid)[0] for cid in expired]
+        for future in futures:
+            future.set_exception(Future.TimeoutException("no reply"))
+
+    def _listen(self):
+        while self._running:
+            try:
+                task = self._listener.take(self.poll)
+            except Exception:
+                time.sleep(self.poll)
+                continue
+            if task is not None:
+                self._dispatch(task)
+            self._expire()
+
+    def _dispatch(self, task):
+        envelope = task.envelope or {}
+        with self._lock:
+            entry = self._pending.pop(envelope.get('cid'), None)
+        if entry is not None:
+            try:
+                if 'error' in envelope:
+                    entry[0].set_exception(RemoteException(envelope['error']))
+                else:
+                    entry[0].set_result(task.data)
+            except Exception as e:
+                entry[0].set_exception(e)
+        task.ack()
+
+    def close(self):
+        """
+        Stop the listener. Requests in flight fail with
+        `Future.TimeoutException`.
+        """
+        with self._lock:
+            running, self._running = self._running, False
+        if running:
+            self._thread.join()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future, _ in pending.values():
+            future.set_exception(Future.TimeoutException("client is closed"))
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+import os
+import mmap
+import zlib
+import time
+import socket
+import struct
+import threading
+import collections
+
+# state, length of body, crc32 of body
+_HEADER = struct.Struct("<BII")
+# delay, ttl, ttr, pri, length of tube name
+_OPTIONS = struct.Struct("<qqqqI")
+
+_EMPTY = 0
+_PENDING = 1
+_DONE = 2
+
+
+def _encode(raw_data, opt):
+    tube = opt['tube']
+    if not isinstance(tube, bytes):
+        tube = tube.encode('utf-8')
+    header = _OPTIONS.pack(int(opt['delay']), int(opt['ttl']),
+                           int(opt['ttr']), int(opt['pri']), len(tube))
+    return header + tube + raw_data
+
+
+def _decode(body):
+    delay, ttl, ttr, pri, length = _OPTIONS.unpack_from(body, 0)
+    start = _OPTIONS.size
+    opt = {
+        'delay': delay,
+        'ttl': ttl,
+        'ttr': ttr,
+        'pri': pri,
+        'tube': body[start:start + length].decode('utf-8')
+    }
+    return body[start + length:], opt
+
+
+class _Segment(object):
+    """
+    Preallocated memory-mapped file with records. Every record is a header
+    and a body, state of record is written last, so torn writes are
+    detected on start by the state and the checksum.
+    """
+    def __init__(self, path, size):
+        self.path = path
+        if os.path.exists(path):
+            self._file = open(path, 'r+b')
+            size = os.path.getsize(path)
+        else:
+            self._file = open(path, 'w+b')
+            self._file.truncate(size)
+        self.size = size
+        self.mm = mmap.mmap(self._file.fileno(), size)
+        self.read_pos = None
+        self.write_pos = 0
+        self.pending = 0
+        self._scan()
+
+    def _scan(self):
+        pos = 0
+        while pos + _HEADER.size <= self.size:
+            state, length, crc = _HEADER.unpack_from(self.mm, pos)
+            if state == _EMPTY:
+                break
+            start = pos + _HEADER.size
+            end = start + length
+            if (state not in (_PENDING, _DONE) or end > self.size or
+                    zlib.crc32(self.mm[start:end]) & 0xffffffff != crc):
+                self.mm[pos:pos + _HEADER.size] = b'\0' * _HEADER.size
+                break
+            if state == _PENDING:
+                if self.read_pos is None:
+                    self.read_pos = pos
+                self.pending += 1
+            pos = end
+        self.write_pos = pos
+        if self.read_pos is None:
+            self.read_pos = pos
+
+    def append(self, body, sync=True):
+        pos = self.write_pos
+        start = pos + _HEADER.size
+        end = start + len(body)
+        if end > self.size:
+            return False
+        self.mm[start:end] = body
+        crc = zlib.crc32(body) & 0xffffffff
+        _HEADER.pack_into(self.mm, pos, _EMPTY, len(body), crc)
+        struct.pack_into("<B", self.mm, pos, _PENDING)
+        if sync:
+            self.mm.flush()
+        self.write_pos = end
+        self.pending += 1
+        return True
+
+    def read(self):
+        pos = self.read_pos
+        while pos < self.write_pos:
+            state, length, _ = _HEADER.unpack_from(self.mm, pos)
+            start = pos + _HEADER.size
+            if state == _PENDING:
+                self.read_pos = pos
+                return pos, self.mm[start:start + length]
+            pos = start + length
+        self.read_pos = pos
+        return None
+
+    def mark_done(self, pos, sync=True):
+        _, length, _ = _HEADER.unpack_from(self.mm, pos)
+        struct.pack_into("<B", self.mm, pos, _DONE)
+        if sync:
+            self.mm.flush()
+        self.pending -= 1
+        self.read_pos = pos + _HEADER.size + length
+
+    def close(self):
+        self.mm.close()
+        self._file.close()
+
+    def remove(self):
+        self.close()
+        os.unlink(self.path)
+
+
+class Spool(object):
+    """
+    Disk-backed spool for a Tube. :meth:`put` sends the task to the server
+    directly, but if the server is unreachable (or the put took more than
+    `slow` seconds) the task is appended to the spool, and the following
+    puts go to the spool too, until the background thread drains it and
+    no task is spooled for `retry_interval` seconds. The spool is a
+    directory of memory-mapped segment files, so tasks survive the
+    restart of the process and are sent in order.
+    Usage:
+
+        >>> spool = Spool(queue.tube('tube'), '/var/spool/tube')
+        >>> spool.put([1, 2, 3])  # `Task` instance or None if spooled
+        >>> spool.depth
+            0
+        >>> spool.close()
+
+    :param tube: `Tube` instance to put tasks into
+    :param path: directory for segment files
+    :param segment_size: size of one segment file in bytes
+    :param max_segments: maximum number of segment files, bounds disk usage
+    :param retry_interval: time between attempts to send a spooled task
+                           while the server is unreachable
+    :param slow: put time in seconds after which puts go to the spool,
+                 None - spool only when the server is unreachable
+    :param sync: flush segment to disk on every write
+    :type path: string
+    :type segment_size: int
+    :type max_segments: int
+    :type retry_interval: float
+    :type slow: float or None
+    :type sync: boolean
+    """
+
+    class FullException(Exception):
+        pass
+
+    def __init__(self, tube, path, segment_size=16 * 1024 * 1024,
+                 max_segments=64, retry_interval=1.0, slow=None, sync=True):
+        if segment_size <= _HEADER.size + _OPTIONS.size:
+            raise ValueError("segment_size is too small")
+        if max_segments < 1:
+            raise ValueError("max_segments must be positive")
+        self.tube = tube
+        self.path = path
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.retry_interval = retry_interval
+        self.slow = slow
+        self.sync = sync
+        self.spooled = 0
+        self.drained = 0
+        self.failed = 0
+        self.last_error = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._segments = collections.deque()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        names = sorted(name for name in os.listdir(path)
+                       if name.endswith('.seg'))
+        for name in names:
+            self._segments.append(
+                _Segment(os.path.join(path, name), segment_size))
+        self._seqno = int(names[-1][:-4]) + 1 if names else 0
+        if not self._segments:
+            self._add_segment()
+        self._bypass = self.depth > 0
+        self._thread = threading.Thread(target=self._run, name='Spool')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def depth(self):
+        """
+        Number of spooled tasks, that are not sent yet.
+        """
+        with self._cond:
+            return sum(segment.pending for segment in self._segments)
+
+    @property
+    def disk_usage(self):
+        """
+        Size of segment files in bytes.
+        """
+        with self._cond:
+            return sum(segment.size for segment in self._segments)
+
+    def _add_segment(self):
+        name = os.path.join(self.path, '%020d.seg' % self._seqno)
+        self._seqno += 1
+        segment = _Segment(name, self.segment_size)
+        self._segments.append(segment)
+        return segment
+
+    def _unavailable(self):
+        return (self.tube.queue.NetworkError, socket.error)
+
+    def put(self, data, **kwargs):
+        """
+        Enqueue a task or spool it. Accepts the same arguments as
+        :meth:`Tube.put() <tarantool_queue.Tube.put>`.
+
+        :rtype: `Task` instance or None if the task is spooled
+        """
+        raw_data = self.tube._wrap(self.tube.serialize(data))
+        if not self._bypass:
+            start = time.time()
+            try:
+                task = self.tube._produce_raw("queue.put", raw_data, **kwargs)
+            except self._unavailable() as e:
+                self.last_error = e
+            else:
+                if self.slow is not None and time.time() - start > self.slow:
+                    with self._cond:
+                        self._bypass = True
+                        self._cond.notify_all()
+                return task
+        self._append(_encode(raw_data, dict(self.tube.opt, **kwargs)))
+        return None
+
+    def _append(self, body):
+        # check everything before the spool is changed
+        if _HEADER.size + len(body) > self.segment_size:
+            raise ValueError("task is larger than segment")
+        with self._cond:
+            segment = self._segments[-1]
+            if not segment.append(body, self.sync):
+                if len(self._segments) >= self.max_segments:
+                    raise Spool.FullException("spool is full")
+                segment = self._add_segment()
+                segment.append(body, self.sync)
+            self._bypass = True
+            self.spooled += 1
+            self._cond.notify_all()
+
+    def _next(self):
+        while True:
+            segment = self._segments[0]
+            record = segment.read()
+            if record is not None:
+                return segment, record
+            if len(self._segments) == 1:
+                return None
+            self._segments.popleft().remove()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and self.depth == 0:
+                    if not self._bypass:
+                        self._cond.wait()
+                        continue
+                    # spool puts for a while after the spool is drained
+                    # or a put was slow
+                    self._cond.wait(self.retry_interval)
+                    if self.depth == 0:
+                        self._bypass = False
+                if self._closed:
+                    for segment in self._segments:
+                        segment.close()
+                    return
+                segment, (pos, body) = self._next()
+            raw_data, opt = _decode(body)
+            try:
+                self.tube._produce_raw("queue.put", raw_data, **opt)
+            except self._unavailable() as e:
+                self.last_error = e
+                with self._cond:
+                    if not self._closed:
+                        self._cond.wait(self.retry_interval)
+                continue
+            except Exception as e:
+                self.last_error = e
+                self.failed += 1
+            else:
+                self.drained += 1
+            with self._cond:
+                segment.mark_done(pos, self.sync)
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Wait until the spool is drained.
+
+        :param timeout: time to wait in seconds, None - wait forever
+        :type timeout: float or None
+        :rtype: boolean - True if the spool is empty
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self._cond:
+            while self.depth:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=0):
+        """
+        Stop the background thread. Tasks that are not sent stay on the
+        disk and are sent by the next Spool with the same path. The thread
+        finishes the put in progress, if any, and closes segment files.
+
+        :param timeout: time to wait for the spool to drain and the thread
+                        to stop, None - wait forever
+        :type timeout: float or None
+        :rtype: boolean - True if the spool is empty
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        flushed = self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if deadline is None:
+            self._thread.join()
+        else:
+            self._thread.join(max(deadline - time.time(), 0))
+        return flushed
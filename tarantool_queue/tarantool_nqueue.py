@@ -0,0 +1,445 @@
+# -*- coding: utf-8 -*-
+import re
+import time
+import msgpack
+
+from .tarantool_queue import Queue, Tube, Task
+from .tracing import wrap
+from .blobstore import parse_reference
+
+# task statuses of `queue` module of Tarantool 1.6+
+STATUSES = {
+    'r': 'ready',
+    't': 'taken',
+    '-': 'done',
+    '!': 'buried',
+    '~': 'delayed',
+}
+# tube name is a part of the name of called function
+TUBE_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def _native(func):
+    return func is NQueue.basic_serialize or func is NQueue.basic_deserialize
+
+
+class NTask(Task):
+    """
+    Task of Tarantool 1.6+ queue. Ids of tasks are unique only in their
+    tube, so `task_id` is a pair of tube name and id.
+
+    .. warning::
+
+        Don't instantiate it with your bare hands
+    """
+    def touch(self, delta=None):
+        """
+        Prolong living time for taken task with this id by `delta`
+        seconds, `ttr` of the tube by default.
+
+        :rtype: boolean
+        """
+        return self.queue._touch(self.task_id, delta)
+
+    def done(self, data):
+        """
+        Not supported by Tarantool 1.6+ queue.
+
+        :raises: `Queue.BadConfigException`
+        """
+        raise Queue.BadConfigException(
+            "done is not supported by Tarantool 1.6+ queue")
+
+    @property
+    def data(self):
+        if self.raw_data is None:
+            return None
+        if not hasattr(self, '_decoded_data'):
+            tube = self.queue.tube(self.tube)
+            tracer = self.queue.tracer
+            if not isinstance(self.raw_data, bytes):
+                if tracer is not None:
+                    tracer.extract(self, None)
+                self._decoded_data = tube.deserialize(self.raw_data)
+                return self._decoded_data
+            envelope, raw_data = self._unwrap()
+            if tracer is not None:
+                tracer.extract(self, envelope.get('ctx') if envelope else None)
+            key = parse_reference(raw_data)
+            if key is not None:
+                raw_data = tube._blob_store().get(key)
+            if _native(tube.deserialize) and (envelope is not None or
+                                              key is not None):
+                # wrapped native payloads are packed, see NTube._wrap()
+                self._decoded_data = msgpack.unpackb(raw_data)
+            else:
+                self._decoded_data = tube.deserialize(raw_data)
+        return self._decoded_data
+
+    @property
+    def envelope(self):
+        if not isinstance(self.raw_data, bytes):
+            return None
+        return self._unwrap()[0]
+
+    def _rewrap(self, headers):
+        if isinstance(self.raw_data, bytes):
+            return Task._rewrap(self, headers)
+        payload = self.raw_data
+        if _native(self.queue.tube(self.tube).serialize):
+            # see NTube._wrap()
+            payload = msgpack.packb(payload)
+        return wrap(payload, headers)
+
+    def _delete_blob(self):
+        if isinstance(self.raw_data, bytes):
+            Task._delete_blob(self)
+
+    def __str__(self):
+        args = (
+            self.task_id[1], self.tube, self.status
+        )
+        return "Task (id: {0}, tube:{1}, status: {2})".format(*args)
+
+    @classmethod
+    def from_response(cls, queue, tube, response):
+        """
+        Create task from the answer of tube method: tuple of task id,
+        status and data.
+        """
+        if response is None or not response.rowcount:
+            return None
+        row = response[0]
+        if not row:
+            return None
+        return cls(
+            queue,
+            task_id=(tube, row[0]),
+            tube=tube,
+            status=STATUSES.get(row[1], row[1]),
+            raw_data=row[2],
+        )
+
+
+class NTube(Tube):
+    """
+    Tube of Tarantool 1.6+ queue, created by `queue.create_tube()` on the
+    server. Options of tasks are sent as a map of numbers and data is
+    sent as is, so it's stored in native msgpack.
+
+    .. warning::
+
+        Don't instantiate it with your bare hands
+    """
+    _put_many_proc = None
+
+    def _wrap(self, raw_data, headers=None):
+        """
+        Same as :meth:`Tube._wrap() <tarantool_queue.Tube._wrap>`. Native
+        payloads are packed with msgpack, if they must be offloaded or
+        put into envelope.
+        """
+        if (self.queue.tracer is None and headers is None and
+                self._offload is None):
+            return raw_data
+        if not _native(self.serialize):
+            return Tube._wrap(self, raw_data, headers)
+        packed = msgpack.packb(raw_data)
+        wrapped = Tube._wrap(self, packed, headers)
+        return raw_data if wrapped is packed else wrapped
+
+    @staticmethod
+    def _options(opt):
+        # zero ttl and ttr mean the defaults of tube on server
+        options = {'delay': opt['delay'], 'pri': opt['pri']}
+        for key in ('ttl', 'ttr'):
+            if opt[key]:
+                options[key] = opt[key]
+        return options
+
+    def _call_args(self):
+        opt = self.opt
+        if opt.template is None:
+            opt.template = (opt['tube'], self._options(opt))
+        return opt.template
+
+    def _produce_raw(self, method, raw_data, **kwargs):
+        if method == "queue.urgent":
+            kwargs['pri'] = 0
+        elif method == "queue.put_unique":
+            raise Queue.BadConfigException(
+                "put_unique is not supported by Tarantool 1.6+ queue")
+        if not kwargs:
+            tube, options = self._call_args()
+        else:
+            opt = dict(self.opt, **kwargs)
+            tube, options = opt['tube'], self._options(opt)
+        return NTask.from_response(
+            self.queue, tube,
+            self.queue._call(tube, 'put', raw_data, options))
+
+    def urgent(self, data=None, **kwargs):
+        """
+        Same as :meth:`Tube.put() <tarantool_queue.Tube.put>` put,
+        but set highest priority (0) for this task.
+        """
+        kwargs['delay'] = 0
+        return self._produce("queue.urgent", data, **kwargs)
+
+
+class NQueue(Queue):
+    """
+    Client of `queue` module of Tarantool 1.6+ over the binary protocol
+    (needs tarantool-python 0.5 or newer). It has the API of
+    :class:`Queue <tarantool_queue.Queue>`, but calls methods of tube
+    objects (`queue.tube.<name>:put(...)`) with native arguments: numbers
+    are not converted to strings and data is not serialized, unless
+    `serialize` is set. Ids of tasks are pairs of tube name and id.
+
+    The server module has no requeue, dig, unique puts and task metadata:
+
+    * requeue and dig put a copy of the task and delete the task, so the
+      task gets a new id. The copy keeps priority, ttr and the rest of ttl
+      of fifottl and utubettl tasks. It isn't atomic: if the task is
+      acked by its consumer between the put and the delete, the copy
+      stays in the tube;
+    * :meth:`Task.done() <tarantool_queue.Task.done>` raises
+      `Queue.BadConfigException`;
+    * metadata has only 'task_id', 'tube' and 'status', so
+      :class:`RetryPolicy <tarantool_queue.RetryPolicy>` counts attempts
+      in the envelope;
+    * :meth:`Tube.put_unique() <tarantool_queue.Tube.put_unique>` raises
+      `Queue.BadConfigException`;
+    * tasks can't be read from the space, so :class:`DeadLetters
+      <tarantool_queue.DeadLetters>`, :func:`export_tube
+      <tarantool_queue.export_tube>` and
+      :meth:`LatencyMonitor.oldest_ready_age()
+      <tarantool_queue.LatencyMonitor.oldest_ready_age>` raise
+      `Queue.BadConfigException`.
+
+    Tube names must be Lua identifiers, because they are parts of the
+    names of called functions.
+    Usage:
+
+        >>> from tarantool_queue import NQueue
+        >>> queue = NQueue('localhost', 3301)
+        >>> tube = queue.tube('holy_grail', ttl=100)
+        >>> tube.put({'knight': 'Arthur'})
+        >>> task = tube.take()
+        >>> task.data
+            {'knight': 'Arthur'}
+        >>> task.ack()
+            True
+    """
+    _tube_class = NTube
+    _selectable = False
+    _ack_many_proc = None
+
+    @staticmethod
+    def basic_serialize(data):
+        return data
+
+    @staticmethod
+    def basic_deserialize(data):
+        return data
+
+    def __init__(self, host="localhost", port=3301, user=None, password=None):
+        super(NQueue, self).__init__(host, port, 0)
+        self.user = user
+        self.password = password
+        self._take_meta = False
+        self._take_many_proc = False
+
+    @property
+    def tnt(self):
+        if not hasattr(self, '_tnt'):
+            with self.tarantool_lock:
+                if not hasattr(self, '_tnt'):
+                    try:
+                        self._tnt = self.tarantool_connection(
+                            self.host, self.port,
+                            user=self.user, password=self.password)
+                    except TypeError:
+                        # connections of tarantool-python < 0.5 have no
+                        # user and password
+                        raise Queue.BadConfigException(
+                            "NQueue needs tarantool-python 0.5 or newer")
+        return self._tnt
+
+    def _call(self, tube, method, *args):
+        return self.tnt.call("queue.tube.%s:%s" % (tube, method), args)
+
+    def _take_task(self, tube, timeout=0, meta=False):
+        args = () if timeout is None else (timeout,)
+        return NTask.from_response(self, tube, self._call(tube, 'take', *args))
+
+    def _ack(self, task_id):
+        tube, task_id = task_id
+        return NTask.from_response(
+            self, tube, self._call(tube, 'ack', task_id)) is not None
+
+    def _release(self, task_id, delay=0, ttl=0):
+        tube, task_id = task_id
+        options = {'delay': delay}
+        if ttl:
+            options['ttl'] = ttl
+        return NTask.from_response(
+            self, tube, self._call(tube, 'release', task_id, options))
+
+    def _bury(self, task_id):
+        tube, task_id = task_id
+        return NTask.from_response(
+            self, tube, self._call(tube, 'bury', task_id)) is not None
+
+    def _delete(self, task_id):
+        tube, task_id = task_id
+        return NTask.from_response(
+            self, tube, self._call(tube, 'delete', task_id)) is not None
+
+    def _touch(self, task_id, delta=None):
+        tube, task_id = task_id
+        if delta is None:
+            delta = self.tube(tube).opt['ttr']
+        return NTask.from_response(
+            self, tube, self._call(tube, 'touch', task_id, delta)) is not None
+
+    def _kick(self, tube, count=None):
+        self._call(tube, 'kick', count or 1)
+        return True
+
+    def _task_options(self, task_id):
+        """
+        Options of the task to put its copy with: 'pri', 'ttr' and the
+        rest of 'ttl' from the tuple of fifottl or utubettl task in the
+        space of tube. Empty for tasks of other drivers.
+        """
+        tube, task_id = task_id
+        try:
+            rows = self.tnt.select(tube, task_id)
+        except Queue.DataBaseError:
+            return {}
+        # task_id, status, next_event, ttl, ttr, pri, created, [utube,] data
+        if not rows or len(rows[0]) < 8:
+            return {}
+        ttl, ttr, pri, created = rows[0][3:7]
+        # times are in microseconds
+        now = time.time() * 1000000
+        return {'pri': pri, 'ttr': ttr // 1000000,
+                'ttl': max(int((created + ttl - now) / 1000000), 1)}
+
+    def _copy(self, task_id, status=None):
+        """
+        Put a copy of the task (with status, if given) at the end of its
+        tube and delete the task. The copy has the options of the task,
+        see :meth:`_task_options`.
+
+        It isn't atomic: if the task is acked or deleted between the put
+        and the delete, the copy stays in the tube.
+        """
+        task = self.peek(task_id)
+        if task is None:
+            return False
+        # it's not ours to release
+        task.modified = True
+        if status is not None and task.status != status:
+            return False
+        self.tube(task.tube)._produce_raw("queue.put", task.raw_data,
+                                          **self._task_options(task_id))
+        return self._delete(task_id)
+
+    def _requeue(self, task_id):
+        return self._copy(task_id)
+
+    def _dig(self, task_id):
+        return self._copy(task_id, 'buried')
+
+    def _meta(self, task_id):
+        task = self.peek(task_id)
+        if task is None:
+            return None
+        task.modified = True
+        return {'task_id': task.task_id, 'tube': task.tube,
+                'status': task.status}
+
+    def meta_many(self, task_ids, columns=False, batch=1000):
+        """
+        Return metadata of many tasks, one request per task. Metadata has
+        only 'task_id', 'tube' and 'status'.
+
+        :param task_ids: pairs of tube name and id of task
+        :param columns: return dict of lists (one list per field) with
+                        found tasks instead of list of dicts
+        :type task_ids: iterable of tuples
+        :type columns: boolean
+        :rtype: list of dicts (None for not found tasks) or dict of lists
+        """
+        metas = [self._meta(task_id) for task_id in task_ids]
+        if columns:
+            found = [meta for meta in metas if meta is not None]
+            return dict((key, [meta[key] for meta in found])
+                        for key in ('task_id', 'tube', 'status'))
+        return metas
+
+    def tube(self, name, **kwargs):
+        """
+        Same as :meth:`Queue.tube() <tarantool_queue.Queue.tube>`, but the
+        name must be Lua identifier.
+        """
+        if not TUBE_NAME.match(name):
+            raise Queue.BadConfigException(
+                "name of tube must be Lua identifier: %r" % (name,))
+        return super(NQueue, self).tube(name, **kwargs)
+
+    def peek(self, task_id):
+        """
+        Return a task by task id.
+
+        :param task_id: pair of tube name and id of task
+        :type task_id: tuple
+        :rtype: `NTask` instance
+        """
+        tube, task_id = task_id
+        return NTask.from_response(self, tube,
+                                   self._call(tube, 'peek', task_id))
+
+    def peek_many(self, task_ids, batch=1000):
+        """
+        Return tasks by task ids, one request per task.
+
+        :param task_ids: pairs of tube name and id of task
+        :type task_ids: iterable of tuples
+        :rtype: list of `NTask` instances
+        """
+        return [self.peek(task_id) for task_id in task_ids]
+
+    def truncate(self, tube):
+        """
+        Truncate queue tube.
+
+        :param tube: Name of tube
+        :type tube: string
+        """
+        self._call(tube, 'truncate')
+
+    def statistics(self, tube=None):
+        """
+        Return queue module statistics in the format of
+        :meth:`Queue.statistics() <tarantool_queue.Queue.statistics>`, but
+        with numbers as values.
+
+        :param tube: Name of tube
+        :type tube: string or None
+        :rtype: dict with statistics
+        """
+        args = () if tube is None else (tube,)
+        stat = self.tnt.call("queue.statistics", args)
+        stat = stat[0] if stat.rowcount else {}
+        if isinstance(stat, (list, tuple)):
+            stat = stat[0] if stat else {}
+        if tube is not None:
+            stat = {tube: stat}
+        ans = {}
+        for name, tube_stat in stat.items():
+            ans[name] = dict(tube_stat.get('calls', {}),
+                             tasks=dict(tube_stat.get('tasks', {})))
+        return ans.get(tube, {}) if tube is not None else ans
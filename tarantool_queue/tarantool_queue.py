@@ -1,11 +1,19 @@
 # -*- coding: utf-8 -*-
 import re
+import copy
+import time
 import struct
 import msgpack
 import threading
 
 import tarantool
 
+from .coalesce import TakeCoalescer
+from .tracing import wrap, unwrap
+from .retry import RetryPolicy
+from .blobstore import make_reference, parse_reference, new_key
+from .registry import TubeRegistry
+
 
 def unpack_long_long(value):
     return struct.unpack("<q", value)[0]
@@ -15,6 +23,77 @@ def unpack_long(value):
     return struct.unpack("<l", value)[0]
 
 
+# event, cid, created, ttl, ttr, cbury, ctaken of task tuple
+META_STRUCT = struct.Struct("<qlqqqqq")
+META_NUMERIC = (3, 6, 7, 8, 9, 10, 11)
+META_KEYS = (
+    'task_id', 'tube', 'status', 'event', 'ipri',
+    'pri', 'cid', 'created', 'ttl', 'ttr', 'cbury',
+    'ctaken', 'now'
+)
+# error code of call of undefined procedure
+ER_NO_SUCH_PROC = 50
+# statuses of task tuple in space
+STATUSES = {
+    'r': 'ready',
+    '~': 'delayed',
+    't': 'taken',
+    '!': 'buried',
+    '*': 'done'
+}
+STATUS_CODES = dict((value, key) for key, value in STATUSES.items())
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+def unpack_meta(row):
+    """
+    Unpack numeric fields of task tuple (or of `queue.meta` answer)
+    with one call.
+    """
+    row = list(row)
+    values = META_STRUCT.unpack(b''.join([row[i] for i in META_NUMERIC]))
+    for index, value in zip(META_NUMERIC, values):
+        row[index] = value
+    return row
+
+
+def meta_from_row(row):
+    """
+    Unpack the answer of `queue.meta` into dict.
+    """
+    row = unpack_meta(row)
+    row[12] = unpack_long_long(row[12])
+    return dict(zip(META_KEYS, row))
+
+
+def split_statistics(stat):
+    """
+    Unpack the answer of `queue.statistics` into dict of statistics of
+    tubes by space number.
+    """
+    spaces = {}
+    if stat.rowcount > 0:
+        for k, v in zip(stat[0][0::2], stat[0][1::2]):
+            k_t = list(
+                re.match(r'space([^.]*)\.(.*)\.([^.]*)', k).groups()
+            )
+            ans = spaces.setdefault(int(k_t[0]), {})
+            if k_t[1].endswith('.tasks'):
+                k_t = k_t[0:1] + k_t[1].rsplit('.', 1) + k_t[2:3]
+            if k_t[1] not in ans:
+                ans[k_t[1]] = {'tasks': {}}
+            if len(k_t) == 4:
+                ans[k_t[1]]['tasks'][k_t[-1]] = v
+            elif len(k_t) == 3:
+                ans[k_t[1]][k_t[-1]] = v
+            else:
+                raise Queue.ZeroTupleException('stats: \
+                        error when parsing respons')
+    return spaces
+
+
 class Task(object):
     """
     Tarantool queue task wrapper.
@@ -32,6 +111,16 @@ class Task(object):
         self.space = space
         self.queue = queue
         self.modified = False
+        self._meta_row = None
+
+    def _end(self):
+        """
+        Mark the task as handled: it isn't released on collection and
+        its trace context is left.
+        """
+        self.modified = True
+        if self.queue.tracer is not None:
+            self.queue.tracer.finish(self)
 
     def ack(self):
         """
@@ -39,7 +128,20 @@ class Task(object):
 
         :rtype: `Task` instance
         """
-        self.modified = True
+        acked = self._ack_keeping_blob()
+        if acked:
+            self._delete_blob()
+        return acked
+
+    def _ack_keeping_blob(self):
+        """
+        Same as :meth:`Task.ack() <tarantool_queue.Task.ack>`, but the
+        offloaded payload isn't deleted, e.g. if another task refers to
+        it.
+        """
+        self._end()
+        if self.queue.monitor is not None:
+            self.queue.monitor.on_ack(self)
         return self.queue._ack(self.task_id)
 
     def release(self, **kwargs):
@@ -52,7 +154,7 @@ class Task(object):
         :type delay: int
         :rtype: `Task` instance
         """
-        self.modified = True
+        self._end()
         return self.queue._release(self.task_id, **kwargs)
 
     def delete(self):
@@ -61,8 +163,11 @@ class Task(object):
 
         :rtype: boolean
         """
-        self.modified = True
-        return self.queue._delete(self.task_id)
+        self._end()
+        deleted = self.queue._delete(self.task_id)
+        if deleted:
+            self._delete_blob()
+        return deleted
 
     def requeue(self):
         """
@@ -73,7 +178,7 @@ class Task(object):
 
         :rtype: boolean
         """
-        self.modified = True
+        self._end()
         return self.queue._requeue(self.task_id)
 
     def done(self, data):
@@ -84,9 +189,9 @@ class Task(object):
         :param data: Data for pushing into queue
         :rtype: boolean
         """
-        self.modified = True
+        self._end()
         the_tuple = self.queue.tnt.call("queue.done", (
-            str(self.queue.space),
+            self.queue._space_arg,
             str(self.task_id),
             self.queue.tube(self.tube).serialize(data))
         )
@@ -102,7 +207,7 @@ class Task(object):
 
         :rtype: boolean
         """
-        self.modified = True
+        self._end()
         return self.queue._bury(self.task_id)
 
     def dig(self):
@@ -112,9 +217,22 @@ class Task(object):
 
         :rtype: boolean
         """
-        self.modified = True
+        self._end()
         return self.queue._dig(self.task_id)
 
+    def retry(self):
+        """
+        Release the task with backoff or bury it according to the retry
+        policy of its tube (see :class:`RetryPolicy
+        <tarantool_queue.RetryPolicy>`).
+
+        :rtype: boolean - True if the task will be retried
+        """
+        policy = self.queue.tube(self.tube).retry_policy
+        if policy is None:
+            policy = DEFAULT_RETRY_POLICY
+        return policy.fail(self)
+
     def meta(self):
         """
         Return unpacked task metadata.
@@ -122,6 +240,23 @@ class Task(object):
         """
         return self.queue._meta(self.task_id)
 
+    @property
+    def meta_cached(self):
+        """
+        Task metadata, that was taken together with the task (see
+        :meth:`Tube.take() <tarantool_queue.Tube.take>`) or requested
+        with :meth:`Task.meta() <tarantool_queue.Task.meta>` on first
+        access.
+
+        :rtype: dict with metainformation or None
+        """
+        if not hasattr(self, '_decoded_meta'):
+            if self._meta_row is not None:
+                self._decoded_meta = meta_from_row(self._meta_row)
+            else:
+                self._decoded_meta = self.meta()
+        return self._decoded_meta
+
     def touch(self):
         """
         Prolong living time for taken task with this id.
@@ -135,10 +270,49 @@ class Task(object):
         if not self.raw_data:
             return None
         if not hasattr(self, '_decoded_data'):
-            data = self.queue.tube(self.tube).deserialize(self.raw_data)
-            self._decoded_data = data
+            envelope, raw_data = self._unwrap()
+            if self.queue.tracer is not None:
+                self.queue.tracer.extract(
+                    self, envelope.get('ctx') if envelope else None)
+            tube = self.queue.tube(self.tube)
+            key = parse_reference(raw_data)
+            if key is not None:
+                raw_data = tube._blob_store().get(key)
+            self._decoded_data = tube.deserialize(raw_data)
         return self._decoded_data
 
+    @property
+    def envelope(self):
+        """
+        Headers of the envelope of task payload (see
+        :class:`Tracer <tarantool_queue.Tracer>`) or None.
+
+        :rtype: dict or None
+        """
+        if not self.raw_data:
+            return None
+        return self._unwrap()[0]
+
+    def _rewrap(self, headers):
+        """
+        Payload of the task with `headers` added to its envelope, to put
+        the same payload again.
+        """
+        envelope, payload = self._unwrap()
+        return wrap(payload, dict(envelope or {}, **headers))
+
+    def _unwrap(self):
+        if not hasattr(self, '_envelope'):
+            self._envelope, self._payload = unwrap(self.raw_data)
+        return self._envelope, self._payload
+
+    def _delete_blob(self):
+        if not self.raw_data:
+            return
+        key = parse_reference(self._unwrap()[1])
+        if key is not None:
+            self.queue.tube(self.tube)._blob_store().delete(key)
+
     def __str__(self):
         args = (
             self.task_id, self.tube, self.status, self.space
@@ -155,7 +329,13 @@ class Task(object):
             return
         if the_tuple.rowcount < 1:
             raise Queue.ZeroTupleException('error creating task')
-        row = the_tuple[0]
+        return cls.from_row_tuple(queue, the_tuple[0])
+
+    @classmethod
+    def from_row_tuple(cls, queue, row):
+        """
+        Create task from one row of the answer of `queue.take` and alike.
+        """
         return cls(
             queue,
             space=queue.space,
@@ -165,6 +345,67 @@ class Task(object):
             raw_data=row[3],
         )
 
+    @classmethod
+    def from_meta_tuple(cls, queue, the_tuple):
+        """
+        Create task from the answer of `queue.take_meta`: the answer of
+        `queue.meta` with task data appended.
+        """
+        if the_tuple.rowcount < 1:
+            raise Queue.ZeroTupleException('error creating task')
+        row = the_tuple[0]
+        task = cls(
+            queue,
+            space=queue.space,
+            task_id=row[0],
+            tube=row[1],
+            status=row[2],
+            raw_data=row[13],
+        )
+        task._meta_row = tuple(row[:13])
+        return task
+
+    @classmethod
+    def from_row(cls, queue, row):
+        """
+        Create task from the raw tuple of queue space.
+        """
+        return cls(
+            queue,
+            space=queue.space,
+            task_id=row[0],
+            tube=row[1],
+            status=STATUSES.get(row[2], row[2]),
+            raw_data=row[12],
+        )
+
+
+class TubeOptions(dict):
+    """
+    Options of tube, that drop arguments of requests cached in `template`
+    on every change, see :meth:`Tube._call_args()
+    <tarantool_queue.Tube._call_args>`.
+    """
+    template = None
+
+    def _changed(method):
+        def changed(self, *args, **kwargs):
+            self.template = None
+            return method(self, *args, **kwargs)
+        changed.__name__ = method.__name__
+        return changed
+
+    __setitem__ = _changed(dict.__setitem__)
+    __delitem__ = _changed(dict.__delitem__)
+    update = _changed(dict.update)
+    pop = _changed(dict.pop)
+    popitem = _changed(dict.popitem)
+    setdefault = _changed(dict.setdefault)
+    clear = _changed(dict.clear)
+    if hasattr(dict, '__ior__'):
+        __ior__ = _changed(dict.__ior__)
+    del _changed
+
 
 class Tube(object):
     """
@@ -175,6 +416,9 @@ class Tube(object):
 
         Don't instantiate it with your bare hands
     """
+    # batch put procedure, see _put_many_raw()
+    _put_many_proc = "queue.put_many"
+
     def __init__(self, queue, name, **kwargs):
         self.queue = queue
         self.opt = {
@@ -187,6 +431,23 @@ class Tube(object):
         self.opt.update(kwargs)
         self._serialize = None
         self._deserialize = None
+        self._coalescer = None
+        self.retry_policy = None
+        self._offload = None
+        # options of tube created without options, see _is_default()
+        self._default_opt = None
+
+    # ----------------
+    @property
+    def opt(self):
+        """
+        Options of tube: dict with delay, ttl, ttr, pri and tube name.
+        """
+        return self._opt
+
+    @opt.setter
+    def opt(self, value):
+        self._opt = TubeOptions(value)
 
     # ----------------
     @property
@@ -229,6 +490,34 @@ class Tube(object):
         """
         self.opt.update(kwargs)
 
+    def _is_default(self):
+        """
+        Is tube configured only by default options, see
+        :class:`TubeRegistry <tarantool_queue.registry.TubeRegistry>`.
+        """
+        return (self._default_opt == self.opt and
+                self._serialize is None and self._deserialize is None and
+                self.retry_policy is None and self._offload is None and
+                self._coalescer is None)
+
+    def _call_args(self):
+        """
+        Arguments of put requests with options of tube, converted once
+        and cached until options of tube or space of queue are changed.
+        """
+        opt = self.opt
+        template = opt.template
+        if template is None or template[0] is not self.queue._space_arg:
+            template = opt.template = (
+                self.queue._space_arg,
+                str(opt["tube"]),
+                str(opt["delay"]),
+                str(opt["ttl"]),
+                str(opt["ttr"]),
+                str(opt["pri"]),
+            )
+        return template
+
     def _produce(self, method, data, **kwargs):
         """
         Generic enqueue a task. Returns a tuple, representing the new task.
@@ -247,20 +536,135 @@ class Tube(object):
         :type tube: string
         :rtype: `Task` instance
         """
-        opt = dict(self.opt, **kwargs)
+        raw_data = self._wrap(self.serialize(data))
+        try:
+            return self._produce_raw(method, raw_data, **kwargs)
+        except Exception:
+            self._discard([raw_data])
+            raise
+
+    def _wrap(self, raw_data, headers=None):
+        """
+        Offload serialized payload into blob store, if it's enabled and
+        payload is large, and put it into envelope, if `Queue.tracer` is
+        set or `headers` are given.
+        """
+        if self._offload is not None and len(raw_data) > self._offload[1]:
+            key = new_key()
+            self._offload[0].put(key, raw_data)
+            raw_data = make_reference(key)
+        tracer = self.queue.tracer
+        if tracer is None and headers is None:
+            return raw_data
+        headers = dict(headers or {}, ts=time.time())
+        if tracer is not None:
+            headers['ctx'] = tracer.inject(self)
+        return wrap(raw_data, headers)
+
+    def _discard(self, raw_datas):
+        """
+        Delete offloaded blobs of payloads, that were not put.
+        """
+        if self._offload is None:
+            return
+        for raw_data in raw_datas:
+            if isinstance(raw_data, bytes):
+                key = parse_reference(unwrap(raw_data)[1])
+                if key is not None:
+                    self._offload[0].delete(key)
 
-        the_tuple = self.queue.tnt.call(method, (
-            str(self.queue.space),
+    def offload(self, store, threshold=1024 * 1024):
+        """
+        Store payloads larger than `threshold` bytes in blob store, only
+        the reference is put into the queue. Data of the task is fetched
+        from the store on first access, the blob is deleted by
+        :meth:`Task.ack() <tarantool_queue.Task.ack>`,
+        :meth:`Task.delete() <tarantool_queue.Task.delete>`,
+        :meth:`Tube.truncate() <tarantool_queue.Tube.truncate>` and when
+        the put fails. Tasks removed by the server (expired by ttl) leave
+        their blobs, expire them in the store, e.g. with
+        :meth:`FileBlobStore.expire() <tarantool_queue.FileBlobStore.expire>`.
+        Payloads of :meth:`Tube.put_unique()
+        <tarantool_queue.Tube.put_unique>` are never offloaded, they are
+        compared on the server.
+        Consumers must enable offloading with the same store.
+        Pass None as `store` to disable it.
+
+        :param store: object with put(key, value), get(key) and
+                      delete(key) methods, e.g.
+                      :class:`FileBlobStore <tarantool_queue.FileBlobStore>`
+                      or :class:`SpaceBlobStore
+                      <tarantool_queue.SpaceBlobStore>`
+        :param threshold: minimal size of offloaded payload in bytes
+        :type threshold: int
+        """
+        self._offload = None if store is None else (store, threshold)
+
+    def _blob_store(self):
+        if self._offload is None:
+            raise Queue.BadConfigException(
+                "task payload is offloaded, but tube '%s' has no blob store"
+                % self.opt['tube'])
+        return self._offload[0]
+
+    def _args(self, kwargs):
+        """
+        Arguments of put requests with options of tube, updated by
+        `kwargs`.
+        """
+        if not kwargs:
+            return self._call_args()
+        opt = dict(self.opt, **kwargs)
+        return (
+            self.queue._space_arg,
             str(opt["tube"]),
             str(opt["delay"]),
             str(opt["ttl"]),
             str(opt["ttr"]),
             str(opt["pri"]),
-            self.serialize(data))
         )
 
+    def _produce_raw(self, method, raw_data, **kwargs):
+        """
+        Same as :meth:`Tube._produce() <tarantool_queue.Tube._produce>`,
+        but `raw_data` is already serialized.
+        """
+        the_tuple = self.queue.tnt.call(method,
+                                        self._args(kwargs) + (raw_data,))
+
         return Task.from_tuple(self.queue, the_tuple)
 
+    def _put_many_raw(self, raw_datas, **kwargs):
+        """
+        Same as :meth:`Tube.put_many() <tarantool_queue.Tube.put_many>`,
+        but `raw_datas` are already serialized.
+        """
+        raw_datas = list(raw_datas)
+        the_tuple = None
+        if raw_datas and self._put_many_proc is not None:
+            the_tuple = self.queue._call_many(
+                self._put_many_proc, self._args(kwargs) + tuple(raw_datas))
+        if the_tuple is None:
+            tasks = []
+            try:
+                for raw_data in raw_datas:
+                    tasks.append(
+                        self._produce_raw("queue.put", raw_data, **kwargs))
+            except Exception as e:
+                if not tasks:
+                    raise
+                raise Queue.PartialPutException(str(e), tasks)
+            return tasks
+        tasks = [self._from_put_row(row) for row in the_tuple]
+        if len(tasks) < len(raw_datas):
+            raise Queue.PartialPutException(
+                "%d of %d tasks are put" % (len(tasks), len(raw_datas)),
+                tasks)
+        return tasks
+
+    def _from_put_row(self, row):
+        return Task.from_row_tuple(self.queue, row)
+
     def put(self, data, **kwargs):
         """
         Enqueue a task. Returns a tuple, representing the new task.
@@ -281,22 +685,48 @@ class Tube(object):
         """
         return self._produce("queue.put", data, **kwargs)
 
+    def put_many(self, datas, **kwargs):
+        """
+        Enqueue many tasks with the same options. Accepts the same
+        options as :meth:`Tube.put() <tarantool_queue.Tube.put>`.
+        It takes one request if the server has `queue.put_many`
+        procedure, and a request per task otherwise. If only first
+        tasks are put, :class:`Queue.PartialPutException` with them in
+        `tasks` is raised.
+
+        :param datas: Data of tasks for pushing into queue
+        :type datas: iterable
+        :rtype: list of `Task` instances
+        """
+        raw_datas = [self._wrap(self.serialize(data)) for data in datas]
+        try:
+            return self._put_many_raw(raw_datas, **kwargs)
+        except Queue.PartialPutException as e:
+            self._discard(raw_datas[len(e.tasks):])
+            raise
+        except Exception:
+            self._discard(raw_datas)
+            raise
+
     def put_unique(self, data, **kwargs):
         """
         Same as :meth:`Tube.put() <tarantool_queue.Tube.put>` put,
-        but it returns None if task exists
+        but it returns None if task exists. The server compares payloads,
+        so the payload is never put into envelope.
         """
-        return self._produce("queue.put_unique", data, **kwargs)
+        return self._produce_raw("queue.put_unique", self.serialize(data),
+                                 **kwargs)
 
     def urgent(self, data=None, **kwargs):
         """
         Same as :meth:`Tube.put() <tarantool_queue.Tube.put>` put,
         but set highest priority for this task.
         """
-        kwargs['delay'] = 0
+        if kwargs or self.opt['delay']:
+            kwargs['delay'] = 0
         return self._produce("queue.urgent", data, **kwargs)
 
-    def take(self, timeout=0):
+    def take(self, timeout=0, meta=False):
         """
         If there are tasks in the queue ready for execution,
         take the highest-priority task. Otherwise, wait for a
@@ -306,11 +736,56 @@ class Tube(object):
         return 'None'. If timeout is None, wait indefinitely until
         a task appears.
 
+        If meta is True, task metadata is taken together with the task
+        and is available in :attr:`Task.meta_cached
+        <tarantool_queue.Task.meta_cached>`. It takes one request if the
+        server has `queue.take_meta` procedure, and two requests
+        otherwise.
+
         :param timeout: timeout to wait.
+        :param meta: take task metadata too
         :type timeout: int or None
+        :type meta: boolean
         :rtype: `Task` instance or None
         """
-        return self.queue._take(self.opt['tube'], timeout)
+        if self._coalescer is not None:
+            return self._coalescer.take(timeout, meta)
+        return self.queue._take(self.opt['tube'], timeout, meta)
+
+    def take_many(self, count, timeout=0, meta=False):
+        """
+        Take up to `count` tasks. Waits for the first task as
+        :meth:`Tube.take() <tarantool_queue.Tube.take>` does, the rest
+        are taken only if they are ready right now. It takes one request
+        if the server has `queue.take_many` procedure (and one more for
+        metadata), and a request per task otherwise.
+
+        :param count: maximum number of tasks to take
+        :param timeout: timeout to wait for the first task.
+        :param meta: take task metadata too
+        :type count: int
+        :type timeout: int or None
+        :type meta: boolean
+        :rtype: list of `Task` instances
+        """
+        return self.queue._take_many(self.opt['tube'], count, timeout, meta)
+
+    def coalesce_takes(self, window=0.0005, limit=64):
+        """
+        Enable coalescing of concurrent :meth:`Tube.take()
+        <tarantool_queue.Tube.take>` calls: takers arriving within `window`
+        seconds are served by one bulk fetch of at most `limit` tasks.
+        Pass None as `window` to disable it.
+
+        :param window: time to wait for other takers, in seconds
+        :param limit: maximum number of takers in one group
+        :type window: float or None
+        :type limit: int
+        """
+        if window is None:
+            self._coalescer = None
+        else:
+            self._coalescer = TakeCoalescer(self, window, limit)
 
     def kick(self, count=None):
         """
@@ -330,9 +805,27 @@ class Tube(object):
 
     def truncate(self):
         """
-        Truncate tube
+        Truncate tube. If payloads are offloaded (see :meth:`offload`),
+        the tube is read before truncating to delete blobs of its tasks,
+        if the queue allows it.
         """
-        return self.queue.truncate(tube=self.opt['tube'])
+        if self._offload is None or not self.queue._selectable:
+            return self.queue.truncate(tube=self.opt['tube'])
+        keys = []
+        offset = 0
+        while True:
+            rows = self.queue._select(self.opt['tube'], offset=offset)
+            for row in rows:
+                key = parse_reference(unwrap(row[12])[1])
+                if key is not None:
+                    keys.append(key)
+            if len(rows) < 1000:
+                break
+            offset += len(rows)
+        deleted = self.queue.truncate(tube=self.opt['tube'])
+        for key in keys:
+            self._offload[0].delete(key)
+        return deleted
 
 
 class Queue(object):
@@ -370,12 +863,28 @@ class Queue(object):
     DataBaseError = tarantool.DatabaseError
     NetworkError = tarantool.NetworkError
 
+    _tube_class = Tube
+    # tasks may be read from the space with _select() and _select_many()
+    _selectable = True
+    # batch ack procedure, see ack_many()
+    _ack_many_proc = "queue.ack_many"
+    # statistics procedure, see statistics() and MultiQueue.statistics()
+    _statistics_proc = "queue.statistics"
+
     class BadConfigException(Exception):
         pass
 
     class ZeroTupleException(Exception):
         pass
 
+    class PartialPutException(Exception):
+        """
+        Only first tasks of batch are put, they are in `tasks`.
+        """
+        def __init__(self, message, tasks):
+            super(Queue.PartialPutException, self).__init__(message)
+            self.tasks = tasks
+
     @staticmethod
     def basic_serialize(data):
         return msgpack.packb(data)
@@ -397,11 +906,36 @@ class Queue(object):
 
         self.host = host
         self.port = port
-        self.space = space
         self.schema = schema
-        self.tubes = {}
+        self.tubes = TubeRegistry()
         self._serialize = self.basic_serialize
         self._deserialize = self.basic_deserialize
+        # is `queue.take_meta` defined on server, None - unknown yet
+        self._take_meta = None
+        # is `queue.take_many` defined on server, None - unknown yet
+        self._take_many_proc = None
+        # are batch procedures defined on server by name, see _call_many()
+        self._many_procs = {}
+        # object with on_take(task) and on_ack(task) methods or None
+        self.monitor = None
+        # object with inject(tube) and extract(task, context) methods or None
+        self.tracer = None
+        self.space = space
+
+    # ----------------
+    @property
+    def space(self):
+        """
+        Number of space of queue.
+        """
+        return self._space
+
+    @space.setter
+    def space(self, space):
+        self._space = space
+        self._space_arg = str(space)
+        # arguments of take requests by (tube, timeout)
+        self._take_args = {}
 
     # ----------------
     @property
@@ -513,23 +1047,135 @@ class Queue(object):
                                                           schema=self.schema)
         return self._tnt
 
-    def _take(self, tube, timeout=0):
-        args = [str(self.space), str(tube)]
-        if timeout is not None:
-            args.append(str(timeout))
-        the_tuple = self.tnt.call("queue.take", tuple(args))
+    def _take(self, tube, timeout=0, meta=False):
+        task = self._take_task(tube, timeout, meta)
+        if task is not None and self.monitor is not None:
+            self.monitor.on_take(task)
+        return task
+
+    def _take_call_args(self, tube, timeout):
+        """
+        Arguments of take requests, cached by (tube, timeout).
+        """
+        args = self._take_args.get((tube, timeout))
+        if args is None:
+            args = (self._space_arg, str(tube))
+            if timeout is not None:
+                args += (str(timeout),)
+            if len(self._take_args) < 1024:
+                self._take_args[(tube, timeout)] = args
+        return args
+
+    def _take_task(self, tube, timeout=0, meta=False):
+        args = self._take_call_args(tube, timeout)
+        if meta and self._take_meta is not False:
+            try:
+                the_tuple = self.tnt.call("queue.take_meta", args)
+            except Queue.DataBaseError as e:
+                if not e.args or e.args[0] != ER_NO_SUCH_PROC:
+                    raise
+                self._take_meta = False
+            else:
+                self._take_meta = True
+                if the_tuple.rowcount == 0:
+                    return None
+                return Task.from_meta_tuple(self, the_tuple)
+        the_tuple = self.tnt.call("queue.take", args)
         if the_tuple.rowcount == 0:
             return None
-        return Task.from_tuple(self, the_tuple)
+        task = Task.from_tuple(self, the_tuple)
+        if meta:
+            task._decoded_meta = self._meta(task.task_id)
+        return task
+
+    def _take_many(self, tube, count, timeout=0, meta=False):
+        if self._take_many_proc is not False:
+            args = (self._space_arg, str(tube), str(count))
+            if timeout is not None:
+                args += (str(timeout),)
+            try:
+                the_tuple = self.tnt.call("queue.take_many", args)
+            except Queue.DataBaseError as e:
+                if not e.args or e.args[0] != ER_NO_SUCH_PROC:
+                    raise
+                self._take_many_proc = False
+            else:
+                self._take_many_proc = True
+                tasks = [Task.from_row_tuple(self, row) for row in the_tuple]
+                if meta and tasks:
+                    metas = self.meta_many([task.task_id for task in tasks])
+                    for task, task_meta in zip(tasks, metas):
+                        task._decoded_meta = task_meta
+                if self.monitor is not None:
+                    for task in tasks:
+                        self.monitor.on_take(task)
+                return tasks
+        tasks = []
+        task = self._take(tube, timeout, meta)
+        while task is not None:
+            tasks.append(task)
+            if len(tasks) >= count:
+                break
+            task = self._take(tube, 0, meta)
+        return tasks
+
+    def _call_many(self, name, args):
+        """
+        Call batch procedure `name`, that may be not defined on server.
+        Returns None, if it's not defined.
+        """
+        if self._many_procs.get(name) is False:
+            return None
+        try:
+            the_tuple = self.tnt.call(name, args)
+        except Queue.DataBaseError as e:
+            if not e.args or e.args[0] != ER_NO_SUCH_PROC:
+                raise
+            self._many_procs[name] = False
+            return None
+        self._many_procs[name] = True
+        return the_tuple
 
     def _ack(self, task_id):
-        args = (str(self.space), task_id)
+        args = (self._space_arg, task_id)
         the_tuple = self.tnt.call("queue.ack", args)
         return the_tuple.return_code == 0
 
+    def ack_many(self, tasks):
+        """
+        Confirm completion of many tasks. It takes one request if the
+        server has `queue.ack_many` procedure, and a request per task
+        otherwise.
+
+        :param tasks: `Task` instances
+        :type tasks: iterable
+        :rtype: list of booleans
+        """
+        tasks = list(tasks)
+        the_tuple = None
+        if tasks and self._ack_many_proc is not None:
+            task_ids = tuple(str(task.task_id) for task in tasks)
+            the_tuple = self._call_many(self._ack_many_proc,
+                                        (self._space_arg,) + task_ids)
+        if the_tuple is None:
+            return [task.ack() for task in tasks]
+        # the procedure returns ids of acked tasks
+        acked = set(row[0] for row in the_tuple)
+        result = []
+        for task in tasks:
+            task.modified = True
+            if self.monitor is not None:
+                self.monitor.on_ack(task)
+            if str(task.task_id) in acked:
+                task._delete_blob()
+                result.append(True)
+            else:
+                result.append(False)
+        return result
+
     def _release(self, task_id, delay=0, ttl=0):
         the_tuple = self.tnt.call("queue.release", (
-            str(self.space),
+            self._space_arg,
             str(task_id),
             str(delay),
             str(ttl)
@@ -537,37 +1183,86 @@ class Queue(object):
         return Task.from_tuple(self, the_tuple)
 
     def _requeue(self, task_id):
-        args = (str(self.space), task_id)
+        args = (self._space_arg, task_id)
         the_tuple = self.tnt.call("queue.requeue", args)
         return the_tuple.return_code == 0
 
     def _bury(self, task_id):
-        args = (str(self.space), task_id)
+        args = (self._space_arg, task_id)
         the_tuple = self.tnt.call("queue.bury", args)
         return the_tuple.return_code == 0
 
     def _delete(self, task_id):
-        args = (str(self.space), task_id)
+        args = (self._space_arg, task_id)
         the_tuple = self.tnt.call("queue.delete", args)
         return the_tuple.return_code == 0
 
     def _meta(self, task_id):
-        args = (str(self.space), task_id)
+        args = (self._space_arg, task_id)
         the_tuple = self.tnt.call("queue.meta", args)
         if the_tuple.rowcount:
-            row = list(the_tuple[0])
-            for index in [3, 7, 8, 9, 10, 11, 12]:
-                row[index] = unpack_long_long(row[index])
-            for index in [6]:
-                row[index] = unpack_long(row[index])
-            keys = [
-                'task_id', 'tube', 'status', 'event', 'ipri',
-                'pri', 'cid', 'created', 'ttl', 'ttr', 'cbury',
-                'ctaken', 'now'
-            ]
-            return dict(zip(keys, row))
+            return meta_from_row(the_tuple[0])
         return None
 
+    def _select_many(self, task_ids, batch):
+        rows = {}
+        task_ids = list(task_ids)
+        for start in range(0, len(task_ids), batch):
+            chunk = task_ids[start:start + batch]
+            for row in self.tnt.select(self.space, chunk):
+                rows[row[0]] = row
+        return task_ids, rows
+
+    def _need_select(self, feature):
+        if not self._selectable:
+            raise Queue.BadConfigException(
+                "%s reads tasks from the queue space, it's not supported "
+                "by %s" % (feature, type(self).__name__))
+
+    def _select(self, tube, status=None, offset=0, limit=1000):
+        """
+        Select raw task tuples of tube (with status, if given) in the order
+        of taking.
+        """
+        key = [str(tube)]
+        if status is not None:
+            key.append(STATUS_CODES[status])
+        return self.tnt.select(self.space, key, index=1,
+                               offset=offset, limit=limit)
+
+    def meta_many(self, task_ids, columns=False, batch=1000):
+        """
+        Return unpacked metadata of many tasks, fetching up to `batch`
+        tasks in one request. Unlike :meth:`Task.meta()
+        <tarantool_queue.Task.meta>`, 'now' is the time of the client.
+
+        :param task_ids: ids of tasks
+        :param columns: return dict of lists (one list per field) with
+                        found tasks instead of list of dicts
+        :param batch: number of tasks in one request
+        :type task_ids: iterable of strings
+        :type columns: boolean
+        :type batch: int
+        :rtype: list of dicts (None for not found tasks) or dict of lists
+        """
+        task_ids, rows = self._select_many(task_ids, batch)
+        now = int(time.time() * 1000000)
+        metas = []
+        for task_id in task_ids:
+            if task_id not in rows:
+                metas.append(None)
+                continue
+            row = unpack_meta(rows[task_id][:12])
+            row[2] = STATUSES.get(row[2], row[2])
+            row.append(now)
+            metas.append(row)
+        if columns:
+            found = [row for row in metas if row is not None]
+            return dict((key, [row[index] for row in found])
+                        for index, key in enumerate(META_KEYS))
+        return [dict(zip(META_KEYS, row)) if row is not None else None
+                for row in metas]
+
     def peek(self, task_id):
         """
         Return a task by task id.
@@ -576,17 +1271,33 @@ class Queue(object):
         :type task_id: string
         :rtype: `Task` instance
         """
-        args = (str(self.space), task_id)
+        args = (self._space_arg, task_id)
         the_tuple = self.tnt.call("queue.peek", args)
         return Task.from_tuple(self, the_tuple)
 
+    def peek_many(self, task_ids, batch=1000):
+        """
+        Return tasks by task ids, fetching up to `batch` tasks in one
+        request.
+
+        :param task_ids: UUIDs of tasks in HEX
+        :param batch: number of tasks in one request
+        :type task_ids: iterable of strings
+        :type batch: int
+        :rtype: list of `Task` instances (None for not found tasks)
+        """
+        task_ids, rows = self._select_many(task_ids, batch)
+        return [Task.from_row(self, rows[task_id])
+                if task_id in rows else None
+                for task_id in task_ids]
+
     def _dig(self, task_id):
-        args = (str(self.space), task_id)
+        args = (self._space_arg, task_id)
         the_tuple = self.tnt.call("queue.dig", args)
         return the_tuple.return_code == 0
 
     def _kick(self, tube, count=None):
-        args = [str(self.space), str(tube)]
+        args = [self._space_arg, str(tube)]
         if count:
             args.append(str(count))
         the_tuple = self.tnt.call("queue.kick", tuple(args))
@@ -600,7 +1311,7 @@ class Queue(object):
         :type tube: string
         :rtype: int
         """
-        args = (str(self.space), tube)
+        args = (self._space_arg, tube)
         deleted = self.tnt.call("queue.truncate", args)
         return unpack_long(deleted[0][0])
 
@@ -648,35 +1359,42 @@ class Queue(object):
         :type tube: string or None
         :rtype: dict with statistics
         """
-        args = (str(self.space),)
+        args = (self._space_arg,)
         args = args if tube is None else args + (tube,)
-        stat = self.tnt.call("queue.statistics", args)
-        ans = {}
-        if stat.rowcount > 0:
-            for k, v in zip(stat[0][0::2], stat[0][1::2]):
-                k_t = list(
-                    re.match(r'space([^.]*)\.(.*)\.([^.]*)', k).groups()
-                )
-                if int(k_t[0]) != self.space:
-                    continue
-                if k_t[1].endswith('.tasks'):
-                    k_t = k_t[0:1] + k_t[1].rsplit('.', 1) + k_t[2:3]
-                if k_t[1] not in ans:
-                    ans[k_t[1]] = {'tasks': {}}
-                if len(k_t) == 4:
-                    ans[k_t[1]]['tasks'][k_t[-1]] = v
-                elif len(k_t) == 3:
-                    ans[k_t[1]][k_t[-1]] = v
-                else:
-                    raise Queue.ZeroTupleException('stats: \
-                            error when parsing respons')
+        return self._parse_statistics(
+            self.tnt.call(self._statistics_proc, args), tube)
+
+    def _parse_statistics(self, stat, tube=None):
+        ans = split_statistics(stat).get(self.space, {})
         return ans[tube] if tube else ans
 
     def _touch(self, task_id):
-        args = (str(self.space), task_id)
+        args = (self._space_arg, task_id)
         the_tuple = self.tnt.call("queue.touch", tuple(args))
         return the_tuple.return_code == 0
 
+    def clone(self):
+        """
+        Return a queue of the same class with the same settings and tubes,
+        but with its own connection, e.g. for long-poll takes that must
+        not block requests of this queue.
+
+        :rtype: `Queue` instance
+        """
+        queue = copy.copy(self)
+        queue.__dict__.pop('_tnt', None)
+        queue._take_args = {}
+        queue.tubes = TubeRegistry(self.tubes.maxsize)
+        for name, tube in self.tubes.items():
+            coalescer = tube._coalescer
+            tube = copy.copy(tube)
+            tube.queue = queue
+            tube.opt = dict(tube.opt)
+            if coalescer is not None:
+                tube.coalesce_takes(coalescer.window, coalescer.limit)
+            queue.tubes[name] = tube
+        return queue
+
     def tube(self, name, **kwargs):
         """
         Create Tube object, if not created before, and set kwargs.
@@ -694,10 +1412,13 @@ class Queue(object):
         :type pri: int
         :rtype: `Tube` instance
         """
-        if name in self.tubes:
-            tube = self.tubes[name]
-            tube.update_options(**kwargs)
+        tube = self.tubes.get(name)
+        if tube is not None:
+            if kwargs:
+                tube.update_options(**kwargs)
         else:
-            tube = Tube(self, name, **kwargs)
+            tube = self._tube_class(self, name, **kwargs)
+            if not kwargs:
+                tube._default_opt = dict(tube.opt)
             self.tubes[name] = tube
         return tube
@@ -1,20 +1,11 @@
 # -*- coding: utf-8 -*-
-import struct
-import msgpack
-import threading
+from .tarantool_queue import Queue, Tube, Task, unpack_long_long
 
-import tarantool
+# options of task in the order of box.queue.release arguments
+RELEASE_OPTIONS = ('pri', 'delay', 'ttr', 'ttl', 'retry')
 
 
-def unpack_long_long(value):
-    return struct.unpack("<q", value)[0]
-
-
-def unpack_long(value):
-    return struct.unpack("<l", value)[0]
-
-
-class TTask(object):
+class TTask(Task):
     """
     Tarantool queue task wrapper.
 
@@ -22,53 +13,38 @@ class TTask(object):
 
         Don't instantiate it with your bare hands
     """
-    def __init__(self, queue, task_id=0,
-                 tube="", raw_data=None):
-        self.task_id = unpack_long_long(task_id)
-        self.tube = tube
-        self.raw_data = raw_data
-        self.queue = queue
-        self.modified = False
-
-    def ack(self):
-        """
-        Confirm completion of a task. Before marking a task as complete
-
-        :rtype: `Task` instance
-        """
-        self.modified = True
-        return self.queue._ack(self.task_id)
-
     def release(self, **kwargs):
         """
         Return a task back to the queue: the task is not executed.
+        Options that are not given are taken from the tube, if any option
+        is given, else the task keeps its own.
 
-        :param ttl: new time to live
+        :param pri: new priority
         :param delay: new delay for task
-        :type ttl: int
+        :param ttr: new time to release
+        :param ttl: new time to live
+        :param retry: new number of retries
+        :type pri: int
         :type delay: int
-        :rtype: `Task` instance
+        :type ttr: int
+        :type ttl: int
+        :type retry: int
+        :rtype: `TTask` instance
         """
-        self.modified = True
+        self._end()
+        if 'prio' in kwargs:
+            kwargs['pri'] = kwargs.pop('prio')
+        if kwargs:
+            opt = self.queue.tube(self.tube).opt
+            kwargs = dict((key, kwargs.get(key, opt[key]))
+                          for key in RELEASE_OPTIONS)
         return self.queue._release(self.task_id, **kwargs)
 
-    def delete(self):
+    def done(self, data):
         """
-        Delete a task from the queue (regardless of task state or status).
-
-        :rtype: boolean
+        Not supported by box.queue, raises `Queue.BadConfigException`.
         """
-        self.modified = True
-        return self.queue._delete(self.task_id)
-
-    @property
-    def data(self):
-        if not self.raw_data:
-            return None
-        if not hasattr(self, '_decoded_data'):
-            data = self.queue.tube(self.tube).deserialize(self.raw_data)
-            self._decoded_data = data
-        return self._decoded_data
+        raise Queue.BadConfigException("done is not supported by box.queue")
 
     def __str__(self):
         args = (
@@ -76,12 +52,8 @@ class TTask(object):
         )
         return "Task (id: {0}, tube:{1}, space:{2})".format(*args)
 
-    def __del__(self):
-        if not self.modified:
-            self.release()
-
     @classmethod
-    def from_tuple(cls, queue, the_tuple):
+    def from_tuple(cls, queue, the_tuple, status='taken'):
         if the_tuple is None:
             return
         if the_tuple.rowcount < 1:
@@ -91,77 +63,72 @@ class TTask(object):
             raise TQueue.NoDataException('no data in the task')
         return cls(
             queue,
-            task_id=row[0],
+            space=queue.space,
+            task_id=unpack_long_long(row[0]),
             tube=row[4],
+            status=status,
             raw_data=row[8],
         )
 
 
-class TTube(object):
+class TTube(Tube):
     """
     Tarantol queue tube wrapper. Pinned to space and tube, but unlike TQueue
-    it has predefined delay, ttl, ttr, and pri.
+    it has predefined delay, ttl, ttr, pri, retry and limits.
 
     .. warning::
 
         Don't instantiate it with your bare hands
     """
+    _put_many_proc = "box.queue.put_many"
+
     def __init__(self, queue, name, **kwargs):
-        self.queue = queue
+        super(TTube, self).__init__(queue, name)
         self.tube = name
-        self.opt = {
-            'delay': 0,
+        self.opt.update({
             'limits': 500000,
-            'ttl': 0,
             'ttr': 300,
             'pri': 0x7fff,
             'retry': 5,
-            'tube': name
-        }
+        })
         self.opt.update(kwargs)
-        self._serialize = None
-        self._deserialize = None
 
-    # ----------------
-    @property
-    def serialize(self):
-        """
-        Serialize function: must be Callable or None. Sets None when deleted
-        """
-        if self._serialize is None:
-            return self.queue.serialize
-        return self._serialize
-
-    @serialize.setter
-    def serialize(self, func):
-        if not (hasattr(func, '__call__') or func is None):
-            raise TypeError("func must be Callable "
-                            "or None, but not " + str(type(func)))
-        self._serialize = func
-
-    # ----------------
-    @property
-    def deserialize(self):
-        """
-        Deserialize function: must be Callable or None. Sets None when deleted
-        """
-        if self._deserialize is None:
-            return self.queue.deserialize
-        return self._deserialize
-
-    @deserialize.setter
-    def deserialize(self, func):
-        if not (hasattr(func, '__call__') or func is None):
-            raise TypeError("func must be Callable "
-                            "or None, but not " + str(type(func)))
-        self._deserialize = func
-
-    # ----------------
-    def update_options(self, **kwargs):
-        """
-        Update options for current tube (such as ttl, ttr, pri and delay)
-        """
-        self.opt.update(kwargs)
+    def _put_args(self, opt):
+        return (
+            self.queue._space_arg,
+            str(opt["tube"]),
+            str(opt["limits"]),
+            str(opt["pri"]),
+            str(opt["delay"]),
+            str(opt["ttr"]),
+            str(opt["ttl"]),
+            str(opt["retry"]),
+        )
+
+    def _call_args(self):
+        opt = self.opt
+        template = opt.template
+        if template is None or template[0] is not self.queue._space_arg:
+            template = opt.template = self._put_args(opt)
+        return template
+
+    def _args(self, kwargs):
+        if not kwargs:
+            return self._call_args()
+        return self._put_args(dict(self.opt, **kwargs))
+
+    def _produce_raw(self, method, raw_data, **kwargs):
+        if method == "queue.urgent":
+            kwargs['pri'] = 0
+        elif method != "queue.put":
+            raise Queue.BadConfigException(
+                "%s is not supported by box.queue" % method)
+        the_tuple = self.queue.tnt.call("box.queue.put",
+                                        self._args(kwargs) + (raw_data,))
+        return self._from_put_row(the_tuple[0])
+
+    def _from_put_row(self, row):
+        return unpack_long_long(row[0])
 
     def put(self, data, **kwargs):
         """
@@ -186,47 +153,58 @@ class TTube(object):
         :type tube: string
         :rtype: int
         """
-        opt = dict(self.opt, **kwargs)
-
-        method = "box.queue.put"
+        return self._produce("queue.put", data, **kwargs)
 
-        the_tuple = self.queue.tnt.call(method, (
-            str(self.queue.space),
-            str(opt["tube"]),
-            str(opt["limits"]),
-            str(opt["pri"]),
-            str(opt["delay"]),
-            str(opt["ttr"]),
-            str(opt["ttl"]),
-            str(opt["retry"]),
-            self.serialize(data))
-        )
-        return unpack_long_long(the_tuple[0][0])
+    def put_many(self, datas, **kwargs):
+        """
+        Enqueue many tasks with the same options. Accepts the same
+        options as :meth:`TTube.put() <tarantool_queue.TTube.put>`.
+        It takes one request if the server has `box.queue.put_many`
+        procedure, and a request per task otherwise.
+
+        :param datas: Data of tasks for pushing into queue
+        :type datas: iterable
+        :rtype: list of ints
+        """
+        return Tube.put_many(self, datas, **kwargs)
 
-    def take(self, timeout=0):
+    def urgent(self, data=None, **kwargs):
         """
-        If there are tasks in the queue ready for execution,
-        take the highest-priority task. Otherwise, wait for a
-        ready task to appear in the queue, and, as soon as it appears,
-        mark it as taken and return to the consumer. If there is a
-        timeout, and the task doesn't appear until the timeout expires,
-        return 'None'. If timeout is None, wait indefinitely until
-        a task appears.
-
-        :param timeout: timeout to wait.
-        :type timeout: int or None
-        :rtype: `Task` instance or None
+        Same as :meth:`TTube.put() <tarantool_queue.TTube.put>` put,
+        but set highest priority (0) for this task.
         """
-        return self.queue._take(self.opt['tube'], timeout)
+        return self._produce("queue.urgent", data, **kwargs)
 
 
-class TQueue(object):
+class TQueue(Queue):
     """
     Tarantool queue wrapper. Surely pinned to space. May create tubes.
     By default it uses msgpack for serialization, but you may redefine
     serialize and deserialize methods.
     You must use TQueue only for creating Tubes.
     For more usage, please, look into tests.
+
+    box.queue has no requeue, done, dig, truncate and task metadata:
+
+    * requeue puts a copy of the task with options of its tube and
+      deletes the task, so the task gets a new id;
+    * metadata has only 'task_id' and 'tube', so :class:`RetryPolicy
+      <tarantool_queue.RetryPolicy>` counts attempts in the envelope;
+    * `TTask.done()`, :meth:`Task.dig()
+      <tarantool_queue.Task.dig>`, :meth:`Tube.truncate()
+      <tarantool_queue.Tube.truncate>` and
+      :meth:`Tube.put_unique() <tarantool_queue.Tube.put_unique>` raise
+      `Queue.BadConfigException`;
+    * tasks can't be read from the space, so :class:`DeadLetters
+      <tarantool_queue.DeadLetters>`, :func:`export_tube
+      <tarantool_queue.export_tube>` and
+      :meth:`LatencyMonitor.oldest_ready_age()
+      <tarantool_queue.LatencyMonitor.oldest_ready_age>` raise
+      `Queue.BadConfigException`.
+
+    Batch puts and acks take one request, if `box.queue.put_many` and
+    `box.queue.ack_many` procedures are defined on server (see
+    `queue.put_many` and `queue.ack_many` in the quick start).
     Usage:
 
         >>> from tarantool_queue import TQueue
@@ -252,202 +230,129 @@ class TQueue(object):
             True
     """
 
-    DataBaseError = tarantool.DatabaseError
-    NetworkError = tarantool.NetworkError
-
-    class BadConfigException(Exception):
-        pass
-
-    class ZeroTupleException(Exception):
-        pass
+    _tube_class = TTube
+    _selectable = False
+    _ack_many_proc = "box.queue.ack_many"
+    _statistics_proc = "box.queue.stats"
 
     class NoDataException(Exception):
         pass
 
-    @staticmethod
-    def basic_serialize(data):
-        return msgpack.packb(data)
-
-    @staticmethod
-    def basic_deserialize(data):
-        return msgpack.unpackb(data)
-
     def __init__(self, host="localhost", port=33013, space=0, schema=None):
-        if not(host and port):
-            raise TQueue.BadConfigException(
-                "host and port params must be not empty")
-
-        if not isinstance(port, int):
-            raise TQueue.BadConfigException("port must be int")
-
-        if not isinstance(space, int):
-            raise TQueue.BadConfigException("space must be int")
-
-        self.host = host
-        self.port = port
-        self.space = space
-        self.schema = schema
-        self.tubes = {}
-        self._serialize = self.basic_serialize
-        self._deserialize = self.basic_deserialize
-
-    # ----------------
-    @property
-    def serialize(self):
-        """
-        Serialize function: must be Callable. If sets to None or deleted, then
-        it will use msgpack for serializing.
-        """
-        if not hasattr(self, '_serialize'):
-            self.serialize = self.basic_serialize
-        return self._serialize
-
-    @serialize.setter
-    def serialize(self, func):
-        if not (hasattr(func, '__call__') or func is None):
-            raise TypeError("func must be Callable "
-                            "or None, but not " + str(type(func)))
-        self._serialize = func if func is not None else self.basic_serialize
-
-    @serialize.deleter
-    def serialize(self):
-        self._serialize = self.basic_serialize
-
-    # ----------------
-    @property
-    def deserialize(self):
-        """
-        Deserialize function: must be Callable. If sets to None or delete,
-        then it will use msgpack for deserializing.
-        """
-        if not hasattr(self, '_deserialize'):
-            self._deserialize = self.basic_deserialize
-        return self._deserialize
-
-    @deserialize.setter
-    def deserialize(self, func):
-        if not (hasattr(func, '__call__') or func is None):
-            raise TypeError("func must be Callable "
-                            "or None, but not " + str(type(func)))
-        self._deserialize = (func
-                             if func is not None
-                             else self.basic_deserialize)
-
-    @deserialize.deleter
-    def deserialize(self):
-        self._deserialize = self.basic_deserialize
-
-    # ----------------
-    @property
-    def tarantool_connection(self):
-        """
-        Tarantool Connection class: must be class with methods call and
-        __init__. If it sets to None or deleted - it will use the default
-        tarantool.Connection class for connection.
-        """
-        if not hasattr(self, '_conclass'):
-            self._conclass = tarantool.Connection
-        return self._conclass
-
-    @tarantool_connection.setter
-    def tarantool_connection(self, cls):
-        if 'call' not in dir(cls) or '__init__' not in dir(cls):
-            if cls is not None:
-                raise TypeError("Connection class must have"
-                                " connect and call methods or be None")
-        self._conclass = cls if cls is not None else tarantool.Connection
-        if hasattr(self, '_tnt'):
-            self.__dict__.pop('_tnt')
-
-    @tarantool_connection.deleter
-    def tarantool_connection(self):
-        if hasattr(self, '_conclass'):
-            self.__dict__.pop('_conclass')
-        if hasattr(self, '_tnt'):
-            self.__dict__.pop('_tnt')
-
-    # ----------------
-    @property
-    def tarantool_lock(self):
-        """
-        Locking class: must be locking instance with methods __enter__
-        and __exit__. If it sets to None or delete - it will use default
-        threading.Lock() instance for locking in the connecting.
-        """
-        if not hasattr(self, '_lockinst'):
-            self._lockinst = threading.Lock()
-        return self._lockinst
-
-    @tarantool_lock.setter
-    def tarantool_lock(self, lock):
-        if '__enter__' not in dir(lock) or '__exit__' not in dir(lock):
-            if lock is not None:
-                raise TypeError("Lock class must have `__enter__`"
-                                " and `__exit__` methods or be None")
-        self._lockinst = lock if lock is not None else threading.Lock()
-
-    @tarantool_lock.deleter
-    def tarantool_lock(self):
-        if hasattr(self, '_lockinst'):
-            self.__dict__.pop('_lockinst')
-
-    # ----------------
-    @property
-    def tnt(self):
-        if not hasattr(self, '_tnt'):
-            with self.tarantool_lock:
-                if not hasattr(self, '_tnt'):
-                    self._tnt = self.tarantool_connection(self.host, self.port,
-                                                          schema=self.schema)
-        return self._tnt
-
-    def _take(self, tube, timeout=0):
-        args = [str(self.space), str(tube)]
-        if timeout is not None:
-            args.append(str(timeout))
-        the_tuple = self.tnt.call("box.queue.take", tuple(args))
+        super(TQueue, self).__init__(host, port, space, schema)
+        # box.queue has no queue.take_many procedure
+        self._take_many_proc = False
+
+    def _take_task(self, tube, timeout=0, meta=False):
+        the_tuple = self.tnt.call("box.queue.take",
+                                  self._take_call_args(tube, timeout))
         if the_tuple.rowcount == 0:
             return None
-        return TTask.from_tuple(self, the_tuple)
+        task = TTask.from_tuple(self, the_tuple)
+        if meta:
+            task._decoded_meta = self._meta(task.task_id)
+        return task
 
     def _ack(self, task_id):
-        args = (str(self.space), str(task_id))
+        args = (self._space_arg, str(task_id))
         the_tuple = self.tnt.call("box.queue.ack", args)
         return the_tuple.return_code == 0
 
-    def _release(self, task_id, prio=0x7fff, delay=0, ttr=300, ttl=0, retry=5):
-        the_tuple = self.tnt.call("box.queue.release", (
-            str(self.space),
-            str(task_id),
-        ))
-        return TTask.from_tuple(self, the_tuple)
+    def _release(self, task_id, **kwargs):
+        args = (self._space_arg, str(task_id))
+        if kwargs:
+            args += tuple(str(kwargs[key]) for key in RELEASE_OPTIONS)
+        the_tuple = self.tnt.call("box.queue.release", args)
+        return TTask.from_tuple(self, the_tuple, status='ready')
+
+    def _bury(self, task_id):
+        args = (self._space_arg, str(task_id))
+        the_tuple = self.tnt.call("box.queue.bury", args)
+        return the_tuple.return_code == 0
 
     def _delete(self, task_id):
-        args = (str(self.space), str(task_id))
+        args = (self._space_arg, str(task_id))
         the_tuple = self.tnt.call("box.queue.delete", args)
         return the_tuple.return_code == 0
 
-    def tube(self, name, **kwargs):
+    def _touch(self, task_id):
+        args = (self._space_arg, str(task_id))
+        the_tuple = self.tnt.call("box.queue.touch", args)
+        return the_tuple.return_code == 0
+
+    def _kick(self, tube, count=None):
+        args = (self._space_arg, str(tube))
+        if count:
+            args += (str(count),)
+        the_tuple = self.tnt.call("box.queue.kick", args)
+        return the_tuple.return_code == 0
+
+    def _requeue(self, task_id):
+        task = self.peek(task_id)
+        if task is None:
+            return False
+        # it's not ours to release
+        task.modified = True
+        # not atomic: the copy stays, if the task is acked before delete
+        self.tube(task.tube)._produce_raw("queue.put", task.raw_data)
+        return self._delete(task_id)
+
+    def _meta(self, task_id):
+        task = self.peek(task_id)
+        if task is None:
+            return None
+        task.modified = True
+        return {'task_id': task.task_id, 'tube': task.tube}
+
+    def meta_many(self, task_ids, columns=False, batch=1000):
         """
-        Create Tube object, if not created before, and set kwargs.
-        If existed, return existed Tube.
-
-        :param name: name of Tube
-        :param delay: default delay for Tube tasks (Not necessary, will be 0)
-        :param ttl: default TTL for Tube tasks (Not necessary, will be 0)
-        :param ttr: default TTR for Tube tasks (Not necessary, will be 0)
-        :param pri: default priority for Tube tasks (Not necessary)
-        :type name: string
-        :type ttl: int
-        :type delay: int
-        :type ttr: int
-        :type pri: int
-        :rtype: `Tube` instance
+        Return metadata of many tasks, one request per task. Metadata has
+        only 'task_id' and 'tube'.
+
+        :param task_ids: ids of tasks
+        :param columns: return dict of lists (one list per field) with
+                        found tasks instead of list of dicts
+        :type task_ids: iterable of ints
+        :type columns: boolean
+        :rtype: list of dicts (None for not found tasks) or dict of lists
+        """
+        metas = [self._meta(task_id) for task_id in task_ids]
+        if columns:
+            found = [meta for meta in metas if meta is not None]
+            return dict((key, [meta[key] for meta in found])
+                        for key in ('task_id', 'tube'))
+        return metas
+
+    def _dig(self, task_id):
+        raise Queue.BadConfigException("dig is not supported by box.queue")
+
+    def truncate(self, tube):
+        """
+        Not supported by box.queue, raises `Queue.BadConfigException`.
+        """
+        raise Queue.BadConfigException(
+            "truncate is not supported by box.queue")
+
+    def peek(self, task_id):
+        """
+        Return a task by task id.
+
+        :param task_id: id of task
+        :type task_id: int
+        :rtype: `TTask` instance
+        """
+        args = (self._space_arg, str(task_id))
+        the_tuple = self.tnt.call("box.queue.peek", args)
+        if the_tuple.rowcount == 0:
+            return None
+        return TTask.from_tuple(self, the_tuple, status='')
+
+    def peek_many(self, task_ids, batch=1000):
+        """
+        Return tasks by task ids, one request per task.
+
+        :param task_ids: ids of tasks
+        :type task_ids: iterable of ints
+        :rtype: list of `TTask` instances (None for not found tasks)
         """
-        if name in self.tubes:
-            tube = self.tubes[name]
-            tube.update_options(**kwargs)
-        else:
-            tube = TTube(self, name, **kwargs)
-            self.tubes[name] = tube
-        return tube
+        return [self.peek(task_id) for task_id in task_ids]
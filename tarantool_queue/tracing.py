@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import uuid
+import struct
+import weakref
+import msgpack
+import threading
+
+# 0xc1 is never used by msgpack, so enveloped payloads are not mistaken
+# for plain ones
+ENVELOPE_MAGIC = b'\xc1TQ\x01'
+_LENGTH = struct.Struct("<I")
+
+
+def wrap(raw_data, headers):
+    """
+    Put serialized payload into envelope with headers.
+    """
+    packed = msgpack.packb(headers)
+    return ENVELOPE_MAGIC + _LENGTH.pack(len(packed)) + packed + raw_data
+
+
+def unwrap(raw_data):
+    """
+    Split enveloped payload into headers and serialized payload. Headers
+    are None if payload is not enveloped.
+    """
+    if raw_data[:4] != ENVELOPE_MAGIC:
+        return None, raw_data
+    length = _LENGTH.unpack_from(raw_data, 4)[0]
+    start = 4 + _LENGTH.size
+    headers = msgpack.unpackb(raw_data[start:start + length])
+    return headers, raw_data[start + length:]
+
+
+class Tracer(object):
+    """
+    Trace context propagation through task payloads. When it's set as
+    `Queue.tracer`, every put wraps the payload into envelope with put
+    time and the context returned by :meth:`inject`, and every task
+    calls :meth:`extract` when its data is read, with None as the
+    context if the task has no envelope. Payloads of `put_unique` are
+    compared on the server, so they are put without envelope.
+
+    This implementation keeps the context of the current thread: trace id
+    is inherited from the task being processed, so the tasks put while
+    processing it belong to the same trace. The context is left when the
+    task is acked, released, buried or deleted (see :meth:`finish`), or
+    when data of a task without envelope is read. Override
+    :meth:`inject`, :meth:`extract` and :meth:`finish` to bridge it to
+    your tracing library.
+    Usage:
+
+        >>> queue.tracer = Tracer()
+        >>> tube.put([1, 2, 3])
+        # on consumer
+        >>> task = tube.take()
+        >>> task.data
+            [1, 2, 3]
+        >>> task.envelope
+            {'ts': 1400000000.0, 'ctx': {'trace_id': '...', ...}}
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def context(self):
+        """
+        Trace context of current thread or None.
+        """
+        return getattr(self._local, 'context', None)
+
+    @context.setter
+    def context(self, context):
+        self._local.context = context
+
+    def inject(self, tube):
+        """
+        Return context to put into the envelope of a new task of tube.
+
+        :rtype: dict
+        """
+        context = self.context
+        if context is None:
+            return {'trace_id': uuid.uuid4().hex,
+                    'span_id': uuid.uuid4().hex[:16]}
+        return {'trace_id': context['trace_id'],
+                'span_id': uuid.uuid4().hex[:16],
+                'parent_id': context['span_id']}
+
+    def extract(self, task, context):
+        """
+        Called with the context from envelope of task (None, if task has
+        no envelope), when task data is read.
+        """
+        self.context = context
+        self._local.task = weakref.ref(task)
+
+    def finish(self, task):
+        """
+        Called when the task is acked, released, buried or deleted.
+        """
+        ref = getattr(self._local, 'task', None)
+        if ref is not None and ref() is task:
+            self.context = None
+            self._local.task = None
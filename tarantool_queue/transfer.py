@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import struct
+import msgpack
+
+from .tarantool_queue import unpack_meta, STATUSES
+
+_LENGTH = struct.Struct("<I")
+
+
+def _load_checkpoint(checkpoint):
+    if checkpoint is None or not os.path.exists(checkpoint):
+        return None
+    with open(checkpoint) as fp:
+        return json.load(fp)
+
+
+def _save_checkpoint(checkpoint, state):
+    if checkpoint is None:
+        return
+    tmp = checkpoint + '.tmp'
+    with open(tmp, 'w') as fp:
+        json.dump(state, fp)
+    os.rename(tmp, checkpoint)
+
+
+def _report(progress, records, size, started):
+    if progress is None:
+        return
+    elapsed = time.time() - started
+    progress({
+        'records': records,
+        'bytes': size,
+        'elapsed': elapsed,
+        'rate': records / elapsed if elapsed > 0 else 0.0
+    })
+
+
+def _pri(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError("bad priority of task: %r" % (value,))
+
+
+def export_tube(tube, path, statuses=('ready', 'delayed', 'buried'),
+                batch=1000, checkpoint=None, progress=None):
+    """
+    Export tasks of tube into file of length-prefixed msgpack records
+    ``[status, pri, delay, ttl, ttr, raw_data]``, where times are in
+    seconds and delay and ttl are remaining ones. Tasks are read in
+    batches, so memory usage doesn't depend on the size of tube.
+
+    If `checkpoint` is given, the state of export is saved there after
+    every batch, and the next export with the same checkpoint continues
+    from it. The checkpoint is removed when export is finished.
+
+    :param tube: `Tube` instance
+    :param path: path of the export file
+    :param statuses: statuses of tasks to export, 'taken' and 'done' are
+                     also allowed
+    :param batch: number of tasks read in one request
+    :param checkpoint: path of the checkpoint file or None
+    :param progress: function, that is called after every batch with
+                     dict of 'records', 'bytes', 'elapsed' and 'rate'
+    :rtype: int - number of exported tasks
+    """
+    tube.queue._need_select("export_tube")
+    state = _load_checkpoint(checkpoint)
+    if state is None:
+        state = {'status': 0, 'offset': 0, 'records': 0, 'bytes': 0}
+    started = time.time()
+    queue = tube.queue
+    with open(path, 'r+b' if state['bytes'] else 'wb') as fp:
+        fp.seek(state['bytes'])
+        fp.truncate()
+        while state['status'] < len(statuses):
+            status = statuses[state['status']]
+            rows = queue._select(tube.opt['tube'], status,
+                                 offset=state['offset'], limit=batch)
+            now = time.time() * 1000000
+            for row in rows:
+                meta = unpack_meta(row[:12])
+                delay = ttl = 0
+                if status == 'delayed':
+                    delay = max(meta[3] - now, 0) / 1000000.0
+                if meta[8]:
+                    ttl = max((meta[7] + meta[8] - now) / 1000000.0, 1)
+                record = msgpack.packb([
+                    STATUSES.get(row[2], row[2]), _pri(meta[5]),
+                    int(delay), int(ttl), meta[9] // 1000000, row[12]
+                ])
+                fp.write(_LENGTH.pack(len(record)))
+                fp.write(record)
+            state['records'] += len(rows)
+            if len(rows) < batch:
+                state['status'] += 1
+                state['offset'] = 0
+            else:
+                state['offset'] += len(rows)
+            fp.flush()
+            state['bytes'] = fp.tell()
+            _save_checkpoint(checkpoint, state)
+            _report(progress, state['records'], state['bytes'], started)
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.unlink(checkpoint)
+    return state['records']
+
+
+def _put_records(tube, status, opt, raw_datas):
+    """
+    Put tasks with the same status and options in one request, bury them
+    if they were buried. Returns the number of put tasks.
+    """
+    queue = tube.queue
+    try:
+        tasks = tube._put_many_raw(raw_datas, **opt)
+    except queue.PartialPutException as e:
+        tasks = e.tasks
+        error = e
+    else:
+        error = None
+    if status == 'buried':
+        for task in tasks:
+            queue._bury(task.task_id)
+    if error is not None:
+        raise error
+    return len(tasks)
+
+
+def import_tube(tube, path, batch=1000, checkpoint=None, progress=None):
+    """
+    Import tasks from the file made by :func:`export_tube` into tube.
+    Tasks are put with their priority, remaining delay and ttl, and ttr,
+    buried tasks are buried again, other tasks become ready. Consecutive
+    tasks with the same status and options are put in one request (see
+    :meth:`Tube.put_many() <tarantool_queue.Tube.put_many>`). Records are
+    read one by one, so memory usage doesn't depend on the size of file.
+
+    If `checkpoint` is given, the state of import is saved there after
+    every `batch` tasks, and the next import with the same checkpoint
+    continues from it. The checkpoint is removed when import is finished.
+
+    :param tube: `Tube` instance
+    :param path: path of the export file
+    :param batch: maximum number of tasks put in one request, number of
+                  tasks between checkpoints and progress reports
+    :param checkpoint: path of the checkpoint file or None
+    :param progress: function, that is called after every batch with
+                     dict of 'records', 'bytes', 'elapsed' and 'rate'
+    :rtype: int - number of imported tasks
+    """
+    state = _load_checkpoint(checkpoint)
+    if state is None:
+        state = {'records': 0, 'bytes': 0}
+    started = time.time()
+    # status and options of pending records, their data and end positions
+    group, raw_datas, ends = None, [], []
+
+    def flush():
+        error = None
+        try:
+            put = _put_records(tube, group[0], group[1], raw_datas)
+        except tube.queue.PartialPutException as e:
+            put, error = len(e.tasks), e
+        if put:
+            reported = state['records'] // batch
+            state['records'] += put
+            state['bytes'] = ends[put - 1]
+            # the checkpoint must cover put tasks before failure
+            if state['records'] // batch > reported or error is not None:
+                _save_checkpoint(checkpoint, state)
+                _report(progress, state['records'], state['bytes'], started)
+        if error is not None:
+            raise error
+        del raw_datas[:], ends[:]
+
+    with open(path, 'rb') as fp:
+        fp.seek(state['bytes'])
+        while True:
+            header = fp.read(_LENGTH.size)
+            if len(header) < _LENGTH.size:
+                break
+            record = msgpack.unpackb(fp.read(_LENGTH.unpack(header)[0]))
+            status, pri, delay, ttl, ttr, raw_data = record
+            if isinstance(status, bytes):
+                status = status.decode('utf-8')
+            opt = {'delay': delay, 'ttl': ttl, 'ttr': ttr}
+            if pri is not None:
+                opt['pri'] = pri
+            if raw_datas and (group != (status, opt) or
+                              len(raw_datas) >= batch):
+                flush()
+            group = (status, opt)
+            raw_datas.append(raw_data)
+            ends.append(fp.tell())
+        if raw_datas:
+            flush()
+        state['bytes'] = fp.tell()
+        _report(progress, state['records'], state['bytes'], started)
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.unlink(checkpoint)
+    return state['records']
@@ -0,0 +1,31 @@
+-- Lua script of the test server: the queue module and the procedures,
+-- that are described in docs/quick-start.en.rst.
+-- Save init.lua of https://github.com/tarantool/queue as queue.lua
+-- next to this file.
+dofile('queue.lua')
+
+function queue.take_many(space, tube, count, timeout)
+    local tasks = {}
+    local task = queue.take(space, tube, timeout)
+    while task ~= nil do
+        table.insert(tasks, task)
+        if #tasks >= tonumber(count) then
+            break
+        end
+        task = queue.take(space, tube, 0)
+    end
+    return unpack(tasks)
+end
+
+function queue.put_many(space, tube, delay, ttl, ttr, pri, ...)
+    local tasks = {}
+    for i = 1, select('#', ...) do
+        local ok, task = pcall(queue.put, space, tube,
+                               delay, ttl, ttr, pri, (select(i, ...)))
+        if not ok then
+            break
+        end
+        table.insert(tasks, task)
+    end
+    return unpack(tasks)
+end
@@ -1,9 +1,21 @@
+import os
 import sys
+import time
+import shutil
+import struct
+import tempfile
 import msgpack
 import unittest
 import threading
 
-from tarantool_queue import Queue
+from tarantool_queue import Queue, AsyncProducer, AdmissionController, Spool
+from tarantool_queue import DedupFilter, CoalescingProducer, LatencyMonitor
+from tarantool_queue import Tracer, RetryPolicy, DeadLetters
+from tarantool_queue import export_tube, import_tube, FileBlobStore, Pipeline
+from tarantool_queue import Stage
+from tarantool_queue import RpcClient, RpcServer, RemoteException, NQueue
+from tarantool_queue import TQueue, MultiQueue, ConnectionPool
+from tarantool_queue import AdaptiveTake, Consumer
 import tarantool
 
 
@@ -114,6 +126,27 @@ class TestSuite_00_ConnectionTest(TestSuite_Basic):
         result2 = self.tube.truncate()
         self.assertEqual(result1, result2)
 
+    def test_08_CachedArguments(self):
+        queue = Queue("127.0.0.1", 33013, 0)
+        tube = queue.tube("tube.args", pri=5)
+        args = tube._call_args()
+        # getting tube without options keeps them
+        self.assertTrue(queue.tube("tube.args")._call_args() is args)
+        tube.opt['pri'] = 7
+        self.assertEqual(tube._call_args()[5], '7')
+        tube.opt.update(ttl=10)
+        self.assertEqual(tube._call_args()[3], '10')
+        tube.opt = dict(tube.opt, delay=1)
+        self.assertEqual(tube._call_args()[2], '1')
+        queue.space = 1
+        self.assertEqual(tube._call_args()[0], '1')
+        queue.space = 0
+        tube.opt['delay'] = 0
+        task = tube.put("cached")
+        self.assertEqual(int(task.meta()['pri']), 7)
+        self.assertEqual(task.meta()['ttl'], 10 * 1000000)
+        task.delete()
+
 
 class TestSuite_01_SerializerTest(TestSuite_Basic):
     def test_00_CustomQueueSerializer(self):
@@ -298,3 +331,1522 @@ class TestSuite_04_StatisticsWithDotInTubeName(TestSuite_Basic):
         self.assertTrue(stat['tube.with.dot']['put'])
         self.assertTrue(stat['tube.with.dot']['tasks'])
         self.assertTrue(stat['tube.with.dot']['tasks']['total'])
+
+
+class TestSuite_05_TakeCoalescing(TestSuite_Basic):
+    @classmethod
+    def setUpClass(cls):
+        cls.queue = Queue("127.0.0.1", 33013, 0)
+        cls.tube = cls.queue.tube("tube.coalesce")
+
+    def test_00_TakeMany(self):
+        for i in range(5):
+            self.tube.put(i)
+        tasks = self.tube.take_many(3)
+        self.assertEqual([task.data for task in tasks], [0, 1, 2])
+        self.assertTrue(all(task.status == 'taken' for task in tasks))
+        tasks += self.tube.take_many(10, meta=True)
+        self.assertEqual([task.data for task in tasks], list(range(5)))
+        self.assertEqual(tasks[3].meta_cached['status'], 'taken')
+        for task in tasks:
+            task.ack()
+        self.assertEqual(self.tube.take_many(10), [])
+
+    def test_01_TakeManyRoundTrips(self):
+        for i in range(5):
+            self.tube.put(i)
+        calls = self.queue.tnt.call
+        requests = []
+
+        def call(name, args):
+            requests.append(name)
+            return calls(name, args)
+        self.queue.tnt.call = call
+        try:
+            tasks = self.tube.take_many(5)
+        finally:
+            del self.queue.tnt.call
+        self.assertEqual(len(tasks), 5)
+        if self.queue._take_many_proc:
+            self.assertEqual(requests, ["queue.take_many"])
+        else:
+            # the server has no procedure of tests/init.lua
+            self.assertEqual([name for name in requests
+                              if name != "queue.take_many"],
+                             ["queue.take"] * 5)
+        for task in tasks:
+            task.ack()
+
+    def test_02_WaitForever(self):
+        self.tube.coalesce_takes(window=0.01)
+        results = []
+
+        def taker():
+            results.append(self.tube.take(None))
+
+        threads = [threading.Thread(target=taker) for _ in range(2)]
+        try:
+            for thread in threads:
+                thread.start()
+            time.sleep(0.05)
+            self.tube.put(1)
+            threads[0].join(0.5)
+            threads[1].join(0.5)
+            # one taker got the task, the other one keeps waiting
+            self.assertEqual([task.data for task in results], [1])
+            self.tube.put(2)
+            for thread in threads:
+                thread.join(1)
+            self.assertEqual(sorted(task.data for task in results), [1, 2])
+        finally:
+            self.tube.coalesce_takes(window=None)
+        for task in results:
+            task.ack()
+
+    def test_03_ConcurrentTakers(self):
+        self.tube.coalesce_takes(window=0.01)
+        for i in range(8):
+            self.tube.put(i)
+        results = []
+
+        def taker():
+            results.append(self.tube.take(1))
+
+        threads = [threading.Thread(target=taker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.tube.coalesce_takes(window=None)
+        tasks = [task for task in results if task is not None]
+        self.assertEqual(len(results), 8)
+        self.assertEqual(len(set(task.task_id for task in tasks)), len(tasks))
+        self.assertEqual(sorted(task.data for task in tasks),
+                         list(range(len(tasks))))
+        for task in tasks:
+            task.ack()
+        for task in self.tube.take_many(8):
+            task.ack()
+
+
+class TestSuite_06_AsyncProducer(TestSuite_Basic):
+    @classmethod
+    def setUpClass(cls):
+        cls.queue = Queue("127.0.0.1", 33013, 0)
+        cls.tube = cls.queue.tube("tube.async")
+
+    def test_00_PutAndFlush(self):
+        producer = AsyncProducer(self.tube, batch_size=4)
+        futures = [producer.put(i) for i in range(10)]
+        self.assertTrue(producer.flush(5))
+        self.assertEqual(producer.pending, 0)
+        self.assertEqual(producer.sent, 10)
+        self.assertEqual([f.result().data for f in futures], list(range(10)))
+        producer.close()
+        with self.assertRaises(AsyncProducer.ClosedException):
+            producer.put(11)
+        for task in self.tube.take_many(10):
+            task.ack()
+
+    def test_01_DropWhenFull(self):
+        sent = threading.Event()
+        self.tube.serialize = (lambda x: sent.wait() and msgpack.packb(x))
+        producer = AsyncProducer(self.tube, maxsize=1, on_full='drop')
+        results = [producer.put(i) for i in range(5)]
+        self.assertTrue(producer.dropped > 0)
+        self.assertTrue(None in results)
+        sent.set()
+        self.assertTrue(producer.close(5))
+        self.tube.serialize = None
+        for task in self.tube.take_many(5):
+            task.ack()
+
+    def test_02_BatchInOneRequest(self):
+        calls = self.queue.tnt.call
+        requests = []
+
+        def call(name, args):
+            requests.append(name)
+            return calls(name, args)
+        self.queue.tnt.call = call
+        producer = AsyncProducer(self.tube, batch_size=10)
+        sent = threading.Event()
+        self.tube.serialize = (lambda x: sent.wait() and msgpack.packb(x))
+        try:
+            futures = [producer.put(i) for i in range(4)]
+            sent.set()
+            self.assertTrue(producer.close(5))
+        finally:
+            self.tube.serialize = None
+            del self.queue.tnt.call
+        self.assertEqual([f.result().data for f in futures], list(range(4)))
+        if self.queue._many_procs.get("queue.put_many"):
+            self.assertTrue(len(requests) < 4)
+            self.assertEqual(set(requests), set(["queue.put_many"]))
+        else:
+            # the server has no procedure of tests/init.lua
+            self.assertEqual([name for name in requests
+                              if name != "queue.put_many"],
+                             ["queue.put"] * 4)
+        for task in self.tube.take_many(4):
+            task.ack()
+
+    def test_03_FailingCallback(self):
+        producer = AsyncProducer(self.tube)
+
+        def callback(future):
+            raise RuntimeError("callback")
+        producer.put(1).add_done_callback(callback)
+        future = producer.put(2)
+        self.assertTrue(producer.flush(5))
+        self.assertEqual(future.result(5).data, 2)
+        self.assertTrue(producer.close(5))
+        for task in self.tube.take_many(2):
+            task.ack()
+
+
+class TestSuite_07_Spool(TestSuite_Basic):
+    @classmethod
+    def setUpClass(cls):
+        cls.queue = Queue("127.0.0.1", 33013, 0)
+        cls.tube = cls.queue.tube("tube.spool")
+        cls.path = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.path)
+        super(TestSuite_07_Spool, cls).tearDownClass()
+
+    def test_00_DirectPut(self):
+        spool = Spool(self.tube, self.path)
+        task = spool.put([1, 2, 3])
+        self.assertEqual(task.data, [1, 2, 3])
+        self.assertEqual(spool.depth, 0)
+        self.assertTrue(spool.close())
+        self.tube.take().ack()
+
+    def test_01_SpoolAndDrainAfterRestart(self):
+        offline = Queue("127.0.0.1", 33099, 0).tube("tube.spool")
+        spool = Spool(offline, self.path, retry_interval=0.05)
+        for i in range(3):
+            self.assertIsNone(spool.put(i, pri=i))
+        self.assertEqual(spool.depth, 3)
+        self.assertEqual(spool.spooled, 3)
+        self.assertFalse(spool.close())
+        spool = Spool(self.tube, self.path)
+        self.assertEqual(spool.depth, 3)
+        self.assertTrue(spool.flush(5))
+        self.assertEqual(spool.drained, 3)
+        spool.close()
+        tasks = self.tube.take_many(3)
+        self.assertEqual(sorted(task.data for task in tasks), [0, 1, 2])
+        for task in tasks:
+            task.ack()
+
+    def test_02_BoundedDiskUsage(self):
+        path = os.path.join(self.path, 'bounded')
+        offline = Queue("127.0.0.1", 33099, 0).tube("tube.spool")
+        spool = Spool(offline, path, segment_size=128, max_segments=2)
+        with self.assertRaises(Spool.FullException):
+            for i in range(100):
+                spool.put("x" * 32)
+        self.assertTrue(spool.disk_usage <= 256)
+        spool.close()
+        spool = Spool(self.tube, path)
+        self.assertTrue(spool.flush(5))
+        spool.close()
+        self.tube.truncate()
+
+    def test_03_OversizeTask(self):
+        path = os.path.join(self.path, 'oversize')
+        offline = Queue("127.0.0.1", 33099, 0).tube("tube.spool")
+        spool = Spool(offline, path, segment_size=128)
+        with self.assertRaises(ValueError):
+            spool.put("x" * 200)
+        self.assertEqual(spool.spooled, 0)
+        self.assertEqual(spool.disk_usage, 128)
+        self.assertFalse(spool._bypass)
+        spool.close()
+
+    def test_04_SlowPutAndStuckClose(self):
+        path = os.path.join(self.path, 'slow')
+        spool = Spool(self.tube, path, slow=0, retry_interval=0.1)
+        self.assertEqual(spool.put(1).data, 1)
+        self.assertTrue(spool._bypass)
+        # the drain thread is woken and ends the bypass
+        time.sleep(0.3)
+        self.assertFalse(spool._bypass)
+        self.assertEqual(spool.put(2).data, 2)
+        calls = self.queue.tnt.call
+        stuck = threading.Event()
+
+        def call(name, args):
+            stuck.wait(5)
+            return calls(name, args)
+        self.queue.tnt.call = call
+        try:
+            self.assertIsNone(spool.put(3))
+            start = time.time()
+            self.assertFalse(spool.close(0.2))
+            self.assertTrue(time.time() - start < 1)
+        finally:
+            stuck.set()
+            del self.queue.tnt.call
+        spool._thread.join(5)
+        tasks = self.tube.take_many(3)
+        self.assertEqual(sorted(task.data for task in tasks), [1, 2, 3])
+        for task in tasks:
+            task.ack()
+
+
+class TestSuite_08_AdmissionControl(TestSuite_Basic):
+    @classmethod
+    def setUpClass(cls):
+        cls.queue = Queue("127.0.0.1", 33013, 0)
+        cls.tube = cls.queue.tube("tube.admission")
+
+    def test_00_RejectWithHysteresis(self):
+        controller = AdmissionController(self.tube, high=3, low=1,
+                                         mode='reject', interval=0)
+        for i in range(3):
+            controller.put(i)
+        with self.assertRaises(AdmissionController.RejectedException):
+            controller.put(3)
+        self.assertTrue(controller.overloaded)
+        self.assertEqual(controller.rejected, 1)
+        self.tube.take().ack()
+        with self.assertRaises(AdmissionController.RejectedException):
+            controller.put(3)
+        self.tube.take().ack()
+        controller.put(3)
+        self.assertFalse(controller.overloaded)
+        self.tube.truncate()
+
+    def test_01_BlockTimeout(self):
+        controller = AdmissionController(self.tube, high=1, interval=0.01,
+                                         timeout=0.05)
+        self.tube.put(0)
+        with self.assertRaises(AdmissionController.RejectedException):
+            controller.put(1)
+        # timeout shorter than interval
+        controller.interval = 1
+        start = time.time()
+        with self.assertRaises(AdmissionController.RejectedException):
+            controller.put(1)
+        self.assertTrue(time.time() - start < 0.5)
+        self.tube.truncate()
+
+
+class TestSuite_09_DedupFilter(TestSuite_Basic):
+    @classmethod
+    def setUpClass(cls):
+        cls.queue = Queue("127.0.0.1", 33013, 0)
+        cls.tube = cls.queue.tube("tube.dedup")
+
+    def test_00_DropDuplicates(self):
+        dedup = DedupFilter(self.tube, capacity=2, ttl=60)
+        self.assertIsNotNone(dedup.put("task#1"))
+        self.assertIsNone(dedup.put("task#1"))
+        self.assertEqual(dedup.dropped, 1)
+        dedup.put("task#2")
+        dedup.put("task#3")
+        # task#1 is evicted from cache, but server still has it
+        dedup.put("task#1")
+        self.assertEqual(dedup.dropped, 1)
+        self.assertEqual(self.tube.statistics()['tasks']['ready'], '3')
+        self.tube.truncate()
+
+    def test_01_KeyAndBloom(self):
+        dedup = DedupFilter(self.tube, capacity=1, ttl=60,
+                            key=lambda data: data[0],
+                            bloom_size=1024, exclusive=True)
+        dedup.put([1, "a"])
+        dedup.put([2, "b"])
+        self.assertIsNone(dedup.put([2, "c"]))
+        self.assertIsNotNone(dedup.put([1, "d"]))
+        self.assertEqual(dedup.uncertain, 1)
+        self.tube.truncate()
+
+    def test_02_Expire(self):
+        dedup = DedupFilter(self.tube, ttl=0.01)
+        dedup.put("task#1")
+        self.tube.truncate()
+        time.sleep(0.02)
+        self.assertIsNotNone(dedup.put("task#1"))
+        self.tube.truncate()
+
+
+class TestSuite_10_CoalescingProducer(TestSuite_Basic):
+    @classmethod
+    def setUpClass(cls):
+        cls.queue = Queue("127.0.0.1", 33013, 0)
+        cls.tube = cls.queue.tube("tube.coalescing")
+
+    def test_00_LastWriteWins(self):
+        producer = CoalescingProducer(self.tube, key=lambda x: x[0],
+                                      window=60)
+        for i in range(10):
+            producer.put(["a", i])
+            producer.put(["b", i])
+        self.assertEqual(producer.pending, 2)
+        self.assertEqual(producer.merged, 18)
+        self.assertTrue(producer.close(5))
+        tasks = self.tube.take_many(10)
+        self.assertEqual(sorted(task.data for task in tasks),
+                         [["a", 9], ["b", 9]])
+        for task in tasks:
+            task.ack()
+
+    def test_01_MergeAfterWindow(self):
+        producer = CoalescingProducer(self.tube, key=lambda x: x[0],
+                                      window=0.5,
+                                      merge=lambda a, b: [a[0], a[1] + b[1]])
+        for i in range(5):
+            producer.put(["a", 1])
+        self.assertEqual(producer.merged, 4)
+        task = self.tube.take(5)
+        self.assertEqual(task.data, ["a", 5])
+        task.ack()
+        producer.close()
+        with self.assertRaises(CoalescingProducer.ClosedException):
+            producer.put(["a", 1])
+
+    def test_02_MergeAfterWaitForSpace(self):
+        producer = CoalescingProducer(self.tube, key=lambda x: x[0],
+                                      window=60, maxsize=2,
+                                      merge=lambda a, b: [a[0], a[1] + b[1]])
+        producer.put(["a", 1])
+        producer.put(["c", 1])
+        threads = [threading.Thread(target=producer.put, args=(["b", i],))
+                   for i in (1, 2)]
+        for thread in threads:
+            thread.start()
+        sent = threading.Event()
+        self.tube.serialize = (lambda x: sent.wait() and msgpack.packb(x))
+        try:
+            # the sender takes "a" and "c" and hangs, both puts of "b" go on
+            self.assertFalse(producer.flush(0.05))
+            for thread in threads:
+                thread.join(5)
+            self.assertEqual(producer.merged, 1)
+        finally:
+            sent.set()
+            self.assertTrue(producer.close(5))
+            self.tube.serialize = None
+        tasks = self.tube.take_many(10)
+        self.assertEqual(sorted(task.data for task in tasks),
+                         [["a", 1], ["b", 3], ["c", 1]])
+        for task in tasks:
+            task.ack()
+
+
+class TestSuite_11_BulkMetaAndPeek(TestSuite_Basic):
+    @classmethod
+    def setUpClass(cls):
+        cls.queue = Queue("127.0.0.1", 33013, 0)
+        cls.tube = cls.queue.tube("tube.bulk")
+
+    def test_00_MetaMany(self):
+        tasks = [self.tube.put(i) for i in range(3)]
+        ids = [task.task_id for task in tasks] + ['0' * 32]
+        metas = self.queue.meta_many(ids, batch=2)
+        self.assertEqual(len(metas), 4)
+        self.assertIsNone(metas[3])
+        for task, meta in zip(tasks, metas):
+            self.assertEqual(meta['task_id'], task.task_id)
+            self.assertEqual(meta['status'], 'ready')
+            self.assertEqual(sorted(meta.keys()),
+                             sorted(task.meta().keys()))
+        columns = self.queue.meta_many(ids, columns=True)
+        self.assertEqual(columns['task_id'], ids[:3])
+        self.assertEqual(columns['status'], ['ready'] * 3)
+        self.tube.truncate()
+
+    def test_01_PeekMany(self):
+        tasks = [self.tube.put(i) for i in range(3)]
+        ids = ['0' * 32] + [task.task_id for task in tasks]
+        peeked = self.queue.peek_many(ids)
+        self.assertIsNone(peeked[0])
+        self.assertEqual([task.data for task in peeked[1:]], [0, 1, 2])
+        self.assertEqual([task.status for task in peeked[1:]],
+                         ['ready'] * 3)
+        self.tube.truncate()
+
+
+class TestSuite_12_TakeWithMeta(TestSuite_Basic):
+    @classmethod
+    def setUpClass(cls):
+        cls.queue = Queue("127.0.0.1", 33013, 0)
+        cls.tube = cls.queue.tube("tube.meta")
+
+    def test_00_TakeMeta(self):
+        self.tube.put("task#1")
+        task = self.tube.take(1, meta=True)
+        self.assertEqual(task.data, "task#1")
+        self.assertEqual(task.meta_cached['task_id'], task.task_id)
+        self.assertEqual(task.meta_cached['status'], 'taken')
+        self.assertEqual(task.meta_cached['ctaken'], 1)
+        self.assertIs(task.meta_cached, task.meta_cached)
+        task.ack()
+        self.assertIsNone(self.tube.take(0, meta=True))
+
+    def test_01_MetaCachedWithoutTakeMeta(self):
+        self.tube.put("task#2")
+        task = self.tube.take(1)
+        self.assertEqual(task.meta_cached['status'], 'taken')
+        task.ack()
+
+
+class TestSuite_13_LatencyMonitor(TestSuite_Basic):
+    @classmethod
+    def setUpClass(cls):
+        cls.queue = Queue("127.0.0.1", 33013, 0)
+        cls.tube = cls.queue.tube("tube.monitor")
+
+    def test_00_WaitAndHandling(self):
+        monitor = LatencyMonitor(timestamp=lambda task: task.data[1])
+        self.queue.monitor = monitor
+        try:
+            self.tube.put(["task#1", time.time() - 10])
+            self.tube.put(["task#2", time.time()])
+            self.tube.take(1, meta=True).ack()
+            self.tube.take(1).ack()
+        finally:
+            self.queue.monitor = None
+        wait = monitor.wait_time("tube.monitor")
+        handling = monitor.handling_time("tube.monitor")
+        self.assertEqual(wait.count, 2)
+        self.assertEqual(handling.count, 2)
+        self.assertTrue(wait.max < 10)
+        self.assertTrue(monitor.stats()["tube.monitor"]["wait"]["p50"]
+                        is not None)
+
+    def test_01_OldestReadyAge(self):
+        monitor = LatencyMonitor()
+        self.assertIsNone(monitor.oldest_ready_age(self.tube))
+        self.tube.put("task#1")
+        time.sleep(0.01)
+        self.assertTrue(monitor.oldest_ready_age(self.tube) >= 0.01)
+        self.tube.truncate()
+
+
+class TestSuite_14_Tracing(TestSuite_Basic):
+    @classmethod
+    def setUpClass(cls):
+        cls.queue = Queue("127.0.0.1", 33013, 0)
+        cls.tube = cls.queue.tube("tube.tracing")
+
+    def test_00_Propagation(self):
+        tracer = Tracer()
+        self.queue.tracer = tracer
+        try:
+            self.tube.put([1, 2, 3])
+            task = self.tube.take(1)
+            self.assertEqual(task.data, [1, 2, 3])
+            trace_id = task.envelope['ctx']['trace_id']
+            self.assertEqual(tracer.context['trace_id'], trace_id)
+            self.assertTrue(time.time() - task.envelope['ts'] < 10)
+            # put while the task is handled
+            self.tube.put([4, 5, 6])
+            task.ack()
+            self.assertIsNone(tracer.context)
+            task = self.tube.take(1)
+            self.assertEqual(task.envelope['ctx']['trace_id'], trace_id)
+            self.assertEqual(task.data, [4, 5, 6])
+            task.ack()
+        finally:
+            self.queue.tracer = None
+
+    def test_03_ContextIsLeft(self):
+        tracer = Tracer()
+        self.queue.tracer = tracer
+        try:
+            self.tube.put([1, 2, 3])
+            task = self.tube.take(1)
+            self.assertEqual(task.data, [1, 2, 3])
+            trace_id = tracer.context['trace_id']
+            task.release()
+            self.assertIsNone(tracer.context)
+            task = self.tube.take(1)
+            self.assertEqual(task.data, [1, 2, 3])
+            task.ack()
+            self.queue.tracer = None
+            self.tube.put([4, 5, 6])
+            self.queue.tracer = tracer
+            # a task without envelope doesn't join the trace of the
+            # task read before
+            task = self.tube.take(1)
+            self.assertEqual(task.data, [4, 5, 6])
+            self.assertIsNone(tracer.context)
+            self.tube.put([7, 8, 9])
+            task.ack()
+            task = self.tube.take(1)
+            self.assertNotEqual(task.envelope['ctx']['trace_id'], trace_id)
+            task.ack()
+        finally:
+            self.queue.tracer = None
+        self.tube.truncate()
+
+    def test_01_NoTracer(self):
+        self.tube.put([1, 2, 3])
+        task = self.tube.take(1)
+        self.assertIsNone(task.envelope)
+        self.assertEqual(task.data, [1, 2, 3])
+        task.ack()
+
+    def test_02_PutUnique(self):
+        self.queue.tracer = Tracer()
+        try:
+            self.tube.put_unique([1, 2, 3])
+            self.tube.put_unique([1, 2, 3])
+            dedup = DedupFilter(self.tube, capacity=1)
+            dedup.put([1, 2, 3])
+            dedup.put([4, 5, 6])
+            # [1, 2, 3] is evicted from cache, server drops it
+            dedup.put([1, 2, 3])
+        finally:
+            self.queue.tracer = None
+        self.assertEqual(self.tube.statistics()['tasks']['ready'], '2')
+        task = self.tube.take(1)
+        self.assertIsNone(task.envelope)
+        self.assertEqual(task.data, [1, 2, 3])
+        task.ack()
+        self.tube.truncate()
+
+
+class TestSuite_15_RetryPolicy(TestSuite_Basic):
+    @classmethod
+    def setUpClass(cls):
+        cls.queue = Queue("127.0.0.1", 33013, 0)
+        cls.tube = cls.queue.tube("tube.retry")
+
+    def test_00_Delay(self):
+        policy = RetryPolicy(base=1, factor=2, max_delay=5, jitter=0)
+        self.assertEqual([policy.delay(i) for i in range(1, 6)],
+                         [1, 2, 4, 5, 5])
+        policy = RetryPolicy(base=100, jitter=0.5)
+        self.assertTrue(50 <= policy.delay(1) <= 100)
+        policy = RetryPolicy(base=1, jitter=1)
+        self.assertEqual(min(policy.delay(1) for i in range(100)), 1)
+
+    def test_01_ReleaseMode(self):
+        self.tube.retry_policy = RetryPolicy(max_attempts=2, base=0)
+        try:
+            self.tube.put("task#1")
+            task = self.tube.take(1)
+            self.assertTrue(task.retry())
+            task = self.tube.take(1)
+            self.assertEqual(task.data, "task#1")
+            self.assertFalse(task.retry())
+            self.assertEqual(self.tube.retry_policy.buried, 1)
+            self.assertEqual(task.meta()['status'], 'buried')
+        finally:
+            self.tube.retry_policy = None
+        self.tube.truncate()
+
+    def test_02_PutMode(self):
+        policy = RetryPolicy(max_attempts=2, base=0, mode='put')
+
+        def handler(task):
+            raise ValueError(task.data)
+
+        self.tube.put("task#2")
+        self.assertFalse(policy.process(self.tube.take(1), handler))
+        task = self.tube.take(1)
+        self.assertEqual(task.envelope['attempt'], 1)
+        self.assertEqual(task.data, "task#2")
+        self.assertFalse(policy.process(task, handler))
+        self.assertEqual(policy.buried, 1)
+        self.assertIsInstance(policy.last_error, ValueError)
+        self.tube.put("task#3")
+        self.assertTrue(policy.process(self.tube.take(1), lambda task: None))
+        self.tube.truncate()
+
+    def test_03_PutModeKeepsOptions(self):
+        policy = RetryPolicy(base=0, mode='put')
+        self.tube.put("task#4", pri=7, ttr=30, ttl=3600)
+        self.assertTrue(policy.fail(self.tube.take(1)))
+        meta = self.tube.take(1).meta()
+        self.assertEqual(meta['pri'], '7')
+        self.assertEqual(meta['ttr'], 30 * 1000000)
+        self.assertTrue(3500 * 1000000 <= meta['ttl'] <= 3600 * 1000000)
+        self.tube.truncate()
+
+    def test_04_PutModeAcksTask(self):
+        policy = RetryPolicy(base=0, mode='put')
+        self.queue.monitor = LatencyMonitor()
+        try:
+            self.tube.put("task#5")
+            task = self.tube.take(1)
+            self.assertTrue(policy.fail(task))
+            self.assertTrue(task.modified)
+            handling = self.queue.monitor.handling_time(self.tube.opt['tube'])
+            self.assertEqual(handling.count, 1)
+        finally:
+            self.queue.monitor = None
+        self.tube.truncate()
+
+
+class TestSuite_16_DeadLetters(TestSuite_Basic):
+    @classmethod
+    def setUpClass(cls):
+        cls.queue = Queue("127.0.0.1", 33013, 0)
+        cls.tube = cls.queue.tube("tube.dead")
+        cls.target = cls.queue.tube("tube.dead.target")
+
+    def bury(self, count):
+        for i in range(count):
+            self.tube.put(i)
+        return DeadLetters(self.tube).bury(self.tube.take_many(count))
+
+    def test_00_CountAndDig(self):
+        self.assertEqual(self.bury(10), 10)
+        progress = []
+        dead = DeadLetters(self.tube, batch=3, progress=progress.append)
+        self.assertEqual(dead.count(), 10)
+        self.assertEqual(progress[-1]['scanned'], 10)
+        self.assertEqual(dead.count(older_than=3600), 0)
+        self.assertEqual(dead.dig(lambda task: task.data % 2 == 0), 5)
+        self.assertEqual(dead.count(), 5)
+        self.assertEqual(self.tube.statistics()['tasks']['ready'], '5')
+        self.tube.truncate()
+
+    def test_01_RequeueAndDelete(self):
+        self.bury(6)
+        dead = DeadLetters(self.tube, batch=2, rate=1000)
+        self.assertEqual(dead.requeue(self.target, lambda t: t.data < 2), 2)
+        self.assertEqual(sorted(task.data for task in
+                                self.target.take_many(10)), [0, 1])
+        self.assertEqual(dead.delete(), 4)
+        self.assertEqual(dead.count(), 0)
+        self.target.truncate()
+
+
+class TestSuite_17_ExportImport(TestSuite_Basic):
+    @classmethod
+    def setUpClass(cls):
+        cls.queue = Queue("127.0.0.1", 33013, 0)
+        cls.tube = cls.queue.tube("tube.export")
+        cls.target = cls.queue.tube("tube.import")
+        cls.path = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.path)
+        super(TestSuite_17_ExportImport, cls).tearDownClass()
+
+    def test_00_ExportImport(self):
+        for i in range(7):
+            self.tube.put(i, ttr=30)
+        self.tube.take().bury()
+        path = os.path.join(self.path, 'tube.dump')
+        checkpoint = os.path.join(self.path, 'checkpoint')
+        progress = []
+        self.assertEqual(export_tube(self.tube, path, batch=2,
+                                     checkpoint=checkpoint,
+                                     progress=progress.append), 7)
+        self.assertFalse(os.path.exists(checkpoint))
+        self.assertEqual(progress[-1]['records'], 7)
+        self.assertEqual(import_tube(self.target, path, batch=3), 7)
+        stat = self.target.statistics()['tasks']
+        self.assertEqual(stat['ready'], '6')
+        self.assertEqual(stat['buried'], '1')
+        tasks = self.target.take_many(10)
+        self.assertEqual(sorted(task.data for task in tasks),
+                         [1, 2, 3, 4, 5, 6])
+        for task in tasks:
+            task.ack()
+        self.tube.truncate()
+        self.target.truncate()
+
+    def test_01_ResumeImport(self):
+        for i in range(5):
+            self.tube.put(i)
+        path = os.path.join(self.path, 'resume.dump')
+        checkpoint = os.path.join(self.path, 'resume.checkpoint')
+        export_tube(self.tube, path)
+        calls = []
+
+        def progress(stats):
+            calls.append(stats)
+            if len(calls) == 1:
+                raise KeyboardInterrupt()
+
+        with self.assertRaises(KeyboardInterrupt):
+            import_tube(self.target, path, batch=2, checkpoint=checkpoint,
+                        progress=progress)
+        self.assertTrue(os.path.exists(checkpoint))
+        self.assertEqual(import_tube(self.target, path, batch=2,
+                                     checkpoint=checkpoint), 5)
+        self.assertEqual(self.target.statistics()['tasks']['ready'], '5')
+        self.tube.truncate()
+        self.target.truncate()
+
+    def test_02_BatchedPuts(self):
+        for i in range(6):
+            self.tube.put(i, ttr=30)
+        path = os.path.join(self.path, 'batched.dump')
+        export_tube(self.tube, path)
+        calls = self.queue.tnt.call
+        requests = []
+
+        def call(name, args):
+            requests.append(name)
+            return calls(name, args)
+        self.queue.tnt.call = call
+        try:
+            self.assertEqual(import_tube(self.target, path, batch=4), 6)
+        finally:
+            del self.queue.tnt.call
+        if self.queue._many_procs.get("queue.put_many"):
+            self.assertEqual(requests, ["queue.put_many"] * 2)
+        else:
+            # the server has no procedure of tests/init.lua
+            self.assertEqual([name for name in requests
+                              if name != "queue.put_many"],
+                             ["queue.put"] * 6)
+        self.assertEqual(self.target.statistics()['tasks']['ready'], '6')
+        self.tube.truncate()
+        self.target.truncate()
+
+    def test_03_BadPriority(self):
+        self.tube.put(1, pri="high")
+        with self.assertRaises(ValueError):
+            export_tube(self.tube, os.path.join(self.path, 'bad.dump'))
+        self.tube.truncate()
+
+
+class TestSuite_18_Offload(TestSuite_Basic):
+    @classmethod
+    def setUpClass(cls):
+        cls.queue = Queue("127.0.0.1", 33013, 0)
+        cls.tube = cls.queue.tube("tube.offload")
+        cls.path = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.path)
+        super(TestSuite_18_Offload, cls).tearDownClass()
+
+    def test_00_Offload(self):
+        self.tube.offload(FileBlobStore(self.path), threshold=100)
+        try:
+            self.tube.put("small")
+            self.tube.put("large" * 100)
+            self.assertEqual(len(os.listdir(self.path)), 1)
+            small = self.tube.take(1)
+            large = self.tube.take(1)
+            self.assertEqual(small.data, "small")
+            self.assertTrue(len(large.raw_data) < 100)
+            self.assertEqual(large.data, "large" * 100)
+            small.ack()
+            large.ack()
+            self.assertEqual(os.listdir(self.path), [])
+        finally:
+            self.tube.offload(None)
+
+    def test_01_NoStoreOnConsumer(self):
+        self.tube.offload(FileBlobStore(self.path), threshold=0)
+        self.tube.put("task")
+        self.tube.offload(None)
+        task = self.tube.take(1)
+        with self.assertRaises(Queue.BadConfigException):
+            task.data
+        task.release()
+        self.tube.truncate()
+
+    def test_02_NoLeaks(self):
+        path = os.path.join(self.path, 'leaks')
+        store = FileBlobStore(path)
+        self.tube.offload(store, threshold=0)
+        calls = self.queue.tnt.call
+
+        def call(name, args):
+            raise Queue.DataBaseError(1, "put failed")
+        try:
+            self.queue.tnt.call = call
+            try:
+                with self.assertRaises(Queue.DataBaseError):
+                    self.tube.put("task")
+                with self.assertRaises(Queue.DataBaseError):
+                    self.tube.put_many(["task"] * 3)
+            finally:
+                del self.queue.tnt.call
+            self.assertEqual(os.listdir(path), [])
+            self.tube.put_unique("task")
+            self.assertEqual(os.listdir(path), [])
+            self.tube.put_many(["task"] * 3)
+            self.assertEqual(len(os.listdir(path)), 3)
+            self.tube.truncate()
+            self.assertEqual(os.listdir(path), [])
+            self.tube.put("task")
+            self.assertEqual(store.expire(3600), 0)
+            self.assertEqual(store.expire(-1), 1)
+            self.assertEqual(os.listdir(path), [])
+        finally:
+            self.tube.offload(None)
+        self.tube.truncate()
+
+
+class TestSuite_19_Pipeline(TestSuite_Basic):
+    @classmethod
+    def setUpClass(cls):
+        cls.queue = Queue("127.0.0.1", 33013, 0)
+        cls.tube = cls.queue.tube("tube.raw")
+
+    def test_00_PutMany(self):
+        tasks = self.tube.put_many([1, 2, 3], pri=1)
+        self.assertEqual([task.data for task in tasks], [1, 2, 3])
+        self.tube.truncate()
+
+    def test_01_RunOnce(self):
+        pipeline = Pipeline(self.queue)
+        pipeline.stage('split', 'tube.raw', lambda data: data.split(),
+                       outputs=['tube.words'], many=True, timeout=0)
+        pipeline.stage('upper', 'tube.words', lambda data: data.upper(),
+                       outputs=['tube.upper', 'tube.copy'], timeout=0)
+        self.tube.put("spam egg spam")
+        # split takes 1 task, then upper takes 3 words
+        self.assertEqual(pipeline.run_once(), 4)
+        self.assertEqual(pipeline.run_once(), 0)
+        metrics = pipeline.metrics()
+        self.assertEqual(metrics['split']['forwarded'], 3)
+        self.assertEqual(metrics['upper']['processed'], 3)
+        self.assertEqual(metrics['upper']['forwarded'], 6)
+        self.assertEqual(metrics['upper']['backlog'], 0)
+        tasks = self.queue.tube('tube.upper').take_many(10)
+        self.assertEqual(sorted(task.data for task in tasks),
+                         ['EGG', 'SPAM', 'SPAM'])
+        for task in tasks:
+            task.ack()
+        self.queue.tube('tube.copy').truncate()
+
+    def test_02_FailedHandler(self):
+        pipeline = Pipeline(self.queue)
+        stage = pipeline.stage('fail', 'tube.raw', lambda data: 1 / data,
+                               outputs=['tube.inverse'], timeout=0)
+        self.tube.retry_policy = RetryPolicy(max_attempts=1)
+        try:
+            self.tube.put(0)
+            self.tube.put(2)
+            pipeline.start()
+            time.sleep(0.1)
+            pipeline.stop()
+        finally:
+            self.tube.retry_policy = None
+        self.assertEqual(stage.failed, 1)
+        self.assertEqual(stage.processed, 1)
+        self.assertEqual(self.tube.statistics()['tasks']['buried'], '1')
+        self.assertEqual(self.queue.tube('tube.inverse').take(1).data, 0.5)
+        self.tube.truncate()
+        self.queue.tube('tube.inverse').truncate()
+
+    def test_03_FailedOutput(self):
+        pipeline = Pipeline(self.queue)
+        stage = pipeline.stage('split', 'tube.raw', lambda data: data.split(),
+                               outputs=['tube.left', 'tube.right'],
+                               many=True, timeout=0)
+        self.assertIsInstance(stage, Stage)
+        left = self.queue.tube('tube.left')
+        right = self.queue.tube('tube.right')
+        self.tube.put("spam egg")
+
+        def serialize(data):
+            raise ValueError(data)
+        right.serialize = serialize
+        try:
+            with self.assertRaises(ValueError):
+                pipeline.run_once()
+        finally:
+            right.serialize = None
+        self.assertEqual(self.tube.statistics()['tasks']['ready'], '1')
+        self.assertEqual(pipeline.run_once(), 1)
+        for tube in (left, right):
+            tasks = tube.take_many(10)
+            self.assertEqual(sorted(task.data for task in tasks),
+                             ['egg', 'spam'])
+            for task in tasks:
+                task.ack()
+        self.assertEqual(pipeline.metrics()['split']['forwarded'], 2)
+
+
+class TestSuite_20_RPC(TestSuite_Basic):
+    @classmethod
+    def setUpClass(cls):
+        cls.queue = Queue("127.0.0.1", 33013, 0)
+        cls.tube = cls.queue.tube("tube.rpc")
+
+    def test_00_Call(self):
+        client = RpcClient(self.queue, "tube.rpc", poll=0.05)
+        server = RpcServer(self.tube, lambda data: 10 / data)
+        try:
+            futures = [client.call(i) for i in (1, 2, 5, 0)]
+            self.assertEqual(client.in_flight, 4)
+            while server.serve(0):
+                pass
+            self.assertEqual([f.result(1) for f in futures[:3]],
+                             [10, 5, 2])
+            self.assertTrue(isinstance(futures[3].exception(1),
+                                       RemoteException))
+            self.assertEqual(client.in_flight, 0)
+        finally:
+            client.close()
+
+    def test_01_Timeout(self):
+        client = RpcClient(self.queue, "tube.rpc", poll=0.05)
+        try:
+            future = client.call(1, timeout=0.1)
+            self.assertRaises(future.TimeoutException, future.result, 1)
+            self.assertEqual(client.in_flight, 0)
+        finally:
+            client.close()
+        self.tube.truncate()
+
+    def test_02_ListenerSettings(self):
+        path = tempfile.mkdtemp()
+        client = RpcClient(self.queue, "tube.rpc", poll=0.05)
+        reply_tube = self.queue.tube(client.reply_tube)
+        reply_tube.offload(FileBlobStore(path), threshold=0)
+        server = RpcServer(self.tube, lambda data: data * 2)
+        self.queue.tracer = Tracer()
+        try:
+            future = client.call("spam")
+            self.assertTrue(server.serve(1))
+            self.assertEqual(future.result(1), "spamspam")
+            self.assertIs(client._listener.queue.tracer, self.queue.tracer)
+        finally:
+            self.queue.tracer = None
+            client.close()
+            shutil.rmtree(path)
+        native = NQueue("127.0.0.1", 3301, user="user", password="secret")
+        native.tube("tube", ttr=5)
+        clone = native.clone()
+        self.assertIsInstance(clone, NQueue)
+        self.assertEqual((clone.user, clone.password), ("user", "secret"))
+        self.assertEqual(clone.tube("tube").opt['ttr'], 5)
+        self.assertIsNot(clone.tube("tube"), native.tube("tube"))
+
+
+class NativeFake(object):
+    """
+    Tarantool 1.6+ queue with fifottl tubes, in memory.
+    """
+    calls = []
+
+    class Response(list):
+        @property
+        def rowcount(self):
+            return len(self)
+
+    def __init__(self, host, port, user=None, password=None):
+        self.tubes = {}
+        self.next_id = 0
+
+    def call(self, name, args):
+        NativeFake.calls.append((name, args))
+        if name == "queue.statistics":
+            stat = {}
+            for tube, tasks in self.tubes.items():
+                counts = {'ready': 0, 'taken': 0, 'buried': 0}
+                for task in tasks.values():
+                    key = {'r': 'ready', 't': 'taken', '!': 'buried'}
+                    counts[key[task[1]]] += 1
+                stat[tube] = {'tasks': counts, 'calls': {'put': len(tasks)}}
+            return self.Response([stat[args[0]] if args else stat])
+        tube, method = name[len("queue.tube."):].split(':')
+        tasks = self.tubes.setdefault(tube, {})
+        if method == 'put':
+            task_id = self.next_id
+            self.next_id += 1
+            options = args[1]
+            tasks[task_id] = [task_id, 'r', args[0], options['pri'],
+                              options.get('ttl', 3600) * 1000000,
+                              options.get('ttr', 60) * 1000000,
+                              time.time() * 1000000]
+            return self.Response([tuple(tasks[task_id][:3])])
+        if method == 'take':
+            ready = sorted((task[3], task[0]) for task in tasks.values()
+                           if task[1] == 'r')
+            if not ready:
+                return self.Response([])
+            task = tasks[ready[0][1]]
+            task[1] = 't'
+            return self.Response([tuple(task[:3])])
+        if method == 'kick':
+            buried = sorted(task_id for task_id, task in tasks.items()
+                            if task[1] == '!')[:args[0]]
+            for task_id in buried:
+                tasks[task_id][1] = 'r'
+            return self.Response([(len(buried),)])
+        task = tasks.get(args[0])
+        if task is None:
+            return self.Response([])
+        if method in ('ack', 'delete'):
+            del tasks[args[0]]
+            return self.Response([(task[0], '-', task[2])])
+        if method == 'release':
+            task[1] = 'r'
+        elif method == 'bury':
+            task[1] = '!'
+        return self.Response([tuple(task[:3])])
+
+    def select(self, space, key):
+        task = self.tubes.get(space, {}).get(key)
+        if task is None:
+            return self.Response([])
+        task_id, status, data, pri, ttl, ttr, created = task
+        return self.Response([(task_id, status, 0, ttl, ttr, pri, created,
+                               data)])
+
+
+class TestSuite_21_NativeQueue(unittest.TestCase):
+    def setUp(self):
+        self.queue = NQueue("127.0.0.1", 3301)
+        self.queue.tarantool_connection = NativeFake
+        self.tube = self.queue.tube("tube", ttl=10)
+
+    def test_00_NativeArguments(self):
+        task = self.tube.put({'id': 1}, pri=2)
+        self.assertEqual(task.task_id, ('tube', 0))
+        self.assertEqual(task.status, 'ready')
+        self.assertEqual(NativeFake.calls[-1],
+                         ("queue.tube.tube:put",
+                          ({'id': 1}, {'delay': 0, 'ttl': 10, 'pri': 2})))
+        self.tube.urgent(1)
+        self.assertEqual(NativeFake.calls[-1][1][1]['pri'], 0)
+        self.tube.take().release(delay=5, ttl=20)
+        self.assertEqual(NativeFake.calls[-1],
+                         ("queue.tube.tube:release",
+                          (1, {'delay': 5, 'ttl': 20})))
+        with self.assertRaises(Queue.BadConfigException):
+            self.queue.tube("tube.dotted")
+
+    def test_01_TakeAckRelease(self):
+        self.tube.put({'id': 1}, pri=2)
+        self.tube.urgent([1, 2])
+        task = self.tube.take()
+        self.assertEqual(task.data, [1, 2])
+        self.assertTrue(task.release())
+        task = self.tube.take()
+        self.assertEqual(task.data, [1, 2])
+        self.assertTrue(task.ack())
+        task = self.tube.take()
+        self.assertEqual(task.data, {'id': 1})
+        self.assertEqual(self.tube.take(), None)
+        self.assertTrue(task.ack())
+
+    def test_02_Statistics(self):
+        self.tube.put({'id': 1})
+        task = self.tube.take()
+        stat = self.tube.statistics()
+        self.assertEqual(stat['tasks']['taken'], 1)
+        self.assertTrue('tube' in self.queue.statistics())
+        self.assertTrue(task.ack())
+
+    def test_03_Envelope(self):
+        tube = self.queue.tube("traced")
+        self.queue.tracer = Tracer()
+        try:
+            tube.put({'id': 2})
+            task = tube.take()
+        finally:
+            self.queue.tracer = None
+        self.assertEqual(task.data, {'id': 2})
+        self.assertTrue('ts' in task.envelope)
+        self.assertTrue(task.ack())
+
+    def test_04_RequeueDigMeta(self):
+        self.tube.put({'id': 1})
+        self.tube.put({'id': 2})
+        task = self.tube.take()
+        self.assertEqual(task.meta_cached,
+                         {'task_id': ('tube', 0), 'tube': 'tube',
+                          'status': 'taken'})
+        self.assertTrue(task.requeue())
+        task = self.tube.take()
+        self.assertEqual(task.data, {'id': 2})
+        self.assertTrue(task.bury())
+        self.assertTrue(task.dig())
+        self.assertFalse(task.dig())
+        self.assertEqual(sorted(t.data['id'] for t in
+                                self.tube.take_many(10)), [1, 2])
+        self.assertEqual(self.queue.meta_many([('tube', 9)]), [None])
+        with self.assertRaises(Queue.BadConfigException):
+            DeadLetters(self.tube)
+
+    def test_06_CopyKeepsOptions(self):
+        self.tube.put({'id': 1}, pri=3, ttr=30)
+        task = self.tube.take()
+        with self.assertRaises(Queue.BadConfigException):
+            task.done({'id': 2})
+        self.assertTrue(task.requeue())
+        name, (data, options) = NativeFake.calls[-2]
+        self.assertEqual(name, "queue.tube.tube:put")
+        self.assertEqual(options['pri'], 3)
+        self.assertEqual(options['ttr'], 30)
+        self.assertTrue(1 <= options['ttl'] <= 10)
+        self.assertTrue(self.tube.take().ack())
+
+    def test_07_OldDriver(self):
+        class OldConnection(object):
+            def __init__(self, host, port, schema=None):
+                pass
+
+            def call(self, name, args):
+                pass
+
+        queue = NQueue("127.0.0.1", 3301)
+        queue.tarantool_connection = OldConnection
+        with self.assertRaises(Queue.BadConfigException):
+            queue.tnt
+
+    def test_05_Retry(self):
+        self.tube.retry_policy = RetryPolicy(max_attempts=2, base=0)
+        self.tube.put({'id': 1})
+        self.assertTrue(self.tube.take().retry())
+        task = self.tube.take()
+        self.assertEqual(task.envelope['attempt'], 1)
+        self.assertEqual(task.data, {'id': 1})
+        self.assertFalse(task.retry())
+        self.assertEqual(self.tube.statistics()['tasks']['buried'], 1)
+
+
+class BoxQueueFake(object):
+    """
+    Connection, that records calls and answers with one task.
+    """
+    calls = []
+    # defined batch procedures
+    procs = set()
+
+    class Response(list):
+        return_code = 0
+
+        @property
+        def rowcount(self):
+            return len(self)
+
+    def __init__(self, host, port, schema=None):
+        pass
+
+    def call(self, name, args):
+        BoxQueueFake.calls.append((name, args))
+        if name.endswith("_many"):
+            if name not in BoxQueueFake.procs:
+                raise tarantool.DatabaseError(
+                    50, "Procedure '%s' is not defined" % name)
+            if name == "box.queue.ack_many":
+                return self.Response([(task_id,) for task_id in args[1:]])
+            return self.Response([(struct.pack("<q", i),)
+                                  for i in range(len(args) - 8)])
+        if name == "box.queue.stats":
+            return self.Response([("space0.tube.put", "1",
+                                   "space0.tube.tasks.ready", "1")])
+        if name == "box.queue.put":
+            return self.Response([(struct.pack("<q", 1),)])
+        return self.Response([(struct.pack("<q", 1), "", "", "", "tube",
+                               "", "", "", msgpack.packb([1, 2]))])
+
+
+class TestSuite_22_TQueue(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.queue = TQueue("127.0.0.1", 33013, 0)
+        cls.queue.tarantool_connection = BoxQueueFake
+        cls.tube = cls.queue.tube("tube", ttr=60)
+
+    def test_00_PutMany(self):
+        self.assertEqual(self.tube.put_many([1, 2]), [1, 1])
+        self.assertEqual(BoxQueueFake.calls[-1],
+                         ("box.queue.put", ("0", "tube", "500000", "32767",
+                                            "0", "60", "0", "5",
+                                            msgpack.packb(2))))
+
+    def test_01_TakeRelease(self):
+        task = self.tube.take()
+        self.assertEqual(task.task_id, 1)
+        self.assertEqual(task.data, [1, 2])
+        task.release(delay=10)
+        self.assertEqual(BoxQueueFake.calls[-1],
+                         ("box.queue.release",
+                          ("0", "1", "32767", "10", "60", "0", "5")))
+        task = self.tube.take()
+        # analog for del task; gc.gc()
+        task.__del__()
+        self.assertEqual(BoxQueueFake.calls[-1],
+                         ("box.queue.release", ("0", "1")))
+
+    def test_02_BatchAndControl(self):
+        tasks = self.tube.take_many(2)
+        self.assertEqual(self.queue.ack_many(tasks), [True, True])
+        self.assertTrue(self.queue.peek(1).bury())
+        self.assertTrue(self.queue.peek(1).touch())
+        self.assertEqual(self.tube.statistics(),
+                         {'put': '1', 'tasks': {'ready': '1'}})
+
+    def test_03_BatchProcedures(self):
+        BoxQueueFake.procs.update(["box.queue.put_many",
+                                   "box.queue.ack_many"])
+        queue = TQueue("127.0.0.1", 33013, 0)
+        queue.tarantool_connection = BoxQueueFake
+        tube = queue.tube("tube", ttr=60)
+        try:
+            del BoxQueueFake.calls[:]
+            self.assertEqual(tube.put_many([1, 2]), [0, 1])
+            tasks = tube.take_many(2)
+            self.assertEqual(queue.ack_many(tasks), [True, True])
+            self.assertEqual([call[0] for call in BoxQueueFake.calls],
+                             ["box.queue.put_many", "box.queue.take",
+                              "box.queue.take", "box.queue.ack_many"])
+        finally:
+            BoxQueueFake.procs.clear()
+
+    def test_04_RetryAndRequeue(self):
+        task = self.tube.take(meta=True)
+        self.assertEqual(task.meta_cached, {'task_id': 1, 'tube': 'tube'})
+        self.assertTrue(task.retry())
+        put, ack = BoxQueueFake.calls[-2:]
+        self.assertEqual(put[1][:8], ("0", "tube", "500000", "32767",
+                                      "1", "60", "0", "5"))
+        self.assertEqual(ack, ("box.queue.ack", ("0", "1")))
+        self.assertTrue(self.tube.take().requeue())
+        self.assertEqual([call[0] for call in BoxQueueFake.calls[-3:]],
+                         ["box.queue.peek", "box.queue.put",
+                          "box.queue.delete"])
+        with self.assertRaises(TQueue.BadConfigException):
+            self.tube.truncate()
+
+
+class TestSuite_23_MultiQueue(unittest.TestCase):
+    def test_00_SharedConnection(self):
+        multi = MultiQueue("127.0.0.1", 33013)
+        first, second = multi.space(0), multi.space(1)
+        self.assertTrue(multi.space(0) is first)
+        self.assertTrue(first.tnt is second.tnt)
+        first.tube("tube.multi").put(1)
+        second.tube("tube.multi").put(2)
+        try:
+            stats = multi.statistics()
+            self.assertEqual(stats[1]['tube.multi']['tasks']['ready'], '1')
+            self.assertEqual(stats[0]['tube.multi'],
+                             first.statistics('tube.multi'))
+            self.assertTrue(multi.statistics(1, max_age=60) is stats[1])
+        finally:
+            first.tube("tube.multi").truncate()
+            second.tube("tube.multi").truncate()
+
+    def test_01_QueueClass(self):
+        multi = MultiQueue("127.0.0.1", 33013, queue_class=TQueue)
+        self.assertTrue(isinstance(multi.space(1), TQueue))
+        self.assertEqual(multi.space(1).space, 1)
+        multi._owner.tarantool_connection = BoxQueueFake
+        self.assertEqual(multi.statistics(),
+                         {0: {'tube': {'put': '1',
+                                       'tasks': {'ready': '1'}}}})
+        self.assertEqual(BoxQueueFake.calls[-1], ("box.queue.stats", ("0",)))
+        with self.assertRaises(Queue.BadConfigException):
+            MultiQueue("127.0.0.1", 33013, queue_class=NQueue)
+
+
+class TestSuite_24_TubeRegistry(unittest.TestCase):
+    def test_00_Bounded(self):
+        queue = Queue("127.0.0.1", 33013, 0)
+        queue.tubes.maxsize = 100
+        held = queue.tube("customer.held")
+        configured = queue.tube("customer.configured", ttl=10)
+        queue.tube("customer.serialized").serialize = str
+        for i in range(3000):
+            queue.tube("customer.%d" % i)
+        self.assertTrue(len(queue.tubes) <= 103)
+        self.assertTrue(queue.tube("customer.held") is held)
+        self.assertTrue(queue.tube("customer.configured") is configured)
+        self.assertEqual(queue.tube("customer.serialized").serialize, str)
+        self.assertTrue("customer.2999" in queue.tubes)
+        self.assertFalse("customer.0" in queue.tubes)
+
+
+class TestSuite_25_ConnectionPool(unittest.TestCase):
+    def test_00_ConcurrentTakes(self):
+        class Pool(ConnectionPool):
+            size = 1
+        queue = Queue("127.0.0.1", 33013, 0)
+        queue.tarantool_connection = Pool
+        tube = queue.tube("tube.pool")
+        results = []
+
+        def take():
+            task = tube.take(0.5)
+            if task is not None:
+                # on the connection, that took the task
+                task.ack()
+            results.append(task)
+        threads = [threading.Thread(target=take) for _ in range(3)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        # takes don't hold the shared connection
+        tube.put(1)
+        self.assertTrue(time.time() - start < 0.4)
+        for thread in threads:
+            thread.join()
+        # long-polls ran on their own connections at once
+        self.assertTrue(time.time() - start < 0.9)
+        self.assertEqual(sorted(task.data for task in results
+                                if task is not None), [1])
+        self.assertEqual(results.count(None), 2)
+        self.assertEqual(queue.tnt._idle.qsize(), 1)
+        tasks = tube.statistics()['tasks']
+        self.assertEqual((tasks['ready'], tasks['taken']), ('0', '0'))
+
+
+class TestSuite_26_AdaptiveTake(TestSuite_Basic):
+    @classmethod
+    def setUpClass(cls):
+        cls.queue = Queue("127.0.0.1", 33013, 0)
+        cls.tube = cls.queue.tube("tube.adaptive")
+
+    def test_00_BackoffAndSnapBack(self):
+        policy = AdaptiveTake(self.tube, min_timeout=0.01, max_timeout=0.04,
+                              window=4, stats_interval=None)
+        for _ in range(3):
+            self.assertEqual(policy.take(), None)
+        self.assertEqual(policy.timeout, 0.04)
+        for i in range(4):
+            self.tube.put(i)
+        for i in range(4):
+            policy.take().ack()
+        self.assertEqual(policy.timeout, 0.01)
+        stats = policy.stats()
+        self.assertEqual((stats['taken'], stats['empty']), (4, 3))
+        self.assertEqual(stats['empty_rate'], 0.0)
+
+
+class TestSuite_27_Consumer(TestSuite_Basic):
+    @classmethod
+    def setUpClass(cls):
+        cls.queue = Queue("127.0.0.1", 33013, 0)
+        cls.tube = cls.queue.tube("tube.consumer")
+
+    class IdleTake(object):
+        def take(self):
+            time.sleep(0.01)
+            return None
+
+    def test_00_Autoscale(self):
+        consumer = Consumer(self.tube, None, max_workers=4, target_delay=1,
+                            cooldown=0, interval=3600, take=self.IdleTake())
+        # depth, latency and CPU are set by the test
+        consumer._sample_depth = lambda: consumer.depth
+        consumer._sample_cpu = lambda: consumer.cpu
+        consumer.start()
+        try:
+            consumer.depth = 10
+            # latency is unknown, one more worker
+            self.assertEqual(consumer.scale(), 2)
+            consumer.latency = 1
+            consumer.cpu = 0.9
+            self.assertEqual(consumer.scale(), 2)
+            consumer.cpu = 0.1
+            self.assertEqual(consumer.scale(), 4)
+            consumer.depth = 0
+            self.assertEqual(consumer.scale(), 3)
+            consumer.depth = 10
+            self.assertEqual(consumer.scale(), 4)
+            consumer.cooldown = 60
+            consumer.depth = 0
+            self.assertEqual(consumer.scale(), 4)
+            names = [thread.name for thread in consumer._threads]
+            self.assertEqual(len(set(names)), len(names))
+        finally:
+            consumer.stop()
+
+    def test_01_Process(self):
+        def handler(data):
+            if data % 2:
+                raise ValueError(data)
+        self.tube.retry_policy = RetryPolicy(max_attempts=1)
+        consumer = Consumer(self.tube, handler, min_workers=2, interval=3600)
+        self.tube.put_many(range(10))
+        consumer.start()
+        try:
+            deadline = time.time() + 5
+            while (consumer.processed + consumer.failed < 10 and
+                   time.time() < deadline):
+                time.sleep(0.05)
+        finally:
+            consumer.stop()
+            self.tube.retry_policy = None
+        self.assertEqual((consumer.processed, consumer.failed), (5, 5))
+        self.assertEqual(self.tube.statistics()['tasks']['buried'], '5')
+        self.tube.truncate()
+
+    def test_02_RetryOnTQueue(self):
+        queue = TQueue("127.0.0.1", 33013, 0)
+        queue.tarantool_connection = BoxQueueFake
+        tube = queue.tube("tube")
+
+        def handler(data):
+            raise ValueError(data)
+        consumer = Consumer(tube, handler)
+        consumer._process(tube.take())
+        self.assertEqual(consumer.failed, 1)
+        self.assertEqual(BoxQueueFake.calls[-1][0], "box.queue.ack")
+
+
+class TestSuite_28_ConsumerBudget(TestSuite_Basic):
+    @classmethod
+    def setUpClass(cls):
+        cls.queue = Queue("127.0.0.1", 33013, 0)
+        cls.tube = cls.queue.tube("tube.budget")
+
+    def run_consumer(self, payloads=None, workers=4, **kwargs):
+        if payloads is None:
+            payloads = ["x" * 1000] * 6
+        release = threading.Event()
+        consumer = Consumer(self.tube, lambda data: release.wait(5),
+                            min_workers=workers, max_workers=workers,
+                            interval=3600, **kwargs)
+        self.tube.put_many(payloads)
+        consumer.start()
+        try:
+            time.sleep(0.3)
+            metrics = consumer.metrics()
+            release.set()
+            deadline = time.time() + 5
+            while (consumer.processed < len(payloads) and
+                   time.time() < deadline):
+                time.sleep(0.05)
+        finally:
+            release.set()
+            consumer.stop()
+        self.assertEqual(consumer.processed, len(payloads))
+        self.assertEqual(consumer.in_flight_bytes, 0)
+        return metrics
+
+    def test_00_MaxBytes(self):
+        size = len(msgpack.packb("x" * 1000))
+        max_bytes = int(size * 2.5)
+        metrics = self.run_consumer(max_bytes=max_bytes)
+        self.assertEqual(metrics['in_flight'], 2)
+        self.assertTrue(metrics['in_flight_bytes'] <= max_bytes)
+        # a task larger than the budget is taken alone
+        metrics = self.run_consumer(max_bytes=size // 2)
+        self.assertEqual(metrics['in_flight'], 1)
+
+    def test_01_MixedSizes(self):
+        small = len(msgpack.packb("x" * 100))
+        large = len(msgpack.packb("x" * 3000))
+        max_bytes = small * 5
+        # the large task is taken, because the average size fits
+        metrics = self.run_consumer(["x" * 100, "x" * 3000, "x" * 3000],
+                                    workers=2, max_bytes=max_bytes)
+        self.assertEqual(metrics['in_flight'], 2)
+        self.assertEqual(metrics['in_flight_bytes'], small + large)
+        self.assertTrue(metrics['in_flight_bytes'] > max_bytes)
+
+    def test_02_MaxTasks(self):
+        metrics = self.run_consumer(max_tasks=2)
+        self.assertEqual(metrics['in_flight'], 2)
+        with self.assertRaises(ValueError):
+            Consumer(self.tube, None, max_tasks=0)